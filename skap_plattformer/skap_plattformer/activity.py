@@ -0,0 +1,115 @@
+# Keeps the physics items that nobody sees from costing anything.
+# Pymunk puts items to sleep when they have been still for ITEM_SLEEP_TIME: a sleeping
+# body is not moved, not collided and not solved, until something awake touches it.
+#
+# Items far outside the view of every player are frozen: their body and shape are
+# taken out of the pymunk space, also when they are still moving, and put back with
+# the same position and speed when a player comes near again. Forcing them asleep
+# instead (Body.sleep()) made Chipmunk crash in crowded levels. An item
+# flying off stays awake until it leaves the margin, so it can still hit the items
+# in the margin, and those only freeze when they are outside it too.
+#
+# The sprites of the frozen and sleeping items aren't moved to their bodies, and which
+# items are near a player is only checked every ITEM_ACTIVITY_INTERVAL steps. So a level
+# full of items costs about the same as an empty one, as long as they aren't all on screen.
+#
+# The area is the view of a window of the default size, also without a window and
+# when the window is resized, so a replay plays out the same everywhere.
+
+import math, numpy
+from constants import *
+
+# Seconds an item has to be still before it falls asleep
+ITEM_SLEEP_TIME = 0.5
+# Pixels around the view in which items keep moving
+ITEM_ACTIVE_MARGIN = 256
+# Steps between checks of which items are near a player
+ITEM_ACTIVITY_INTERVAL = 10
+
+
+def view_area(x, y, width=SCREEN_WIDTH, height=SCREEN_HEIGHT):
+    """ Left, bottom, right and top of what the player camera sees with the player at x, y.
+    Same as MyGame.center_camera_on_player() """
+    left = max(x - width / 2, 0)
+    bottom = max(y - height / 2, 0)
+    return left, bottom, left + width, bottom + height
+
+
+def sync_sprites(sprites, physics_objects):
+    """ Move the sprites to their bodies, like PymunkPhysicsEngine.resync_sprites() does for every sprite """
+    for sprite, physics_object in zip(sprites, physics_objects):
+        body = physics_object.body
+        if body.is_sleeping:
+            continue
+        sprite.position = body.position
+        sprite.angle = math.degrees(body.angle)
+
+
+class ItemActivity:
+    """ Freezes the items far from every player, and puts them back when a player comes near """
+
+    def __init__(self, engine, items, margin=ITEM_ACTIVE_MARGIN):
+        # The engine gets a new space when a snapshot is restored (see snapshot.py)
+        self.engine = engine
+        self.sprites = list(items)
+        # The bodies are swapped when a snapshot is restored, the physics objects stay
+        self.physics_objects = [engine.get_physics_object(item) for item in self.sprites]
+        self.margin = margin
+
+        # Position of every item as of the last check. Frozen and sleeping items don't move.
+        self.positions = numpy.zeros((len(self.sprites), 2))
+        # Items taken out of the space
+        self.frozen = numpy.zeros(len(self.sprites), numpy.bool_)
+        # Items in the space, their sprites are synced every step
+        self.active_sprites = []
+        self.active_objects = []
+        self.reset()
+
+    def __len__(self):
+        return len(self.sprites)
+
+    def reset(self):
+        """ Every item counts as in the space until the next check. For a fresh or restored level """
+        self.frozen[:] = False
+        for index, physics_object in enumerate(self.physics_objects):
+            self.positions[index] = physics_object.body.position
+        self.active_sprites = list(self.sprites)
+        self.active_objects = list(self.physics_objects)
+
+    def sync(self):
+        """ Move the sprites of the items in the space to their bodies. Call after every physics step """
+        sync_sprites(self.active_sprites, self.active_objects)
+
+    def update(self, areas):
+        """ Freeze the items outside all the areas (plus the margin), and put back the frozen ones inside one """
+        if not self.sprites:
+            return
+        # Only the items in the space can have moved since the last check
+        for index in numpy.flatnonzero(~self.frozen):
+            body = self.physics_objects[index].body
+            if not body.is_sleeping:
+                self.positions[index] = body.position
+
+        margin = self.margin
+        x = self.positions[:, 0]
+        y = self.positions[:, 1]
+        inside = numpy.zeros(len(self.sprites), numpy.bool_)
+        for left, bottom, right, top in areas:
+            inside |= (x > left - margin) & (x < right + margin) & (y > bottom - margin) & (y < top + margin)
+
+        space = self.engine.space
+        freeze = numpy.flatnonzero(~self.frozen & ~inside)
+        if len(freeze):
+            objects = [self.physics_objects[index] for index in freeze]
+            space.remove(*(physics_object.shape for physics_object in objects),
+                         *(physics_object.body for physics_object in objects))
+        thaw = numpy.flatnonzero(self.frozen & inside)
+        if len(thaw):
+            objects = [self.physics_objects[index] for index in thaw]
+            space.add(*(physics_object.body for physics_object in objects),
+                      *(physics_object.shape for physics_object in objects))
+        if len(freeze) or len(thaw):
+            self.frozen = ~inside
+            active = numpy.flatnonzero(inside)
+            self.active_sprites = [self.sprites[index] for index in active]
+            self.active_objects = [self.physics_objects[index] for index in active]
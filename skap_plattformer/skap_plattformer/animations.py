@@ -0,0 +1,263 @@
+# Animation frames for the player and the items.
+# Every frame is decoded once and stored in one raw RGBA file on disk, so later runs
+# don't open a single PNG. The game window then packs all the frames into the GPU
+# texture atlas at startup. After that, switching frames is just picking a texture
+# from a list: no file access and no image decoding.
+
+import arcade, bisect, glob, hashlib, json, mmap, os, re, struct
+from PIL import Image
+from constants import *
+
+ANIMATION_CACHE = "skap_plattformer/assets/.cache/animations.bin"
+
+# Sprite sheets with frames side by side: clip name -> (file, frame width)
+SPRITE_SHEETS = {
+    "jump_right": ("skap_plattformer/assets/player/jump_right_sprite_sheet.png", 35),
+}
+
+# Folders with one file per frame. Files named like alienBlue_walk1.png and alienBlue_walk2.png
+# become the frames of the clip "<prefix>walk", sorted by the number at the end.
+FRAME_FOLDERS = {
+    "": ["skap_plattformer/assets/items", "skap_plattformer/assets/images/Items"],
+}
+for colour in ("Beige", "Blue", "Green", "Pink", "Yellow"):
+    FRAME_FOLDERS[f"{colour.lower()}_"] = [f"skap_plattformer/assets/images/Players/128x256/{colour}"]
+    FRAME_FOLDERS[f"variable_{colour.lower()}_"] = [f"skap_plattformer/assets/images/Players/Variable sizes/{colour}"]
+
+# File format. All numbers are little endian.
+#   header:  magic, version, sha1 of the source file list, length of the index
+#   index:   JSON, clip name -> [[offset, width, height], ...] into the pixel block
+#   pixels:  raw RGBA pixels of every frame
+CACHE_MAGIC = b"SKAN"
+CACHE_VERSION = 1
+HEADER_FORMAT = struct.Struct("<4sH20sI")
+
+
+def find_sources():
+    """ Every file the animations are made from, and the clip and frame number it becomes """
+    sources = []
+    for name, (file_name, frame_width) in SPRITE_SHEETS.items():
+        sources.append((name, path(file_name), frame_width))
+
+    for prefix, folders in FRAME_FOLDERS.items():
+        for folder in folders:
+            for file_path in sorted(glob.glob(os.path.join(path(folder), "*.png"))):
+                # alienBlue_walk1 -> walk, coinGold -> coinGold, Leapy_Lime -> Leapy_Lime
+                stem = os.path.splitext(os.path.basename(file_path))[0]
+                if stem.startswith("alien"):
+                    stem = stem.split("_", 1)[1]
+                match = re.fullmatch(r"(.*?)(\d*)", stem)
+                sources.append((prefix + match.group(1), file_path, int(match.group(2) or 0)))
+    return sources
+
+
+def sources_hash(sources):
+    """ Changes whenever a source file is added, removed or changed """
+    digest = hashlib.sha1()
+    for name, file_path, extra in sources:
+        stat = os.stat(file_path)
+        digest.update(f"{name}|{file_path}|{extra}|{stat.st_size}|{stat.st_mtime_ns}\n".encode("utf-8"))
+    return digest.digest()
+
+
+def decode_frames(sources):
+    """ Open every source file and cut it into frames. Returns clip name -> list of RGBA images """
+    clips = {}
+    numbered = {}
+    for name, file_path, extra in sources:
+        image = Image.open(file_path).convert("RGBA")
+        if name in SPRITE_SHEETS:
+            frame_width = extra
+            clips[name] = [image.crop((left, 0, left + frame_width, image.height))
+                           for left in range(0, image.width, frame_width)]
+        else:
+            numbered.setdefault(name, []).append((extra, image))
+
+    for name, frames in numbered.items():
+        clips[name] = [image for number, image in sorted(frames, key=lambda frame: frame[0])]
+    return clips
+
+
+def write_cache(file_path, content_hash, clips):
+    index = {}
+    pixels = []
+    offset = 0
+    for name, frames in clips.items():
+        index[name] = []
+        for image in frames:
+            data = image.tobytes()
+            index[name].append([offset, image.width, image.height])
+            pixels.append(data)
+            offset += len(data)
+
+    index = json.dumps(index).encode("utf-8")
+    # read_cache() memory-maps the cache, also in other game processes, so it is written to a file
+    # of this process and swapped in, like the level cache (see level_cache.compile_level())
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    temporary_path = f"{file_path}.{os.getpid()}.tmp"
+    try:
+        with open(temporary_path, "wb") as file:
+            file.write(HEADER_FORMAT.pack(CACHE_MAGIC, CACHE_VERSION, content_hash, len(index)))
+            file.write(index)
+            file.write(b"".join(pixels))
+        os.replace(temporary_path, file_path)
+    except OSError:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+
+def read_cache(file_path, content_hash):
+    """ The frames stored in the cache, or None if the cache is missing or out of date """
+    if not os.path.exists(file_path):
+        return None
+
+    with open(file_path, "rb") as file:
+        if os.fstat(file.fileno()).st_size < HEADER_FORMAT.size:
+            return None
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+        magic, version, cached_hash, index_length = HEADER_FORMAT.unpack_from(data, 0)
+        if magic != CACHE_MAGIC or version != CACHE_VERSION or cached_hash != content_hash:
+            return None
+        start = HEADER_FORMAT.size
+        index = json.loads(bytes(data[start:start + index_length]))
+        start += index_length
+
+        clips = {}
+        for name, frames in index.items():
+            clips[name] = []
+            for offset, width, height in frames:
+                size = width * height * 4
+                pixels = data[start + offset:start + offset + size]
+                clips[name].append(Image.frombytes("RGBA", (width, height), pixels))
+        return clips
+    finally:
+        data.close()
+
+
+class AnimationLibrary:
+    """ All animation clips, addressed by clip name and frame index """
+
+    def __init__(self, clips):
+        # Clip name -> list of textures
+        self.clips = {}
+        for name, frames in clips.items():
+            self.clips[name] = [arcade.Texture(f"animation:{name}:{index}", image)
+                                for index, image in enumerate(frames)]
+
+    @classmethod
+    def load(cls, cache_file=None):
+        """ Load the frames from the disk cache, decoding the images and rewriting the cache if it is out of date """
+        cache_file = cache_file or path(ANIMATION_CACHE)
+        sources = find_sources()
+        content_hash = sources_hash(sources)
+
+        clips = read_cache(cache_file, content_hash)
+        if clips is None:
+            clips = decode_frames(sources)
+            write_cache(cache_file, content_hash, clips)
+        return cls(clips)
+
+    def get(self, name, index=0):
+        """ One frame of a clip """
+        return self.clips[name][index]
+
+    def clip(self, name):
+        """ All frames of a clip """
+        return self.clips[name]
+
+    def scaled_clip(self, name, height):
+        """ A clip with every frame resized to the given height. Stored as its own clip, so it ends up in the atlas too """
+        scaled_name = f"{name}@{height}"
+        if scaled_name not in self.clips:
+            frames = []
+            for index, texture in enumerate(self.clips[name]):
+                image = texture.image
+                if image.height != height:
+                    width = max(1, round(image.width * height / image.height))
+                    image = image.resize((width, height), Image.LANCZOS)
+                    texture = arcade.Texture(f"animation:{scaled_name}:{index}", image)
+                frames.append(texture)
+            self.clips[scaled_name] = frames
+        return self.clips[scaled_name]
+
+    def frame_count(self, name):
+        return len(self.clips[name])
+
+    def textures(self):
+        for frames in self.clips.values():
+            yield from frames
+
+
+class PlayerAnimator:
+    """ Picks the texture of every player from its state: standing, walking, jumping, climbing, swimming or ducking """
+
+    def __init__(self, library, clips=PLAYER_CLIPS, height=PLAYER_ANIMATION_HEIGHT):
+        self.clips = {state: library.scaled_clip(clip, height) for state, clip in clips.items()}
+
+        # bisect wants the thresholds from low to high
+        self.jump_velocities = sorted(JUMP_FRAME_VELOCITIES)
+        self.last_jump_frame = len(self.clips["jump"]) - 1
+
+        # State of every row of the player store, and the distance moved since it started
+        self.states = []
+        self.distances = []
+
+    def reset(self):
+        """ Every player starts its clip over, for a new level or a loaded state """
+        self.states = []
+        self.distances = []
+
+    def jump_frame(self, velocity_y):
+        """ The jump frame for a vertical speed, the same as checking the thresholds from the top down """
+        frame = len(self.jump_velocities) - bisect.bisect_left(self.jump_velocities, velocity_y)
+        return min(frame, self.last_jump_frame)
+
+    def update(self, game, delta_time):
+        players = game.players
+        # Players that joined since the last update
+        while len(self.states) < players.count:
+            self.states.append(None)
+            self.distances.append(0.0)
+
+        for index in range(players.count):
+            velocity_x, velocity_y = players.physics_objects[index].body.velocity
+
+            if players.on_ladder[index]:
+                state = "climb"
+            elif players.in_water[index]:
+                state = "swim"
+            elif not players.on_ground[index]:
+                state = "jump"
+            elif players.down[index] and not players.up[index]:
+                state = "duck"
+            elif abs(velocity_x) > WALK_MIN_SPEED:
+                state = "walk"
+            else:
+                state = "stand"
+
+            if state != self.states[index]:
+                self.states[index] = state
+                self.distances[index] = 0.0
+
+            if state == "jump":
+                frame = self.jump_frame(velocity_y)
+            elif state == "stand":
+                frame = STAND_FRAME
+            elif state == "duck":
+                frame = 0
+            else:
+                # Walk, climb and swim clips move on with the distance travelled
+                if state == "walk":
+                    speed, frame_distance = abs(velocity_x), WALK_FRAME_DISTANCE
+                elif state == "climb":
+                    speed, frame_distance = abs(velocity_y), CLIMB_FRAME_DISTANCE
+                else:
+                    speed, frame_distance = abs(velocity_x) + abs(velocity_y), SWIM_FRAME_DISTANCE
+                self.distances[index] += speed * delta_time
+                frame = int(self.distances[index] / frame_distance)
+
+            frames = self.clips[state]
+            players.sprites[index].texture = frames[frame % len(frames)]
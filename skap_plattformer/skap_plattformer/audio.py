@@ -0,0 +1,80 @@
+# Sound effects for the game window.
+# Sounds are decoded into memory once when they are loaded. They are played on a
+# fixed pool of voices (pyglet players) that are made once and used again, so
+# playing a sound never creates a player. Sounds asked for during one frame are
+# collected first, so ten coins picked up at once play the coin sound once.
+#
+# Sounds can be loaded and decoded on a loader thread (see startup.py), but the voices
+# are made and played on the main thread only: pyglet's players aren't thread-safe and
+# are driven by the main thread's clock.
+
+import arcade, pyglet
+from constants import *
+from log import log
+
+# Most sounds that can play at the same time. When all voices are busy, the one that started first is cut off.
+VOICE_COUNT = 8
+
+
+class AudioManager:
+    """ Preloaded sounds, played on a fixed pool of voices """
+
+    def __init__(self, voice_count=VOICE_COUNT):
+        self.voice_count = voice_count
+        # Made by the first flush(), on the main thread
+        self.voices = []
+        self.next_voice = 0
+
+        # Sounds asked for since the last flush(), in order, each once
+        self.pending = {}
+
+    def load(self, file_name):
+        """ Load and decode a sound. Returns None if it can't be loaded, which plays nothing """
+        try:
+            return arcade.load_sound(file_name, streaming=False)
+        except Exception as error:
+            log.warning("audio", "Could not load sound {}: {}", file_name, error)
+            return None
+
+    def play(self, sound, volume=1.0):
+        """ Play a sound at the next flush(). Asking for the same sound again before that does nothing """
+        if sound is None:
+            return
+        self.pending[sound] = max(volume, self.pending.get(sound, 0.0))
+
+    def flush(self):
+        """ Start the sounds of this frame. Called once per frame, on the main thread """
+        if not self.pending:
+            return
+        if not self.voices:
+            self.voices = [pyglet.media.Player() for _ in range(self.voice_count)]
+        for sound, volume in self.pending.items():
+            self.start_voice(sound, volume)
+        self.pending.clear()
+
+    def close(self):
+        """ Stop and delete the voices. Called on the main thread when the window closes """
+        for voice in self.voices:
+            voice.delete()
+        self.voices = []
+
+    def start_voice(self, sound, volume):
+        """ Play a sound on a free voice, or on the voice that has been playing the longest """
+        voice = None
+        for index in range(self.voice_count):
+            candidate = self.voices[(self.next_voice + index) % self.voice_count]
+            if not candidate.playing:
+                voice = candidate
+                break
+        if voice is None:
+            voice = self.voices[self.next_voice]
+        self.next_voice = (self.voices.index(voice) + 1) % self.voice_count
+
+        # Drop whatever the voice played before
+        voice.pause()
+        while voice.source is not None:
+            voice.next_source()
+
+        voice.queue(sound.source)
+        voice.volume = volume
+        voice.play()
@@ -0,0 +1,115 @@
+# Checks and benchmarks every level, without a window.
+# Each level is set up the same way the game does it, which checks that every layer
+# has a collision_type and every pick-up names a handler (see level.py). Then a few
+# scripted runs are played on it and timed. Levels are checked in parallel, one per
+# process, so adding levels doesn't make the check much slower.
+#
+# Check every level with:
+#     python check_levels.py
+
+import argparse, concurrent.futures, glob, os, sys, time, traceback
+from constants import *
+from level import LevelError
+from level_cache import LEVEL_FOLDER
+from log import log, WARNING
+from profiler import Profiler
+from replay import INPUT_LEFT, INPUT_RIGHT, INPUT_UP, Recording, Replayer
+from simulation import GameSimulation
+
+# Keys held on every step of the scripted runs
+SCRIPTS = {
+    "idle": lambda step: 0,
+    "run right": lambda step: INPUT_RIGHT | (INPUT_UP if step % 60 < 20 else 0),
+    "run left": lambda step: INPUT_LEFT | (INPUT_UP if step % 60 < 20 else 0),
+    "bunny hop": lambda step: (INPUT_RIGHT if step % 240 < 120 else INPUT_LEFT) | (INPUT_UP if step % 40 < 30 else 0),
+}
+
+
+class LevelReport:
+    """ How the check of one level went """
+
+    def __init__(self, map_name):
+        self.map_name = map_name
+        # None if the level is fine, else what is wrong with it
+        self.error = None
+        # Slowest setup of the level, in seconds
+        self.load_time = 0.0
+        # Script name -> (steps, tick p50, tick p99, physics p50, physics p99), times in milliseconds
+        self.runs = {}
+
+
+def make_recording(map_name, script, steps):
+    inputs = bytearray(SCRIPTS[script](step) for step in range(steps))
+    return Recording(map_name, inputs)
+
+
+def check_level(map_name, seconds):
+    """ Set up one level and time the scripted runs on it. Runs in a worker process """
+    report = LevelReport(map_name)
+    steps = round(seconds / FIXED_TIMESTEP)
+    # Only problems are written, not the level setup or the pick-ups of every run
+    log.set_level(WARNING)
+    try:
+        for script in SCRIPTS:
+            game = GameSimulation()
+            game.map_name = map_name
+            game.replayer = Replayer(make_recording(map_name, script, steps))
+            # Every step of the run counts towards the percentiles
+            game.profiler = Profiler(window=steps)
+
+            start = time.perf_counter()
+            game.setup()
+            load_time = time.perf_counter() - start
+            report.load_time = max(report.load_time, load_time)
+
+            profiler = game.profiler
+            for _ in range(steps):
+                profiler.begin_frame()
+                game.fixed_update()
+                profiler.end_frame()
+
+            table = profiler.percentiles()
+            tick = table["frame"]
+            physics = table["physics step"]
+            report.runs[script] = (steps, tick[0], tick[2], physics[0], physics[2])
+    except LevelError as error:
+        report.error = str(error)
+    except Exception:
+        report.error = traceback.format_exc(limit=-3).strip()
+    return report
+
+
+def main():
+    """ Check every level, and exit with an error if any of them is broken """
+    parser = argparse.ArgumentParser(description="Check and benchmark the levels without a window")
+    parser.add_argument("levels", nargs="*", help="levels to check, relative to the repository. Default is every .tmx in the level folder")
+    parser.add_argument("--seconds", type=float, default=20, help="game seconds of every scripted run")
+    parser.add_argument("--workers", type=int, default=None, help="processes to use, default is one per CPU")
+    args = parser.parse_args()
+
+    levels = args.levels or [os.path.relpath(file_path, path(""))
+                             for file_path in sorted(glob.glob(os.path.join(path(LEVEL_FOLDER), "*.tmx")))]
+
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as pool:
+        reports = list(pool.map(check_level, levels, [args.seconds] * len(levels)))
+    elapsed = time.perf_counter() - start
+
+    broken = 0
+    for report in reports:
+        print(f"\n{report.map_name}")
+        if report.error is not None:
+            broken += 1
+            print(f"    BROKEN: {report.error}")
+            continue
+        print(f"    load {report.load_time * 1000:.1f} ms")
+        print(f"    {'run':<12}{'steps':>7}{'tick p50':>10}{'tick p99':>10}{'physics p50':>13}{'physics p99':>13}  ms")
+        for script, (steps, tick_p50, tick_p99, physics_p50, physics_p99) in report.runs.items():
+            print(f"    {script:<12}{steps:>7}{tick_p50:>10.3f}{tick_p99:>10.3f}{physics_p50:>13.3f}{physics_p99:>13.3f}")
+
+    print(f"\nChecked {len(reports)} levels in {elapsed:.2f} s, {broken} broken")
+    sys.exit(1 if broken else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,374 @@
+# Chunk streaming for infinite Tiled maps, like assets/tiles/map.json.
+# Infinite maps store their tile layers in chunks of 16x16 tiles. Only the chunks
+# around the view get sprites and collision shapes. Chunks that leave the view are
+# unloaded again, so memory and the cost of a frame depend on the size of the view,
+# not of the map. Decoding a chunk (base64, zlib, finding the wall rectangles)
+# happens on a background thread. Making sprites and pymunk shapes happens on the
+# main thread, a few chunks per step.
+
+import arcade, base64, gzip, json, math, os, pymunk, queue, struct, threading, zlib
+import xml.etree.ElementTree as ElementTree
+from constants import *
+from level import LevelError, merge_touching
+
+# The infinite maps use 32 pixel tiles, which is the right size for the player as they are
+CHUNK_MAP_SCALING = 1.0
+
+# Chunks finished by the background thread that get sprites and shapes per step
+CHUNKS_PER_UPDATE = 2
+
+# Extra chunks around the view that are loaded before they are seen,
+# and how far outside the view a chunk has to be before it is unloaded
+CHUNK_LOAD_MARGIN = 1
+CHUNK_UNLOAD_MARGIN = 2
+
+# The top bits of a GID say how the tile is flipped
+FLIPPED_HORIZONTALLY = 0x80000000
+FLIPPED_VERTICALLY = 0x40000000
+FLIPPED_DIAGONALLY = 0x20000000
+GID_MASK = 0x1FFFFFFF
+
+# Tile layer collision types a streamed map can use. Tile layers without one are walls.
+STREAMED_COLLISION_TYPES = ("none", "wall")
+
+
+def is_streamed_map(map_file):
+    """ Infinite maps are saved as Tiled JSON and streamed in chunks """
+    return map_file.endswith(".json")
+
+
+def decode_chunk_data(data, encoding, compression):
+    """ The GIDs of a chunk, row by row """
+    if encoding != "base64":
+        return list(data)
+    raw = base64.b64decode(data)
+    if compression == "zlib":
+        raw = zlib.decompress(raw)
+    elif compression == "gzip":
+        raw = gzip.decompress(raw)
+    elif compression:
+        raise LevelError(f"Chunks compressed with {compression} are not supported")
+    return struct.unpack(f"<{len(raw) // 4}I", raw)
+
+
+def read_properties(properties):
+    """ Tiled JSON stores properties as a list of name/value pairs """
+    return {prop["name"]: prop["value"] for prop in properties or []}
+
+
+def read_tileset(entry, map_directory):
+    """ A tileset as (first GID, tileset dict in the Tiled JSON layout, folder its images are in) """
+    if "source" not in entry:
+        return entry["firstgid"], entry, map_directory
+
+    file_path = os.path.join(map_directory, entry["source"])
+    directory = os.path.dirname(file_path)
+    if not file_path.endswith(".tsx"):
+        with open(file_path) as file:
+            return entry["firstgid"], json.load(file), directory
+
+    root = ElementTree.parse(file_path).getroot()
+    tileset = {
+        "tilewidth": int(root.get("tilewidth")),
+        "tileheight": int(root.get("tileheight")),
+        "columns": int(root.get("columns", 0)),
+        "margin": int(root.get("margin", 0)),
+        "spacing": int(root.get("spacing", 0)),
+        "tiles": [],
+    }
+    image = root.find("image")
+    if image is not None:
+        tileset["image"] = image.get("source")
+    for tile in root.findall("tile"):
+        tile_image = tile.find("image")
+        if tile_image is not None:
+            tileset["tiles"].append({"id": int(tile.get("id")), "image": tile_image.get("source")})
+    return entry["firstgid"], tileset, directory
+
+
+class StreamedLayer:
+    """ One tile layer of an infinite map, and where its chunks are in the file """
+
+    def __init__(self, name, properties, offset_x, offset_y, encoding, compression):
+        self.name = name
+        self.properties = properties
+        self.offset_x = offset_x
+        self.offset_y = offset_y
+        self.encoding = encoding
+        self.compression = compression
+        # (chunk column, chunk row) -> the chunk as it is in the file, still encoded
+        self.chunks = {}
+        # Filled by add_to_scene()
+        self.sprite_list = None
+
+        collision_type = properties.get("collision_type", "wall")
+        if collision_type not in STREAMED_COLLISION_TYPES:
+            raise LevelError(f"Layer '{name}' has collision_type {collision_type!r}, a streamed map can only use {STREAMED_COLLISION_TYPES}")
+        self.is_wall = collision_type == "wall"
+        self.friction = properties.get("friction", WALL_FRICTION)
+
+
+class DecodedChunk:
+    """ What the background thread makes of a chunk: per layer the tiles and the merged wall rectangles """
+
+    def __init__(self, key):
+        self.key = key
+        # One list per layer of (gid, tile column, tile row)
+        self.tiles = []
+        # One list per layer of (left, bottom, right, top) in world pixels
+        self.walls = []
+
+
+class ChunkStreamer:
+    """ Keeps the chunks around a point loaded, and the rest of the map unloaded """
+
+    def __init__(self, map_file, scaling=CHUNK_MAP_SCALING):
+        with open(map_file) as file:
+            map_data = json.load(file)
+        if not map_data.get("infinite"):
+            raise LevelError(f"{map_file} is not an infinite map, load it as a .tmx level instead")
+
+        self.map_file = map_file
+        self.scaling = scaling
+        self.tile_width = map_data["tilewidth"]
+        self.tile_height = map_data["tileheight"]
+        map_directory = os.path.dirname(os.path.abspath(map_file))
+
+        self.tilesets = sorted((read_tileset(entry, map_directory) for entry in map_data["tilesets"]),
+                               key=lambda tileset: tileset[0])
+        # GID -> texture, made the first time a tile uses it
+        self.textures = {}
+
+        self.layers = []
+        self.image_layers = []
+        self.chunk_width = self.chunk_height = 16
+        for layer in map_data["layers"]:
+            if layer["type"] == "tilelayer":
+                streamed = StreamedLayer(layer["name"], read_properties(layer.get("properties")),
+                                         layer.get("offsetx", 0), layer.get("offsety", 0),
+                                         layer.get("encoding", "csv"), layer.get("compression", ""))
+                for chunk in layer.get("chunks", []):
+                    self.chunk_width, self.chunk_height = chunk["width"], chunk["height"]
+                    key = (chunk["x"] // chunk["width"], chunk["y"] // chunk["height"])
+                    streamed.chunks[key] = chunk
+                self.layers.append(streamed)
+            elif layer["type"] == "imagelayer":
+                self.image_layers.append(layer)
+            else:
+                raise LevelError(f"Layer '{layer['name']}' is a {layer['type']}, a streamed map can only have tile and image layers")
+
+        # Every chunk that has tiles in any layer
+        self.chunk_keys = set()
+        for layer in self.layers:
+            self.chunk_keys.update(layer.chunks)
+
+        # Chunk key -> (sprites, shapes) of the loaded chunks
+        self.loaded = {}
+        # Chunks the background thread is decoding
+        self.pending = set()
+        self.center_chunk = None
+
+        # The area around the player that should be loaded, in pixels. The game window sets this to its size.
+        self.view_width = SCREEN_WIDTH
+        self.view_height = SCREEN_HEIGHT
+
+        self.physics_engine = None
+        self.wall_collision_type = None
+
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.thread = threading.Thread(target=self.work, name="chunk streamer", daemon=True)
+        self.thread.start()
+
+    # region Background thread
+    def work(self):
+        while True:
+            key = self.requests.get()
+            if key is None:
+                return
+            self.results.put(self.decode(key))
+
+    def decode(self, key):
+        """ Decode the chunk in every layer and find its wall rectangles. Only reads data that never changes """
+        decoded = DecodedChunk(key)
+        scale = self.scaling
+        for layer in self.layers:
+            tiles = []
+            boxes = []
+            chunk = layer.chunks.get(key)
+            if chunk is not None:
+                gids = decode_chunk_data(chunk["data"], layer.encoding, layer.compression)
+                width = chunk["width"]
+                for index, gid in enumerate(gids):
+                    if not gid:
+                        continue
+                    column = chunk["x"] + index % width
+                    row = chunk["y"] + index // width
+                    tiles.append((gid, column, row))
+                    if layer.is_wall:
+                        left = (column * self.tile_width + layer.offset_x) * scale
+                        top = -(row * self.tile_height + layer.offset_y) * scale
+                        boxes.append((left, top - self.tile_height * scale, left + self.tile_width * scale, top))
+
+            # The same merging as the wall tiles of a normal level (see level.py)
+            rows = merge_touching(boxes, lambda box: (box[1], box[3]), 0, 2) if boxes else []
+            decoded.walls.append(merge_touching(rows, lambda box: (box[0], box[2]), 1, 3) if rows else [])
+            decoded.tiles.append(tiles)
+        return decoded
+
+    def close(self):
+        """ Stop the background thread """
+        self.requests.put(None)
+    # endregion
+
+    # region Main thread
+    def add_to_scene(self, scene):
+        """ Give every tile layer a sprite list in the scene, and add the image layers """
+        for layer in self.layers:
+            if layer.name not in scene.name_mapping:
+                scene.add_sprite_list_before(layer.name, "Player")
+            layer.sprite_list = scene[layer.name]
+
+        # Image layers are a single picture each, so they are loaded right away
+        decorations = scene["DecorationBehindPlayer"]
+        map_directory = os.path.dirname(os.path.abspath(self.map_file))
+        for layer in self.image_layers:
+            sprite = arcade.Sprite(os.path.join(map_directory, layer["image"]), self.scaling, hit_box_algorithm="None")
+            sprite.left = layer.get("offsetx", 0) * self.scaling
+            sprite.top = -layer.get("offsety", 0) * self.scaling
+            decorations.append(sprite)
+
+    def attach(self, physics_engine):
+        """ Walls of the chunks that get loaded are added to this physics engine """
+        self.physics_engine = physics_engine
+        if "wall" not in physics_engine.collision_types:
+            physics_engine.collision_types.append("wall")
+        self.wall_collision_type = physics_engine.collision_types.index("wall")
+
+    def chunk_at(self, x, y):
+        """ The chunk key of a point in the world """
+        column = math.floor(x / self.scaling / self.tile_width / self.chunk_width)
+        row = math.floor(-y / self.scaling / self.tile_height / self.chunk_height)
+        return column, row
+
+    def chunks_around(self, x, y, margin):
+        """ Keys of the existing chunks in the view around a point, plus margin chunks on every side """
+        left, top = self.chunk_at(x - self.view_width / 2, y + self.view_height / 2)
+        right, bottom = self.chunk_at(x + self.view_width / 2, y - self.view_height / 2)
+        return {(column, row)
+                for column in range(left - margin, right + margin + 1)
+                for row in range(top - margin, bottom + margin + 1)
+                if (column, row) in self.chunk_keys}
+
+    def update(self, x, y):
+        """ Stream the chunks around the point (the player). Called every step """
+        center = self.chunk_at(x, y)
+        if center != self.center_chunk:
+            self.center_chunk = center
+
+            wanted = self.chunks_around(x, y, CHUNK_LOAD_MARGIN)
+            for key in wanted - self.loaded.keys() - self.pending:
+                self.pending.add(key)
+                self.requests.put(key)
+
+            keep = self.chunks_around(x, y, CHUNK_UNLOAD_MARGIN)
+            for key in self.loaded.keys() - keep:
+                self.unload(key)
+            self.pending &= keep
+
+            # The player can touch the chunks next to the one they are in, so those can't wait
+            column, row = center
+            for key in ((column + dx, row + dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)):
+                if key in self.chunk_keys and key not in self.loaded:
+                    self.pending.discard(key)
+                    self.build(self.decode(key))
+
+        for _ in range(CHUNKS_PER_UPDATE):
+            try:
+                decoded = self.results.get_nowait()
+            except queue.Empty:
+                break
+            # Skip chunks that were unloaded again, or already built because the player got there first
+            if decoded.key in self.pending:
+                self.pending.discard(decoded.key)
+                self.build(decoded)
+
+    def load_all_around(self, x, y):
+        """ Load every chunk around a point right away, without the background thread. Used when a level starts """
+        for key in self.chunks_around(x, y, CHUNK_LOAD_MARGIN) - self.loaded.keys():
+            self.build(self.decode(key))
+        self.center_chunk = self.chunk_at(x, y)
+
+    def jump_to(self, x, y):
+        """ The player was moved somewhere else at once, like when the level restarts """
+        keep = self.chunks_around(x, y, CHUNK_UNLOAD_MARGIN)
+        for key in self.loaded.keys() - keep:
+            self.unload(key)
+        self.pending.clear()
+        self.load_all_around(x, y)
+
+    def texture(self, gid):
+        """ The texture of a GID. Textures are cut out of the tileset image once and shared """
+        if gid in self.textures:
+            return self.textures[gid]
+
+        tile_id = gid & GID_MASK
+        for first_gid, tileset, directory in reversed(self.tilesets):
+            if first_gid <= tile_id:
+                break
+        else:
+            raise LevelError(f"{self.map_file} uses GID {tile_id}, which is in no tileset")
+        local_id = tile_id - first_gid
+
+        flips = dict(flipped_horizontally=bool(gid & FLIPPED_HORIZONTALLY),
+                     flipped_vertically=bool(gid & FLIPPED_VERTICALLY),
+                     flipped_diagonally=bool(gid & FLIPPED_DIAGONALLY))
+        if "image" in tileset:
+            width, height = tileset["tilewidth"], tileset["tileheight"]
+            margin, spacing = tileset.get("margin", 0), tileset.get("spacing", 0)
+            x = margin + (local_id % tileset["columns"]) * (width + spacing)
+            y = margin + (local_id // tileset["columns"]) * (height + spacing)
+            texture = arcade.load_texture(os.path.join(directory, tileset["image"]), x, y, width, height,
+                                          hit_box_algorithm="None", **flips)
+        else:
+            images = {tile["id"]: tile["image"] for tile in tileset.get("tiles", [])}
+            texture = arcade.load_texture(os.path.join(directory, images[local_id]), hit_box_algorithm="None", **flips)
+
+        self.textures[gid] = texture
+        return texture
+
+    def build(self, decoded):
+        """ Make the sprites and collision shapes of a decoded chunk """
+        scale = self.scaling
+        sprites = []
+        shapes = []
+        for layer, tiles, walls in zip(self.layers, decoded.tiles, decoded.walls):
+            for gid, column, row in tiles:
+                texture = self.texture(gid)
+                # Tiled puts a tile's bottom left corner in the bottom left of its cell
+                sprite = arcade.Sprite(texture=texture, scale=scale)
+                sprite.left = (column * self.tile_width + layer.offset_x) * scale
+                sprite.bottom = -((row + 1) * self.tile_height + layer.offset_y) * scale
+                layer.sprite_list.append(sprite)
+                sprites.append(sprite)
+
+            if self.physics_engine is not None:
+                static_body = self.physics_engine.space.static_body
+                for left, bottom, right, top in walls:
+                    shape = pymunk.Poly(static_body, ((left, bottom), (right, bottom), (right, top), (left, top)))
+                    shape.friction = layer.friction
+                    shape.collision_type = self.wall_collision_type
+                    shapes.append(shape)
+
+        if shapes:
+            self.physics_engine.space.add(*shapes)
+        self.loaded[decoded.key] = (sprites, shapes)
+
+    def unload(self, key):
+        """ Remove the sprites and collision shapes of a chunk """
+        sprites, shapes = self.loaded.pop(key)
+        for sprite in sprites:
+            sprite.remove_from_sprite_lists()
+        if shapes:
+            self.physics_engine.space.remove(*shapes)
+    # endregion
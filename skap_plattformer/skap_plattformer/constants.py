@@ -0,0 +1,127 @@
+# Constants shared between the game window and the headless simulation
+
+import arcade, os
+
+
+# More convenient way to find files
+def path(file_address):
+    return os.path.realpath(f"{__file__}/../../../{file_address}")
+
+
+SCREEN_TITLE = "PyMunk Platformer"
+
+# How big are our image tiles?
+GRID_PIXEL_SIZE = 128
+
+# Scale sprites up or down
+SPRITE_SCALING_PLAYER = 0.5
+SPRITE_SCALING_TILES = 0.5
+
+# Scaled sprite size for tiles
+SPRITE_SIZE = int(GRID_PIXEL_SIZE*0.4)
+
+# Size of grid to show on screen, in number of tiles
+SCREEN_GRID_WIDTH = 25
+SCREEN_GRID_HEIGHT = 15
+
+# Size of screen to show, in pixels
+SCREEN_WIDTH = SPRITE_SIZE * SCREEN_GRID_WIDTH
+SCREEN_HEIGHT = SPRITE_SIZE * SCREEN_GRID_HEIGHT
+
+# GUI placements
+TIMER_FROM_RIGHT = 38
+TIMER_FROM_TOP = 20
+SCORE_FROM_LEFT = 20
+SCORE_FROM_TOP = 20
+
+# Constants for color
+WHITE = arcade.color.WHITE
+
+# Level
+DEFAULT_MAP = "skap_plattformer/assets/levels/secretTestLevel.tmx"
+
+# --- Fixed timestep. The physics always moves forward in steps of this size,
+# no matter how long a rendered frame took.
+FIXED_TIMESTEP = 1 / 60
+
+# Most steps we catch up on in one frame, so a long stall doesn't freeze the game
+MAX_STEPS_PER_FRAME = 8
+
+# --- Physics forces. Higher number, faster accelerating.
+
+# Gravity
+GRAVITY = 2500
+
+# Damping - Amount of speed retained per second
+DEFAULT_DAMPING = 1.0
+PLAYER_DAMPING = 0.3
+
+# Friction between objects
+PLAYER_FRICTION = 2.0
+WALL_FRICTION = 0.7
+DYNAMIC_ITEM_FRICTION = 0.6
+
+# Mass (defaults to 1)
+PLAYER_MASS = 2.0
+
+# Player constants
+PLAYER_MAX_HORIZONTAL_SPEED = 520
+PLAYER_MAX_VERTICAL_SPEED = 1600
+PLAYER_MAX_CLIMB_SPEED = 300
+PLAYER_MOVE_FORCE_ON_GROUND = 8500
+PLAYER_MOVE_FORCE_IN_AIR = 3000
+PLAYER_CLIMB_FORCE = 2000
+PLAYER_JUMP_FORCE = 1400
+PLAYER_JUMP_SODA_BOOST = 250
+PLAYER_CLIMB_SPEED = 10
+
+# Ghost runners are see-through
+GHOST_ALPHA = 96
+
+# Keys of co-op players 2 to 4 (left, right, up, down, fire) and their colors. F9 adds a player.
+COOP_KEYS = (
+    (arcade.key.J, arcade.key.L, arcade.key.I, arcade.key.K, arcade.key.U),
+    (arcade.key.NUM_4, arcade.key.NUM_6, arcade.key.NUM_8, arcade.key.NUM_5, arcade.key.NUM_0),
+    (arcade.key.F, arcade.key.H, arcade.key.T, arcade.key.G, arcade.key.R),
+)
+COOP_COLORS = (arcade.color.LIGHT_GREEN, arcade.color.LIGHT_BLUE, arcade.color.LIGHT_PINK)
+
+# Landing slower than this makes no sound
+LAND_SOUND_MIN_SPEED = 600
+
+# --- Pooled sprites (see pool.py). The pools are filled once per level.
+# Speed, lifetime and cooldown of the bullets come from the weapon definition (see registry.py)
+BULLET_POOL_SIZE = 32
+
+PARTICLE_POOL_SIZE = 64
+PARTICLE_LIFETIME = 0.6
+PARTICLE_SPEED = 250
+PARTICLE_SCALING = 0.25
+# Particles that fly out of a picked up item
+PICK_UP_PARTICLES = 6
+
+# --- Player animation
+
+# Frame i of the jump clip is shown while the vertical speed is above JUMP_FRAME_VELOCITIES[i].
+# Below the last one, the last frame of the clip is shown.
+JUMP_FRAME_VELOCITIES = (500, 400, 200, 50, -100, -300, -400, -500, -600, -700, -800)
+
+# Clip for each animation state (see animations.py). Clips are scaled to the player's height.
+PLAYER_CLIPS = {
+    "stand": "jump_right",
+    "jump": "jump_right",
+    "walk": "variable_green_walk",
+    "climb": "variable_green_climb",
+    "swim": "variable_green_swim",
+    "duck": "variable_green_duck",
+}
+PLAYER_ANIMATION_HEIGHT = 51
+STAND_FRAME = 7
+
+# Pixels moved per frame of the walk, climb and swim clips
+WALK_FRAME_DISTANCE = 24
+CLIMB_FRAME_DISTANCE = 16
+SWIM_FRAME_DISTANCE = 24
+
+# Slower than this counts as standing still
+WALK_MIN_SPEED = 20
@@ -0,0 +1,120 @@
+# Draws only the part of the scene that is on screen.
+# Layers whose sprites never move are split into a grid of small sprite lists, one
+# per grid cell. A frame draws just the cells that overlap the camera, so sprites
+# far away from the player cost nothing. Layers with moving sprites (the player and
+# the physics items) are drawn as a whole, as they only have a few sprites.
+#
+# The hit box debug view is built once into a buffer of lines per layer, instead
+# of drawing every outline with its own draw call every frame. It is only built
+# again when the SpritePool of the layer turns a sprite on or off.
+
+import arcade, math
+from constants import *
+
+# Width and height of one render cell in pixels. Big enough that a screen covers only a few.
+RENDER_CELL_SIZE = GRID_PIXEL_SIZE * SPRITE_SCALING_TILES * 8
+
+HIT_BOX_COLOR = (0, 0, 0, 255)
+
+
+class CulledLayer:
+    """ A static layer split into one sprite list per grid cell """
+
+    def __init__(self, sprite_list, cell_size):
+        self.sprite_list = sprite_list
+        self.cell_size = cell_size
+        # (column, row) -> sprite list with the sprites whose center is in that cell
+        self.cells = {}
+        # Sprites stick out of their cell by up to half their size, so the view is made this much bigger
+        self.margin = 0
+
+        for sprite in sprite_list:
+            cell = (math.floor(sprite.center_x / cell_size), math.floor(sprite.center_y / cell_size))
+            if cell not in self.cells:
+                # Lazy: the OpenGL buffers of a cell are made when it is first drawn, not all at level start
+                self.cells[cell] = arcade.SpriteList(use_spatial_hash=False, lazy=True)
+            # The sprite is in both lists, so hiding a picked up coin (see pool.py) hides it here too
+            self.cells[cell].append(sprite)
+            self.margin = max(self.margin, sprite.width / 2, sprite.height / 2)
+
+    def draw(self, left, bottom, right, top):
+        size = self.cell_size
+        margin = self.margin
+        for column in range(math.floor((left - margin) / size), math.floor((right + margin) / size) + 1):
+            for row in range(math.floor((bottom - margin) / size), math.floor((top + margin) / size) + 1):
+                cell = self.cells.get((column, row))
+                if cell is not None:
+                    cell.draw()
+
+
+class HitBoxCache:
+    """ The hit box outlines of a static layer, as one buffer of lines """
+
+    def __init__(self, sprite_list, pool=None):
+        self.sprite_list = sprite_list
+        # The pool that turns the sprites of the layer on and off, if it has one
+        self.pool = pool
+        self.shapes = None
+        self.changes = None
+
+    def draw(self):
+        # Picked up sprites are turned off by their pool (see pool.py), then the outlines are built again
+        changes = self.pool.changes if self.pool is not None else 0
+        if changes != self.changes:
+            self.changes = changes
+            self.shapes = arcade.ShapeElementList()
+            points = []
+            for sprite in self.sprite_list:
+                if not sprite.visible:
+                    continue
+                hit_box = sprite.get_adjusted_hit_box()
+                for index, point in enumerate(hit_box):
+                    points.append(point)
+                    points.append(hit_box[(index + 1) % len(hit_box)])
+            if points:
+                self.shapes.append(arcade.create_lines(points, HIT_BOX_COLOR))
+        self.shapes.draw()
+
+
+class SceneRenderer:
+    """ Draws the layers of a scene in order, skipping what is outside the camera """
+
+    def __init__(self, scene, dynamic_layers=(), pools=(), cell_size=RENDER_CELL_SIZE):
+        self.scene = scene
+        self.show_hit_boxes = False
+
+        # Sprite list -> CulledLayer and HitBoxCache for the static layers. Static layers
+        # with a SpritePool (the pick-ups) have sprites that are turned on and off.
+        pools = {pool.sprite_list: pool for pool in pools}
+        self.culled = {}
+        self.hit_boxes = {}
+        for name, sprite_list in scene.name_mapping.items():
+            if name not in dynamic_layers:
+                self.culled[sprite_list] = CulledLayer(sprite_list, cell_size)
+                self.hit_boxes[sprite_list] = HitBoxCache(sprite_list, pools.get(sprite_list))
+
+    def toggle_hit_boxes(self):
+        self.show_hit_boxes = not self.show_hit_boxes
+
+    def draw(self, camera):
+        """ Draw the scene as seen by the camera. Call camera.use() first """
+        left, bottom = camera.position
+        right = left + camera.viewport_width
+        top = bottom + camera.viewport_height
+
+        for sprite_list in self.scene.sprite_lists:
+            if not sprite_list.visible:
+                continue
+            culled = self.culled.get(sprite_list)
+            if culled is not None:
+                culled.draw(left, bottom, right, top)
+            else:
+                sprite_list.draw()
+
+        if self.show_hit_boxes:
+            for sprite_list in self.scene.sprite_lists:
+                cache = self.hit_boxes.get(sprite_list)
+                if cache is not None:
+                    cache.draw()
+                else:
+                    sprite_list.draw_hit_boxes(HIT_BOX_COLOR)
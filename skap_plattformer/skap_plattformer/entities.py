@@ -0,0 +1,163 @@
+# Players of the Skap platforming game, stored as arrays.
+# Every player is a row in a PlayerStore: a NumPy array per value (on_ground, air_time,
+# facing, ...) instead of attributes spread over sprites. The game loop then works out
+# the movement, jumping and climbing of every player at once with array operations,
+# and only goes through the players one by one to talk to pymunk. The main player,
+# co-op players and ghost runners all go through the same code.
+#
+# The player sprites are PlayerSprites. Their attributes read and write their row of
+# the store, so code that works on game.player keeps working.
+
+import arcade, numpy
+from constants import *
+from replay import INPUT_LEFT, INPUT_RIGHT, INPUT_UP, INPUT_DOWN, INPUT_FIRE
+
+# Sprite attribute, store array and its type, for the state of a player
+PLAYER_FIELDS = (
+    ("newJump", "new_jump", numpy.bool_),
+    ("jump_boost_soda", "jump_boost_soda", numpy.int32),
+    ("on_ladder", "on_ladder", numpy.bool_),
+    ("on_ground", "on_ground", numpy.bool_),
+    ("air_time", "air_time", numpy.int32),
+    ("animation_frame", "animation_frame", numpy.int64),
+    ("in_water", "in_water", numpy.bool_),
+    ("facing", "facing", numpy.int8),
+    ("fire_cooldown", "fire_cooldown", numpy.float64),
+    ("fall_speed", "fall_speed", numpy.float64),
+)
+# Keys held this step, one array per key
+INPUT_FIELDS = (("left", INPUT_LEFT), ("right", INPUT_RIGHT), ("up", INPUT_UP), ("down", INPUT_DOWN),
+                ("fire", INPUT_FIRE))
+
+# Rows the store starts with. It doubles when it is full.
+PLAYER_STORE_CAPACITY = 8
+
+# Pymunk shape filter of the ghosts. They are in a group of their own, so they don't touch each other,
+# and the players and items leave their category out of their mask, so those don't touch ghosts.
+GHOST_GROUP = 1
+GHOST_CATEGORY = 0b10
+
+
+class PlayerStore:
+    """ The state and input of every player, a row per player """
+
+    def __init__(self, capacity=PLAYER_STORE_CAPACITY):
+        self.count = 0
+        self.capacity = capacity
+        for _, name, kind in PLAYER_FIELDS:
+            setattr(self, name, numpy.zeros(capacity, kind))
+        for name, _ in INPUT_FIELDS:
+            setattr(self, name, numpy.zeros(capacity, numpy.bool_))
+        # Ghost runners only run: they pick nothing up, shoot nothing and touch nothing but walls
+        self.ghost = numpy.zeros(capacity, numpy.bool_)
+
+        # Sprite and pymunk physics object of every row
+        self.sprites = []
+        self.physics_objects = []
+
+    def __len__(self):
+        return self.count
+
+    def array_names(self):
+        return [name for _, name, _ in PLAYER_FIELDS] + [name for name, _ in INPUT_FIELDS] + ["ghost"]
+
+    def add(self, sprite, ghost=False):
+        """ Add a row for a PlayerSprite, with the state a player starts a level with """
+        if self.count == self.capacity:
+            self.capacity *= 2
+            for name in self.array_names():
+                array = getattr(self, name)
+                grown = numpy.zeros(self.capacity, array.dtype)
+                grown[:self.count] = array[:self.count]
+                setattr(self, name, grown)
+
+        index = self.count
+        self.count += 1
+        for name in self.array_names():
+            getattr(self, name)[index] = 0
+        self.new_jump[index] = True
+        self.facing[index] = 1
+        self.ghost[index] = ghost
+
+        sprite.store = self
+        sprite.index = index
+        self.sprites.append(sprite)
+        self.physics_objects.append(None)
+        return index
+
+    def set_input_bits(self, index, bits):
+        """ Unpack an input byte (see replay.py) into the key arrays of one player """
+        for name, bit in INPUT_FIELDS:
+            getattr(self, name)[index] = bool(bits & bit)
+
+    def set_input_array(self, rows, bits):
+        """ Unpack an array of input bytes into the key arrays of the given rows """
+        for name, bit in INPUT_FIELDS:
+            getattr(self, name)[rows] = (bits & bit) != 0
+
+    def save(self):
+        """ A copy of every array, for snapshots """
+        return {name: getattr(self, name)[:self.count].copy() for name in self.array_names()}
+
+    def load(self, arrays):
+        """ Put back arrays from save(). Rows added since then keep their state """
+        for name, array in arrays.items():
+            getattr(self, name)[:len(array)] = array
+
+
+def store_property(name, kind):
+    """ A sprite attribute that is really the sprite's row in a store array """
+    # Plain Python values come out, so the values can be compared, packed and printed like before
+    plain = {numpy.bool_: bool, numpy.float64: float}.get(kind, int)
+
+    def get(sprite):
+        return plain(getattr(sprite.store, name)[sprite.index])
+
+    def set(sprite, value):
+        getattr(sprite.store, name)[sprite.index] = value
+
+    return property(get, set)
+
+
+class PlayerSprite(arcade.Sprite):
+    """ A player sprite whose state lives in a PlayerStore. Set up by PlayerStore.add() """
+
+    store = None
+    index = None
+
+
+for attribute, name, kind in PLAYER_FIELDS:
+    setattr(PlayerSprite, attribute, store_property(name, kind))
+
+
+class GhostRunner:
+    """ Input for ghost players: every ghost plays back a recording, all of them with array lookups """
+
+    def __init__(self):
+        # Store row of every ghost, and an input byte per ghost per step, padded with 0 (no keys)
+        self.rows = numpy.zeros(0, numpy.intp)
+        self.inputs = numpy.zeros((0, 0), numpy.uint8)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def add(self, row, recording, delay=0):
+        """ A ghost that plays a recording, starting delay steps after the level starts """
+        inputs = bytes(delay) + bytes(recording.inputs)
+        steps = max(self.inputs.shape[1], len(inputs))
+        grown = numpy.zeros((len(self.rows) + 1, steps), numpy.uint8)
+        grown[:-1, :self.inputs.shape[1]] = self.inputs
+        grown[-1, :len(inputs)] = numpy.frombuffer(inputs, numpy.uint8)
+        self.inputs = grown
+        self.rows = numpy.append(self.rows, row)
+
+    def feed(self, store, step):
+        """ Set the keys of every ghost for a step of the level. After the end of its recording a ghost lets go.
+        The step comes from the game, so ghosts follow along when the level is reset or loaded """
+        if not len(self.rows):
+            return
+        if step < self.inputs.shape[1]:
+            bits = self.inputs[:, step]
+        else:
+            bits = numpy.zeros(len(self.rows), numpy.uint8)
+        store.set_input_array(self.rows, bits)
@@ -0,0 +1,77 @@
+# Score and timer shown on top of the game.
+# The labels are made once and all drawn in one batch. A label's text is only
+# changed, and so laid out again, when the number it shows has changed.
+
+import arcade, pyglet
+from constants import *
+
+HUD_FONT = ("calibri", "arial")
+HUD_FONT_SIZE = 18
+
+
+class Hud:
+    """ Score counter and clock """
+
+    def __init__(self, width, height):
+        self.batch = pyglet.graphics.Batch()
+        color = arcade.get_four_byte_color(WHITE)
+
+        self.score_label = self.make_label(color)
+        self.clock_label = self.make_label(color)
+        self.milliseconds_label = self.make_label(color)
+
+        # The values the labels show right now
+        self.score = None
+        self.coins_left = None
+        self.clock = None
+        self.milliseconds = None
+
+        self.width = width
+        self.height = height
+        self.resize(width, height)
+
+    def make_label(self, color):
+        return pyglet.text.Label("", font_name=HUD_FONT, font_size=HUD_FONT_SIZE, color=color,
+                                 anchor_x="left", anchor_y="baseline", batch=self.batch)
+
+    def resize(self, width, height):
+        self.width = width
+        self.height = height
+        self.score_label.position = (SCORE_FROM_LEFT, height - SCORE_FROM_TOP)
+        self.milliseconds_label.position = (width - TIMER_FROM_RIGHT, height - TIMER_FROM_TOP)
+        self.place_clock()
+
+    def place_clock(self):
+        # The clock ends where the milliseconds start, about 14 pixels per character
+        clock_length = len(self.clock_label.text)
+        from_right = TIMER_FROM_RIGHT + 7 + 14 * max(clock_length - 1, 0)
+        self.clock_label.position = (self.width - from_right, self.height - TIMER_FROM_TOP)
+
+    def update(self, game):
+        """ Change the labels whose numbers have changed since the last frame """
+        score = int(game.score)
+        coin_pool = game.pick_up_pools.get("Coin")
+        coins_left = len(coin_pool) if coin_pool is not None else 0
+        if score != self.score or coins_left != self.coins_left:
+            self.score = score
+            self.coins_left = coins_left
+            self.score_label.text = f"Score: {score}, there are {coins_left} remaining"
+
+        minutes = int(game.total_time) // 60
+        seconds = int(game.total_time) % 60
+        milliseconds = int((game.total_time - seconds - minutes * 60) * 100 // 1)
+
+        clock = (minutes, seconds)
+        if clock != self.clock:
+            self.clock = clock
+            self.clock_label.text = f"{minutes}:{seconds}"
+            self.place_clock()
+
+        if milliseconds != self.milliseconds:
+            self.milliseconds = milliseconds
+            self.milliseconds_label.text = f":{milliseconds}"
+
+    def draw(self, ctx):
+        """ Draw every label in one go """
+        with ctx.pyglet_rendering():
+            self.batch.draw()
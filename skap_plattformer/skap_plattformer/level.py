@@ -0,0 +1,120 @@
+# Compiles the Tiled layer and object properties of a loaded level into plain
+# tables, once per level. The game loop then never has to look at properties,
+# compare collision_type strings or find pick-up handlers by name.
+
+from constants import *
+from pick_ups import bind_pick_up
+from registry import RegistryError
+from spatial_index import SpatialIndex
+
+COLLISION_TYPES = ("none", "wall", "pick_up", "item")
+
+
+class LevelError(Exception):
+    """ The level has a layer or object the game doesn't know how to handle """
+    pass
+
+
+class CompiledLevel:
+    """ Layers grouped by collision type, and the sprites the player can touch """
+
+    def __init__(self):
+        # (sprite list, friction) for every wall layer
+        self.wall_layers = []
+        # (points, friction) of the static collision shapes, after merging the wall tiles
+        self.wall_shapes = []
+        # Sprite lists with collision_type "pick_up" and "item"
+        self.pick_up_layers = []
+        self.item_layers = []
+
+        self.pick_up_index = SpatialIndex()
+        self.ladder_index = SpatialIndex()
+        # Empty when the level has no "Water" layer
+        self.water_index = SpatialIndex()
+
+
+def compile_level(scene, game, wall_shapes=None):
+    """ Sort the layers of the scene by collision type and bind every pick-up to the effects of its item.
+    wall_shapes are the merged wall shapes if they were made already (see levels.py) """
+    level = CompiledLevel()
+
+    for name in scene.name_mapping:
+        sprite_list = scene[name]
+        properties = sprite_list.properties or {}
+        collision_type = properties.get('collision_type')
+        if collision_type not in COLLISION_TYPES:
+            raise LevelError(f"Layer '{name}' has collision_type {collision_type!r}, expected one of {COLLISION_TYPES}")
+
+        if collision_type == "wall":
+            if "friction" not in properties:
+                raise LevelError(f"Wall layer '{name}' has no friction")
+            level.wall_layers.append((sprite_list, properties["friction"]))
+
+        elif collision_type == "pick_up":
+            level.pick_up_layers.append(sprite_list)
+            for item in sprite_list:
+                try:
+                    bind_pick_up(item, game, game.registry)
+                except RegistryError as error:
+                    raise LevelError(f"Pick-up at {item.position} in '{name}': {error}")
+            level.pick_up_index.add_sprite_list(sprite_list)
+
+        elif collision_type == "item":
+            level.item_layers.append(sprite_list)
+
+    # Ladders and water never move, so they go in the grid once
+    level.ladder_index.add_sprite_list(scene["Ladder"])
+    if "Water" in scene.name_mapping:
+        level.water_index.add_sprite_list(scene["Water"])
+
+    if wall_shapes is None:
+        wall_shapes = merge_wall_shapes(level.wall_layers)
+    level.wall_shapes = wall_shapes
+
+    return level
+
+
+def merge_wall_shapes(wall_layers):
+    """ Merge touching rectangular wall tiles with the same friction into bigger rectangles.
+    Tiles with any other hit box shape are kept as they are """
+    rectangles = {}
+    shapes = []
+    for sprite_list, friction in wall_layers:
+        for sprite in sprite_list:
+            points = sprite.get_adjusted_hit_box()
+            xs = sorted({round(x, 3) for x, y in points})
+            ys = sorted({round(y, 3) for x, y in points})
+            if len(points) == 4 and len(xs) == 2 and len(ys) == 2:
+                rectangles.setdefault(friction, []).append((xs[0], ys[0], xs[1], ys[1]))
+            else:
+                shapes.append((tuple(points), friction))
+
+    for friction, boxes in rectangles.items():
+        # First join boxes side by side in the same row, then stack rows with the same width
+        rows = merge_touching(boxes, lambda box: (box[1], box[3]), 0, 2)
+        for left, bottom, right, top in merge_touching(rows, lambda box: (box[0], box[2]), 1, 3):
+            shapes.append((((left, bottom), (right, bottom), (right, top), (left, top)), friction))
+
+    return shapes
+
+
+def merge_touching(boxes, group_key, start, end):
+    """ Join boxes that have the same group key and touch or overlap along one axis.
+    start and end are the indexes of that axis in the (left, bottom, right, top) tuples """
+    groups = {}
+    for box in boxes:
+        groups.setdefault(group_key(box), []).append(box)
+
+    merged = []
+    for group in groups.values():
+        group.sort(key=lambda box: box[start])
+        current = list(group[0])
+        for box in group[1:]:
+            if box[start] <= current[end]:
+                current[end] = max(current[end], box[end])
+            else:
+                merged.append(tuple(current))
+                current = list(box)
+        merged.append(tuple(current))
+    return merged
+
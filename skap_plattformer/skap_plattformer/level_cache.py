@@ -0,0 +1,343 @@
+# Binary level cache for the Skap platforming game.
+# Parsing a .tmx file means XML, base64 and zlib decoding and working out the hit box
+# of every tile image. The level compiler does all of that once and writes the result
+# to a small binary file next to the level. Loading the level then only memory-maps
+# that file and creates the sprites. The cache stores a hash of the .tmx file and of the
+# tilesets and images it uses, and is rebuilt automatically when any of them changes.
+# Every level has its own cache file, named after its path in the repository.
+#
+# Compile every level ahead of time with:
+#     python level_cache.py
+
+import arcade, argparse, glob, hashlib, json, mmap, os, struct, time
+import pytiled_parser
+from xml.etree import ElementTree
+from constants import *
+from level import LevelError
+
+LEVEL_FOLDER = "skap_plattformer/assets/levels"
+CACHE_FOLDER = "skap_plattformer/assets/levels/.cache"
+
+# File format. All numbers are little endian.
+#   header:   magic, version, scaling, sha1 of the level files (see level_files()), length of the table block
+#   tables:   JSON with the map size, layers, textures, hit boxes and properties
+#   gids:     uint32 tile GID arrays of the tile layers, row by row
+#   sprites:  one record per sprite, see SPRITE_FORMAT
+CACHE_MAGIC = b"SKLV"
+CACHE_VERSION = 2
+HEADER_FORMAT = struct.Struct("<4sHd20sI")
+GID_FORMAT = "I"
+# gid, center x, center y, width, height, scale, angle, alpha, properties index, hit box index
+SPRITE_FORMAT = struct.Struct("<IdddddfBii")
+
+
+class CachedTileMap:
+    """ The parts of arcade.TileMap the game uses, loaded from the level cache """
+
+    def __init__(self):
+        self.width = 0
+        self.height = 0
+        self.tile_width = 0
+        self.tile_height = 0
+        # Layer name -> sprite list, in the order Tiled draws them
+        self.sprite_lists = {}
+        # (layer name, properties) for every layer in the map, with or without sprites
+        self.layer_properties = []
+        # Layer name -> (width, height, GIDs row by row) for every tile layer
+        self.tile_gids = {}
+
+
+def cache_path(map_file):
+    """ Where the cache of a level is stored. Levels with the same name in different folders get their own """
+    name = os.path.splitext(os.path.basename(map_file))[0]
+    relative = os.path.relpath(os.path.realpath(map_file), path("")).replace(os.sep, "/")
+    folder_hash = hashlib.sha1(relative.encode("utf-8")).hexdigest()[:8]
+    return os.path.join(path(CACHE_FOLDER), f"{name}.{folder_hash}.skl")
+
+
+def level_files(map_file):
+    """ The .tmx file, then every external tileset (.tsx) and image file it uses, without parsing the level """
+    files = [os.path.abspath(map_file)]
+    # Tilesets can be in files of their own, with image paths relative to that file
+    unread = [files[0]]
+    while unread:
+        file_path = unread.pop()
+        directory = os.path.dirname(file_path)
+        try:
+            root = ElementTree.parse(file_path).getroot()
+        except (OSError, ElementTree.ParseError):
+            # Hashed as missing, compile_level() says what is wrong with it
+            continue
+        for element in root.iter():
+            source = element.get("source")
+            if source is None or element.tag not in ("tileset", "image"):
+                continue
+            source = os.path.normpath(os.path.join(directory, source))
+            if source not in files:
+                files.append(source)
+                if element.tag == "tileset":
+                    unread.append(source)
+    return files
+
+
+def level_hash(map_file):
+    """ Changes whenever the .tmx file, or a tileset or image it uses, is changed, added or removed """
+    digest = hashlib.sha1()
+    map_directory = os.path.dirname(os.path.abspath(map_file))
+    for file_path in level_files(map_file):
+        digest.update(os.path.relpath(file_path, map_directory).encode("utf-8") + b"\0")
+        try:
+            with open(file_path, "rb") as file:
+                digest.update(hashlib.sha1(file.read()).digest())
+        except OSError:
+            digest.update(b"missing")
+    return digest.digest()
+
+
+def tile_image(tile, map_directory):
+    """ The image file of a tile, and the area of it to cut out: (file, x, y, width, height).
+    The file is None if it can't be found. Does what arcade.TileMap does when it makes the sprite """
+    image_file = tile.image or tile.tileset.image
+    if image_file and not os.path.exists(image_file):
+        image_file = os.path.join(map_directory, image_file)
+    if not image_file or not os.path.exists(image_file):
+        image_file = None
+
+    tileset = tile.tileset
+    if tileset.image:
+        # One image with all the tiles in a grid
+        margin = tileset.margin or 0
+        spacing = tileset.spacing or 0
+        row, column = divmod(tile.id, tileset.columns)
+        return (image_file, margin + column * (tileset.tile_width + spacing),
+                margin + row * (tileset.tile_height + spacing), tileset.tile_width, tileset.tile_height)
+    # An image per tile
+    return image_file, tile.x, tile.y, tile.width, tile.height
+
+
+def compile_level(map_file, scaling=SPRITE_SCALING_TILES):
+    """ Parse a .tmx file with arcade and write everything the game needs into the level cache """
+    content_hash = level_hash(map_file)
+    tile_map = arcade.load_tilemap(map_file, scaling)
+    tiled_map = tile_map.tiled_map
+    map_directory = os.path.dirname(os.path.abspath(map_file))
+
+    textures = []
+    texture_indexes = {}
+    hit_boxes = []
+    hit_box_indexes = {}
+    properties_table = []
+    properties_indexes = {}
+
+    def texture_index(gid):
+        """ Index of the texture for a GID. Textures are stored as the area of an image file to cut out """
+        if gid not in texture_indexes:
+            tile = tile_map._get_tile_by_gid(gid)
+            if tile is None:
+                raise LevelError(f"{map_file} uses GID {gid}, which is in no tileset")
+            if tile.animation:
+                raise LevelError(f"{map_file} has an animated tile (GID {gid}), the level cache doesn't support those")
+            image_file, image_x, image_y, width, height = tile_image(tile, map_directory)
+            if image_file is None:
+                raise LevelError(f"{map_file} uses GID {gid}, but its image can't be found")
+            texture_indexes[gid] = len(textures)
+            textures.append({
+                "file": os.path.relpath(image_file, map_directory),
+                "x": image_x, "y": image_y, "width": width, "height": height,
+                "flipped_horizontally": tile.flipped_horizontally,
+                "flipped_vertically": tile.flipped_vertically,
+                "flipped_diagonally": tile.flipped_diagonally,
+            })
+        return texture_indexes[gid]
+
+    def table_index(value, table, indexes):
+        """ Store each distinct value once, and refer to it by index """
+        key = json.dumps(value, sort_keys=True, default=str)
+        if key not in indexes:
+            indexes[key] = len(table)
+            table.append(json.loads(key))
+        return indexes[key]
+
+    # The GIDs behind the sprites of every layer, in the same order arcade created the sprites
+    layer_gids = {}
+    gid_blocks = []
+    layers = []
+    for layer in tiled_map.layers:
+        info = {"name": layer.name, "properties": layer.properties or None}
+        if isinstance(layer, pytiled_parser.TileLayer) and layer.data is not None:
+            flat = [gid for row in layer.data for gid in row]
+            info["tile_width"] = layer.size.width
+            info["tile_height"] = layer.size.height
+            info["gid_offset"] = sum(len(block) for block in gid_blocks)
+            gid_blocks.append(flat)
+            layer_gids[layer.name] = [gid for gid in flat if gid]
+        elif isinstance(layer, pytiled_parser.ObjectLayer):
+            layer_gids[layer.name] = [tiled_object.gid for tiled_object in layer.tiled_objects
+                                      if isinstance(tiled_object, pytiled_parser.tiled_object.Tile)]
+        layers.append(info)
+
+    sprite_lists = []
+    records = []
+    for name, sprite_list in tile_map.sprite_lists.items():
+        gids = layer_gids[name]
+        if len(gids) != len(sprite_list):
+            raise LevelError(f"Layer '{name}' in {map_file} has {len(sprite_list)} sprites but {len(gids)} tiles")
+        sprite_lists.append({"name": name, "visible": sprite_list.visible,
+                             "sprite_offset": len(records), "sprite_count": len(sprite_list)})
+        for gid, sprite in zip(gids, sprite_list):
+            if type(sprite) is not arcade.Sprite:
+                raise LevelError(f"Layer '{name}' in {map_file} has a {type(sprite).__name__}, the level cache only stores plain sprites")
+            texture_index(gid)
+            records.append(SPRITE_FORMAT.pack(
+                gid, sprite.center_x, sprite.center_y, sprite.width, sprite.height, sprite.scale, sprite.angle,
+                sprite.alpha,
+                table_index(sprite.properties, properties_table, properties_indexes) if sprite.properties else -1,
+                table_index([list(point) for point in sprite.hit_box], hit_boxes, hit_box_indexes)))
+
+    tables = json.dumps({
+        "width": tile_map.width, "height": tile_map.height,
+        "tile_width": tile_map.tile_width, "tile_height": tile_map.tile_height,
+        "layers": layers,
+        "sprite_lists": sprite_lists,
+        "textures": [textures[texture_indexes[gid]] | {"gid": gid} for gid in texture_indexes],
+        "hit_boxes": hit_boxes,
+        "properties": properties_table,
+    }, default=str).encode("utf-8")
+
+    gid_array = struct.pack(f"<{sum(len(block) for block in gid_blocks)}{GID_FORMAT}",
+                            *(gid for block in gid_blocks for gid in block))
+
+    # Other processes may have the old cache memory-mapped, or be compiling the same level, so the cache is
+    # written to a file of this process and then swapped in. The old file is never truncated under them.
+    file_path = cache_path(map_file)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    temporary_path = f"{file_path}.{os.getpid()}.tmp"
+    try:
+        with open(temporary_path, "wb") as file:
+            file.write(HEADER_FORMAT.pack(CACHE_MAGIC, CACHE_VERSION, scaling, content_hash, len(tables)))
+            file.write(tables)
+            file.write(gid_array)
+            file.write(b"".join(records))
+        os.replace(temporary_path, file_path)
+    except OSError:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+
+def read_header(cache_file):
+    with open(cache_file, "rb") as file:
+        data = file.read(HEADER_FORMAT.size)
+    if len(data) < HEADER_FORMAT.size:
+        return None
+    return HEADER_FORMAT.unpack(data)
+
+
+def is_up_to_date(map_file, scaling=SPRITE_SCALING_TILES):
+    """ True if the cache exists and was made from these exact level files with this scaling """
+    cache_file = cache_path(map_file)
+    if not os.path.exists(cache_file):
+        return False
+    header = read_header(cache_file)
+    if header is None:
+        return False
+    magic, version, cached_scaling, content_hash, _ = header
+    return (magic == CACHE_MAGIC and version == CACHE_VERSION and cached_scaling == scaling
+            and content_hash == level_hash(map_file))
+
+
+def load_tilemap(map_file, scaling=SPRITE_SCALING_TILES, lazy=False):
+    """ Load a level from its cache, compiling the .tmx file first if the cache is missing or stale.
+    With lazy=True the sprite lists don't touch OpenGL until they are drawn or initialize()d, so
+    the level can be loaded on another thread, as long as its cache is up to date """
+    if not is_up_to_date(map_file, scaling):
+        compile_level(map_file, scaling)
+
+    map_directory = os.path.dirname(os.path.abspath(map_file))
+    with open(cache_path(map_file), "rb") as file:
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+        _, _, _, _, tables_length = HEADER_FORMAT.unpack_from(data, 0)
+        offset = HEADER_FORMAT.size
+        tables = json.loads(bytes(data[offset:offset + tables_length]))
+        offset += tables_length
+
+        tile_map = CachedTileMap()
+        tile_map.width = tables["width"]
+        tile_map.height = tables["height"]
+        tile_map.tile_width = tables["tile_width"]
+        tile_map.tile_height = tables["tile_height"]
+
+        gid_count = 0
+        for layer in tables["layers"]:
+            tile_map.layer_properties.append((layer["name"], layer["properties"]))
+            if "gid_offset" in layer:
+                count = layer["tile_width"] * layer["tile_height"]
+                start = offset + layer["gid_offset"] * 4
+                gids = memoryview(data)[start:start + count * 4].cast(GID_FORMAT)
+                tile_map.tile_gids[layer["name"]] = (layer["tile_width"], layer["tile_height"], gids.tolist())
+                gids.release()
+                gid_count += count
+        offset += gid_count * 4
+
+        # Every texture is cut out once, and shared by all sprites using it.
+        # The hit boxes come from the cache, so arcade doesn't have to work them out again.
+        textures = {}
+        for texture in tables["textures"]:
+            textures[texture["gid"]] = arcade.load_texture(
+                os.path.join(map_directory, texture["file"]),
+                texture["x"], texture["y"], texture["width"], texture["height"],
+                flipped_horizontally=texture["flipped_horizontally"],
+                flipped_vertically=texture["flipped_vertically"],
+                flipped_diagonally=texture["flipped_diagonally"],
+                hit_box_algorithm="None")
+        hit_boxes = [tuple(tuple(point) for point in hit_box) for hit_box in tables["hit_boxes"]]
+        properties_table = tables["properties"]
+
+        for info in tables["sprite_lists"]:
+            sprite_list = arcade.SpriteList(lazy=lazy)
+            sprite_list.visible = info["visible"]
+            start = offset + info["sprite_offset"] * SPRITE_FORMAT.size
+            end = start + info["sprite_count"] * SPRITE_FORMAT.size
+            for gid, center_x, center_y, width, height, scale, angle, alpha, properties_index, hit_box_index \
+                    in SPRITE_FORMAT.iter_unpack(data[start:end]):
+                sprite = arcade.Sprite(texture=textures[gid], scale=scale, center_x=center_x, center_y=center_y)
+                sprite.width = width
+                sprite.height = height
+                sprite.angle = angle
+                sprite.alpha = alpha
+                if properties_index >= 0:
+                    sprite.properties = dict(properties_table[properties_index])
+                sprite.hit_box = hit_boxes[hit_box_index]
+                sprite_list.append(sprite)
+            tile_map.sprite_lists[info["name"]] = sprite_list
+    finally:
+        data.close()
+
+    return tile_map
+
+
+def main():
+    """ Compile all levels into the level cache """
+    parser = argparse.ArgumentParser(description="Compile the .tmx levels into the binary level cache")
+    parser.add_argument("levels", nargs="*", help="levels to compile, default is every .tmx in the level folder")
+    parser.add_argument("--force", action="store_true", help="compile even if the cache is up to date")
+    args = parser.parse_args()
+
+    levels = args.levels or sorted(glob.glob(os.path.join(path(LEVEL_FOLDER), "*.tmx")))
+    for map_file in levels:
+        if not args.force and is_up_to_date(map_file):
+            print(f"{map_file} is up to date")
+            continue
+        start = time.perf_counter()
+        try:
+            compile_level(map_file)
+        except LevelError as error:
+            print(f"Could not compile {map_file}: {error}")
+            continue
+        print(f"Compiled {map_file} in {time.perf_counter() - start:.3f} s, {os.path.getsize(cache_path(map_file))} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+# Level progression for the Skap platforming game.
+# The levels are played in the order of levels.json in the level folder. When the
+# player walks off the right end of a level, the next one starts.
+#
+# The next level is loaded while the current one is played: a loader thread reads its
+# level cache, cuts out its textures, makes its sprites and merges its wall tiles
+# (see level_cache.py and level.py). Switching level then only builds the scene and
+# the physics engine from what is already loaded. Sprite lists are made lazy on the
+# loader thread, since OpenGL can only be used on the main thread.
+
+import concurrent.futures, json, time
+from constants import *
+from level import LevelError, merge_wall_shapes
+from chunks import is_streamed_map
+from log import log
+import level_cache
+
+LEVEL_MANIFEST = "skap_plattformer/assets/levels/levels.json"
+
+
+class LevelManifest:
+    """ The map files of the levels, in the order they are played """
+
+    def __init__(self, maps, names):
+        self.maps = maps
+        self.names = names
+
+    @classmethod
+    def load(cls, file_path=LEVEL_MANIFEST):
+        try:
+            with open(path(file_path)) as file:
+                levels = json.load(file)["levels"]
+            maps = [level["map"] for level in levels]
+            names = [level.get("name", level["map"]) for level in levels]
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as error:
+            raise LevelError(f"Could not read the level manifest {file_path}: {error}")
+        if not maps:
+            raise LevelError(f"The level manifest {file_path} has no levels")
+        return cls(maps, names)
+
+    def __len__(self):
+        return len(self.maps)
+
+    def number(self, map_name):
+        """ Level number of a map, counting from 1. None for maps that aren't in the manifest """
+        if map_name in self.maps:
+            return self.maps.index(map_name) + 1
+        return None
+
+    def name(self, map_name):
+        number = self.number(map_name)
+        return self.names[number - 1] if number is not None else map_name
+
+    def next(self, map_name):
+        """ The map after this one. After the last level, and after maps that aren't in the manifest,
+        the first level comes again """
+        number = self.number(map_name)
+        if number is None or number == len(self.maps):
+            return self.maps[0]
+        return self.maps[number]
+
+
+class PreparedLevel:
+    """ A level loaded by the LevelPreloader, ready to be set up """
+
+    def __init__(self, map_name, tile_map, wall_shapes, load_time):
+        self.map_name = map_name
+        # CachedTileMap with lazy sprite lists
+        self.tile_map = tile_map
+        # Merged wall shapes, the same as compile_level() would make
+        self.wall_shapes = wall_shapes
+        # Seconds the loader thread took
+        self.load_time = load_time
+
+
+def prepare_level(map_name):
+    """ Load everything of a level that doesn't need OpenGL. Runs on the loader thread """
+    start = time.perf_counter()
+    tile_map = level_cache.load_tilemap(path(map_name), SPRITE_SCALING_TILES, lazy=True)
+    wall_layers = []
+    for name, properties in tile_map.layer_properties:
+        if properties and properties.get("collision_type") == "wall" and name in tile_map.sprite_lists:
+            if "friction" not in properties:
+                raise LevelError(f"Wall layer '{name}' has no friction")
+            wall_layers.append((tile_map.sprite_lists[name], properties["friction"]))
+    return PreparedLevel(map_name, tile_map, merge_wall_shapes(wall_layers), time.perf_counter() - start)
+
+
+class LevelPreloader:
+    """ Loads one level ahead on a loader thread """
+
+    def __init__(self):
+        self.executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="level loader")
+        self.map_name = None
+        self.future = None
+
+    def preload(self, map_name):
+        """ Start loading a level. Streamed maps and levels whose cache is stale are loaded when they start,
+        compiling the level cache makes sprite lists, which needs the main thread """
+        if map_name == self.map_name:
+            return
+        self.map_name = None
+        self.future = None
+        if is_streamed_map(map_name) or not level_cache.is_up_to_date(path(map_name)):
+            return
+        self.map_name = map_name
+        self.future = self.executor.submit(prepare_level, map_name)
+
+    def take(self, map_name):
+        """ The prepared level, waiting for the loader thread if it isn't done yet.
+        None if that level isn't being preloaded or failed to load, it is then loaded the normal way """
+        if map_name != self.map_name:
+            return None
+        future = self.future
+        self.map_name = None
+        self.future = None
+        try:
+            return future.result()
+        except (LevelError, OSError) as error:
+            log.warning("level", "Could not preload {}: {}", map_name, error)
+            return None
+
+    def close(self):
+        """ Stop the loader thread, a level it is loading is dropped """
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,170 @@
+# Logging for the Skap platforming game.
+# Writing to stdout while playing takes time, and much more when stdout is a pipe or
+# a file, which shows up as frame spikes. Messages are therefore only put in a ring
+# buffer by the game, and a flusher thread formats and writes them a few times a
+# second.
+#
+# Every message has a level and a category ("level", "pick_up", "save", ...). A message
+# below the level of its category returns right away, before anything is formatted, so
+# debug messages cost next to nothing when they are off. The arguments are formatted
+# into the message by the flusher thread, so only pass values that don't change.
+#
+# Writing doesn't take a lock. Every message gets a sequence number and goes in slot
+# number % size. If the game writes faster than the flusher keeps up, the oldest
+# messages are overwritten, and the flusher writes how many were lost.
+#
+# Turn on more messages with the SKAP_LOG environment variable, a level for all
+# categories and/or category=level pairs:
+#     SKAP_LOG=debug python main.py
+#     SKAP_LOG=warning,pick_up=debug python main.py
+
+import atexit, itertools, os, sys, threading, time
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVEL_NAMES = {"debug": DEBUG, "info": INFO, "warning": WARNING, "error": ERROR}
+
+# Messages kept until the flusher writes them
+LOG_BUFFER_SIZE = 4096
+# Seconds between flushes. Errors are written right away.
+LOG_FLUSH_INTERVAL = 0.1
+
+
+class Logger:
+    """ Messages by level and category, written to a stream by a flusher thread """
+
+    def __init__(self, size=LOG_BUFFER_SIZE, level=INFO, stream=None):
+        self.size = size
+        # (sequence number, time, level, category, message, arguments) or None
+        self.slots = [None] * size
+        self.sequence = itertools.count()
+        # Sequence number of the next message to write
+        self.next_to_write = 0
+        self.start_time = time.perf_counter()
+
+        # Lowest level that is written, for every category, and for the categories not in there
+        self.default_level = level
+        self.levels = {}
+        # None writes to sys.stdout as it is at the time, so redirecting stdout works
+        self.stream = stream
+
+        # Only one thread writes at a time, the flusher or a flush() on close
+        self.write_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.closed = False
+        self.thread = None
+
+    def set_level(self, level, category=None):
+        if category is None:
+            self.default_level = level
+        else:
+            self.levels[category] = level
+
+    def configure(self, text):
+        """ Levels from text like "warning,pick_up=debug", see SKAP_LOG above """
+        for part in text.split(","):
+            category, _, name = part.strip().rpartition("=")
+            level = LEVEL_NAMES.get(name.lower())
+            if level is not None:
+                self.set_level(level, category or None)
+
+    def enabled(self, level, category):
+        return level >= self.levels.get(category, self.default_level)
+
+    def log(self, level, category, message, *args):
+        """ Put a message in the buffer. args are put into the {} of the message when it is written """
+        if level < self.levels.get(category, self.default_level):
+            return
+        number = next(self.sequence)
+        self.slots[number % self.size] = (number, time.perf_counter(), level, category, message, args)
+        if level >= ERROR:
+            self.wake.set()
+        if self.thread is None:
+            self.start()
+
+    def debug(self, category, message, *args):
+        if DEBUG >= self.levels.get(category, self.default_level):
+            self.log(DEBUG, category, message, *args)
+
+    def info(self, category, message, *args):
+        if INFO >= self.levels.get(category, self.default_level):
+            self.log(INFO, category, message, *args)
+
+    def warning(self, category, message, *args):
+        if WARNING >= self.levels.get(category, self.default_level):
+            self.log(WARNING, category, message, *args)
+
+    def error(self, category, message, *args):
+        if ERROR >= self.levels.get(category, self.default_level):
+            self.log(ERROR, category, message, *args)
+
+    def start(self):
+        with self.write_lock:
+            if self.thread is None and not self.closed:
+                self.thread = threading.Thread(target=self.run, name="log flusher", daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while not self.closed:
+            self.wake.wait(LOG_FLUSH_INTERVAL)
+            self.wake.clear()
+            self.flush()
+
+    def flush(self):
+        """ Write every message in the buffer """
+        with self.write_lock:
+            lines = []
+            while True:
+                record = self.slots[self.next_to_write % self.size]
+                if record is None or record[0] < self.next_to_write:
+                    # Not written yet
+                    break
+                if record[0] > self.next_to_write:
+                    # Overwritten before it was written. The oldest one left is a buffer length back.
+                    oldest = record[0] - self.size + 1
+                    lines.append(f"[log] {oldest - self.next_to_write} messages lost, the log buffer was full\n")
+                    self.next_to_write = oldest
+                    continue
+                lines.append(self.format(record))
+                self.next_to_write += 1
+            if lines:
+                stream = self.stream or sys.stdout
+                try:
+                    stream.write("".join(lines))
+                    stream.flush()
+                except (OSError, ValueError):
+                    # The stream is closed, on exit for example
+                    pass
+
+    def format(self, record):
+        _, when, level, category, message, args = record
+        if args:
+            try:
+                message = message.format(*args)
+            except (IndexError, KeyError, ValueError) as error:
+                message = f"{message} {args} (could not format: {error})"
+        prefix = "" if level == INFO else f"{level_name(level).upper()} "
+        return f"[{when - self.start_time:8.3f} {category}] {prefix}{message}\n"
+
+    def close(self):
+        """ Stop the flusher and write what is left """
+        self.closed = True
+        self.wake.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.flush()
+
+
+def level_name(level):
+    for name, value in LEVEL_NAMES.items():
+        if value == level:
+            return name
+    return str(level)
+
+
+# The log of the game, used by every module
+log = Logger()
+log.configure(os.environ.get("SKAP_LOG", ""))
+atexit.register(log.close)
@@ -1,149 +1,117 @@
 # Skap platforming game
 
-# importing modules and libraries as needed
-import arcade, os, json
-from PIL import Image
-
-
-# More convenient way to find files
-def path(file_address):
-    return os.path.realpath(f"{__file__}/../../../{file_address}")
+# The startup report counts from here
+import time
+START_TIME = time.perf_counter()
+
+# importing modules and libraries as needed. Modules only the loading stages need are imported there.
+import arcade, math, os, json
+from constants import *
+from culling import SceneRenderer
+from hud import Hud
+from levels import LevelPreloader
+from log import log
+from pool import SpritePool
+from profiler import Profiler, ProfilerOverlay
+from savestate import Autosaver, SaveError
+from entities import INPUT_FIELDS
+from simulation import GameSimulation, PLAYER_HIT_BOX
+from replay import InputRecorder, FAST_FORWARD_STEPS
+from startup import Startup, StartupStage
 
 
 """
 Example of Pymunk Physics Engine Platformer
 """
 
-SCREEN_TITLE = "PyMunk Platformer"
-
-# How big are our image tiles?
-GRID_PIXEL_SIZE = 128
-
-# Scale sprites up or down
-SPRITE_SCALING_PLAYER = 0.5
-SPRITE_SCALING_TILES = 0.5
-
-# Scaled sprite size for tiles
-SPRITE_SIZE = int(GRID_PIXEL_SIZE*0.4)
-
-# Size of grid to show on screen, in number of tiles
-SCREEN_GRID_WIDTH = 25
-SCREEN_GRID_HEIGHT = 15
-
-# Size of screen to show, in pixels
-SCREEN_WIDTH = SPRITE_SIZE * SCREEN_GRID_WIDTH
-SCREEN_HEIGHT = SPRITE_SIZE * SCREEN_GRID_HEIGHT
-
-# GUI placements
-TIMER_FROM_RIGHT = 38
-TIMER_FROM_TOP = 20
-SCORE_FROM_LEFT = 20
-SCORE_FROM_TOP = 20
-
-# Constants for color
-WHITE = arcade.color.WHITE
-
-# --- Physics forces. Higher number, faster accelerating.
-
-# Gravity
-GRAVITY = 2500
-
-# Damping - Amount of speed retained per second
-DEFAULT_DAMPING = 1.0
-PLAYER_DAMPING = 0.3
-
-# Friction between objects
-PLAYER_FRICTION = 2.0
-WALL_FRICTION = 0.7
-DYNAMIC_ITEM_FRICTION = 0.6
-
-# Mass (defaults to 1)
-PLAYER_MASS = 2.0
-
-# Player constants
-PLAYER_MAX_HORIZONTAL_SPEED = 520
-PLAYER_MAX_VERTICAL_SPEED = 1600
-PLAYER_MAX_CLIMB_SPEED = 300
-PLAYER_MOVE_FORCE_ON_GROUND = 8500
-PLAYER_MOVE_FORCE_IN_AIR = 3000
-PLAYER_CLIMB_FORCE = 2000
-PLAYER_JUMP_FORCE = 1400
-PLAYER_JUMP_SODA_BOOST = 250
-PLAYER_CLIMB_SPEED = 10
-
-class MyGame(arcade.Window):
+class MyGame(GameSimulation, arcade.Window):
     """ Main Window """
 
     def __init__(self, width, height, title):
         """ Create the variables """
 
-        # Init the parent class
-        super().__init__(width, height, title, resizable=True)
-
-        # Init the tile map
-        self.tile_map = None
-        self.end_of_map = None
-        self.friction = None
-
-        # Level
-        self.level = 1
-
-        # Scene object
-        self.scene = None
-
-        # Physics engine
-        self.physics_engine = None
+        # Init the parent classes
+        arcade.Window.__init__(self, width, height, title, resizable=True)
+        GameSimulation.__init__(self)
 
         # Cameras
         self.player_camera = None
         self.gui_camera = None
 
-        # Score
-        self.score = 0
-        self.score_text = ""
+        # Draws the part of the scene the player camera sees. F2 shows the hit boxes.
+        self.scene_renderer = None
 
-        # Timer
-        self.total_time = 0.0
-        self.real_timer_from_right = 60
-        self.clock_text = ""
-        self.minutes = 0
-        self.seconds = 0
-        self.milliseconds = 0
+        # Bits flying out of picked up items, made once per level
+        self.particle_pool = None
 
-        # Load sounds
-        self.collect_coin_sound = arcade.load_sound(":resources:sounds/coin1.wav")
-        self.jump_sound = arcade.load_sound(":resources:sounds/phaseJump1.wav")
-        self.big_jump_sound = arcade.load_sound(":resources:sounds/jump3.wav")
-        self.land_sound = arcade.load_sound(":resources:sounds/rockHit2.ogg")
+        # Sounds, decoded into memory once (see audio.py). Loaded by the startup.
+        self.audio = None
+
+        # Player animation frames, loaded by the startup
+        self.animations = None
+        self.player_animator = None
 
         # Set background color
         arcade.set_background_color(arcade.color.AMAZON)
 
-        # Sprite lists we need
-        self.player_list = None
-        self.wall_list = None
-        self.bullet_list = None
-        self.item_list = None
-        self.coin_list = None
-        self.ice_list = None
-
-        # Track the current state of what key is pressed
-        self.left_pressed: bool = False
-        self.right_pressed: bool = False
-        self.up_pressed: bool = False
-        self.down_pressed: bool = False
-
-        self.player = {}
-        self.damping = 0
-        self.gravity = 0
-
-
         self.screen_width = SCREEN_WIDTH
         self.screen_height = SCREEN_HEIGHT
 
-        # region animations.
-
-        # endregion
+        # Score and timer
+        self.hud = Hud(self.screen_width, self.screen_height)
+
+        # Region timings. F3 shows them, F4 saves them as a Chrome trace
+        self.profiler = Profiler()
+        self.profiler_overlay = ProfilerOverlay(self.profiler, self.screen_width, self.screen_height)
+
+        # Saves the game a few times a second, F8 continues from there. F6 makes a quick save and F7 loads it.
+        self.autosaver = Autosaver(path("skap_plattformer/saves"))
+        self.quick_saver = Autosaver(path("skap_plattformer/saves"), "quicksave")
+
+        # Hold TAB to fast-forward a replay
+        self.fast_forward = False
+
+        # The next level is loaded while this one is played (see levels.py)
+        self.level_preloader = LevelPreloader()
+
+        # The window is open now. The rest is loaded behind a loading screen (see startup.py).
+        self.startup = Startup([
+            StartupStage("sounds", self.load_sounds, background=True),
+            StartupStage("animations", self.load_animations, background=True),
+            StartupStage("texture atlas", self.pack_animations),
+            StartupStage("level", self.setup),
+        ], START_TIME)
+
+    # region Loading stages
+    def load_sounds(self):
+        from audio import AudioManager
+        audio = AudioManager()
+        self.collect_coin_sound = audio.load(":resources:sounds/coin1.wav")
+        self.jump_sound = audio.load(":resources:sounds/phaseJump1.wav")
+        self.big_jump_sound = audio.load(":resources:sounds/jump3.wav")
+        self.land_sound = audio.load(":resources:sounds/rockHit2.ogg")
+        self.audio = audio
+
+    def load_animations(self):
+        """ Decoded frames come from the disk cache """
+        from animations import AnimationLibrary, PlayerAnimator
+        animations = AnimationLibrary.load()
+        self.player_animator = PlayerAnimator(animations)
+        self.animations = animations
+
+    def pack_animations(self):
+        """ Every frame goes in the texture atlas now, so none is uploaded while playing. One texture per step """
+        atlas = self.ctx.default_atlas
+        # Growing the atlas copies everything in it, so it is made big enough once, before it fills up.
+        # Packing leaves gaps, so it gets about twice the area of the frames.
+        area = 2 * sum(texture.image.width * texture.image.height for texture in self.animations.textures())
+        size = atlas.width
+        while size * size < area and size < atlas.max_width:
+            size *= 2
+        if size > atlas.width:
+            atlas.resize((size, size))
+        return (atlas.add(texture) for texture in self.animations.textures())
+    # endregion
 
     def setup(self):
         """ Set up everything with the game """
@@ -153,352 +121,142 @@ class MyGame(arcade.Window):
         self.gui_camera = arcade.Camera(self.screen_width, self.screen_height)
         # endregion
 
-        # region Map
-        map_name = "skap_plattformer/assets/levels/secretTestLevel.tmx"
-
-        # Load in TileMap
-        self.tile_map = arcade.load_tilemap(path(map_name), SPRITE_SCALING_TILES)
-        self.scene = arcade.Scene.from_tilemap(self.tile_map)
-        self.end_of_map = self.tile_map.width * GRID_PIXEL_SIZE
-
-        self.score = 0
-
-        # Create the missing sprite lists
-        self.player_list = arcade.SpriteList()
-        self.bullet_list = arcade.SpriteList()
-        print('\nSprite list:')
-        print(arcade.SpriteList())
-
-        layers = ["BackgroundTile", "Ground", "Ice", "Ladder", "DecorationBehindPlayer", "Player", "DynamicItem",
-                  "Item", "Coin", "Platform", "DecorationInFrontPlayer"]
-        if "BackgroundTile" not in self.scene.name_mapping:
-            self.scene.add_sprite_list("BackgroundTile")
-
-
-        previous_layer = "BackgroundTile"
-        for name in layers:
-            if name not in self.scene.name_mapping:
-                self.scene.add_sprite_list_after(name, previous_layer)
-                previous_layer = name
-
-        for layer in self.tile_map.tiled_map.layers:
-            if layer.properties:
-                if not self.scene[layer.name]:
-                    self.scene.add_sprite_list(layer.name)
-                self.scene[layer.name].properties = layer.properties
-                print(f"Added {layer.properties} to {layer.name}")
-
-        print(self.scene["Ground"].properties)
-        # endregion
-
-        # region Player
-        image_source = path("skap_plattformer/assets/player/player_right.png")
-        self.player = arcade.Sprite(image_source, 1, hit_box_algorithm='Simple')
-
-        if "Player" not in self.scene.name_mapping:
-            self.scene.add_sprite_list_before("Player", "DecorationInFrontPlayer")
-
-        self.scene.add_sprite("Player", self.player)
-        self.player.newJump = True
-        self.player.jump_boost_soda = 0
-        self.player.on_ladder = False
-        self.player.on_ground = False
-        self.player.air_time = 0
-        self.player.animation_frame = 0
-        self.player.jump_right_sprites = self.load_animation_sprite_sheet("jump_right", path("skap_plattformer/assets/player/jump_right_sprite_sheet.png"), 35)
-        print(len(self.player.jump_right_sprites))
-        self.player.texture = self.player.jump_right_sprites[7]
-
-        self.player.hit_box = ((-14.5, -20.0), (-11.5, -25.0), (7.5, -25.0), (8.5, -20.0), (8.5, 18.0), (4.5, 22.0), (-2.5, 22.0), (-14.5, 10.0))
-        print(self.player.hit_box)
-        grid_x = 3
-        grid_y = 3
-        self.player.center_x = SPRITE_SIZE * grid_x + SPRITE_SIZE / 2
-        self.player.center_y = SPRITE_SIZE * grid_y + SPRITE_SIZE / 2
+        # Level, player and physics
+        super().setup()
 
+        # region Particles
+        particle_list = arcade.SpriteList()
+        self.particle_pool = SpritePool.preallocate(particle_list, PARTICLE_POOL_SIZE, self.make_particle)
+        self.scene.add_sprite_list_before("Particle", "DecorationInFrontPlayer", sprite_list=particle_list)
         # endregion
 
-        # Damping means the fraction of speed that you still have after 1 second.
-        self.damping = DEFAULT_DAMPING
-
-        # Set the gravity. (0, 0) is good for outer space and top-down.
-        self.gravity = (0, -GRAVITY)
-
-        # region The physics engine
-        self.physics_engine = arcade.PymunkPhysicsEngine(damping=self.damping, gravity=self.gravity)
-
-        # Add the player.
-        self.physics_engine.add_sprite(self.player,
-                                       damping=PLAYER_DAMPING,
-                                       friction=PLAYER_FRICTION,
-                                       mass=PLAYER_MASS,
-                                       moment=arcade.PymunkPhysicsEngine.MOMENT_INF,
-                                       collision_type="player",
-                                       max_horizontal_velocity=PLAYER_MAX_HORIZONTAL_SPEED,
-                                       max_vertical_velocity=PLAYER_MAX_VERTICAL_SPEED),
-
-        # STATIC means cant move, DYNAMIC can move, KINEMATIC means can move, but has to be coded in.
-        print(self.scene["Ground"].properties)
-
-        # Add the ground spritelists
-        for name in self.scene.name_mapping:
-            hit_sprite_list = self.scene.get_sprite_list(name)
-            if hit_sprite_list.properties['collision_type'] == "wall":
-                self.physics_engine.add_sprite_list(self.scene[name],
-                                                    friction=self.scene[name].properties["friction"],
-                                                    collision_type="wall",
-                                                    body_type=arcade.PymunkPhysicsEngine.STATIC)
-
-        # Add the items
-        self.physics_engine.add_sprite_list(self.scene["Item"],
-                                            friction=DYNAMIC_ITEM_FRICTION,
-                                            mass = 0.75,
-                                            collision_type="item")
+        # region Drawing
+        # Layers whose sprites move are drawn whole, the rest only where the camera is
+        dynamic_layers = {"Player", "Bullet", "Particle"}
+        for name, sprite_list in self.scene.name_mapping.items():
+            if any(sprite_list is item_list for item_list in self.compiled_level.item_layers):
+                dynamic_layers.add(name)
+        if self.chunk_streamer is not None:
+            # Streamed chunks come and go, and are only loaded around the view anyway
+            dynamic_layers.update(layer.name for layer in self.chunk_streamer.layers)
+        show_hit_boxes = self.scene_renderer is not None and self.scene_renderer.show_hit_boxes
+        self.scene_renderer = SceneRenderer(self.scene, dynamic_layers, self.pick_up_pools.values())
+        self.scene_renderer.show_hit_boxes = show_hit_boxes
         # endregion
 
-    def load_level(self):
-        pass
-
-    def on_update(self, delta_time):
-        """ Movement and game logic """
-
-        # region Player Left/Right
-        self.player.on_ground = self.physics_engine.is_on_ground(self.player)
-        # Update player forces based on keys pressed
-        if self.left_pressed and not self.right_pressed:
-            # Create a force to the left. Apply it.
-            if self.player.on_ground:
-                force = (-PLAYER_MOVE_FORCE_ON_GROUND, 0)
-
-            else: # Bole er bøg
-                force = (-PLAYER_MOVE_FORCE_IN_AIR, 0)
-            self.physics_engine.apply_force(self.player, force)
-            # Set friction to zero for the player while moving
-            self.physics_engine.set_friction(self.player, 0)
-        elif self.right_pressed and not self.left_pressed:
-            # Create a force to the right. Apply it.
-            if self.player.on_ground:
-                force = (PLAYER_MOVE_FORCE_ON_GROUND, 0)
-                self.player.animation_frame += 1
-            else:
-                force = (PLAYER_MOVE_FORCE_IN_AIR, 0)
-            self.physics_engine.apply_force(self.player, force)
-            # Set friction to zero for the player while moving
-            self.physics_engine.set_friction(self.player, 0)
-        else:
-            # Player's feet are not moving. Therefore, up the friction so we stop.
-            self.physics_engine.set_friction(self.player, 1.0)
-        # endregion
-
-        # region Jump mechanics
-
-        # Do the jump
-        if self.player.on_ground and not self.player.on_ladder:
-            if self.player.newJump:
-                if self.up_pressed and not self.down_pressed:
-                    if self.player.on_ground:
-                        self.player.newJump = False
-
-                        self.physics_engine.apply_impulse(
-                            self.player, [0, PLAYER_JUMP_FORCE + PLAYER_JUMP_SODA_BOOST * self.player.jump_boost_soda])
-                        arcade.play_sound(self.jump_sound)
-
-        # Extending the jump
-        if not self.player.on_ground and not self.player.on_ladder:
-            self.player.air_time += 1
-
-            if self.up_pressed and not self.down_pressed and self.player.air_time < 11 and not self.player.newJump:
-                self.physics_engine.apply_force(self.player, (0, 3500+self.player.jump_boost_soda * PLAYER_JUMP_SODA_BOOST))
-            if self.up_pressed and not self.down_pressed and self.player.air_time < 17 and not self.player.newJump:
-                self.physics_engine.apply_force(self.player, (0, 2500+self.player.jump_boost_soda * PLAYER_JUMP_SODA_BOOST))
-
-            else:
-                self.player.air_time = 1000
+        # Stream in the chunks that fit in the window
+        if self.chunk_streamer is not None:
+            self.chunk_streamer.view_width = self.screen_width
+            self.chunk_streamer.view_height = self.screen_height
 
-
-            if self.down_pressed and not self.up_pressed:
-                self.physics_engine.apply_force(self.player, (0, -5000))
-
-
-
-        else:
-            self.player.air_time = 0
-
-
-        if not self.up_pressed:
-            self.player.newJump = True
+        # region Player animations
+        self.player.jump_right_sprites = self.animations.clip("jump_right")
+        log.debug("animation", "{} jump frames", len(self.player.jump_right_sprites))
+        self.player.texture = self.player.jump_right_sprites[7]
+        # The texture sets its own hit box, put ours back
+        self.player.hit_box = PLAYER_HIT_BOX
+        self.player_animator.reset()
+        # Co-op players come right after the first player in the store
+        for index in range(self.coop_players):
+            self.players.sprites[index + 1].color = COOP_COLORS[index]
         # endregion
 
-        # region Climbing
-        ladder_hit_list = arcade.check_for_collision_with_list(
-            self.player, self.scene["Ladder"]
-        )
-
-        if ladder_hit_list:
-            self.player.on_ladder = True
-        else:
-            self.player.on_ladder = False
+    def soft_reset(self):
+        """ Restart the level, see GameSimulation.soft_reset """
+        super().soft_reset()
+        self.reset_view()
 
-        if self.player.on_ladder:
-            self.physics_engine.gravity = (0, 0)
-            self.physics_engine.damping = 0.01
-            self.physics_engine.max_vertical_velocity = PLAYER_MAX_CLIMB_SPEED
+    def load_state(self, state):
+        """ Continue from a saved state, see GameSimulation.load_state """
+        super().load_state(state)
+        self.reset_view()
 
-            if self.up_pressed and not self.down_pressed:
-                force = (0, PLAYER_CLIMB_FORCE)
-                self.physics_engine.apply_force(self.player, [0, PLAYER_CLIMB_FORCE*100])
-                # self.physics_engine.set_velocity(self.player, [self.physics_engine.get_physics_object(self.player).body.velocity.x, 300])
-                # Set friction to zero for the player while moving
-                self.physics_engine.set_friction(self.player, 0)
+    def reset_view(self):
+        """ Clear what is only for show after the level jumped to another state """
+        self.particle_pool.deactivate_all()
+        self.player_animator.reset()
+        self.center_camera_on_player()
+        self.hud.update(self)
 
-            elif self.down_pressed and not self.up_pressed:
-                force = (0, -PLAYER_CLIMB_FORCE)
-                self.physics_engine.apply_force(self.player, [0, -PLAYER_CLIMB_FORCE])
+    def load_level(self, map_name=None):
+        """ Go on to the next level, see GameSimulation.load_level """
+        start = time.perf_counter()
+        super().load_level(map_name)
+        self.reset_view()
+        log.info("level", "Level {}: {}, switched in {:.0f} ms", self.level, self.levels.name(self.map_name),
+                 (time.perf_counter() - start) * 1000)
 
-                self.physics_engine.set_friction(self.player, 0)
+    def on_update(self, delta_time):
+        """ Movement and game logic """
+        if not self.startup.update():
+            return
 
-            else:
-                self.physics_engine.set_velocity(self.player, [self.physics_engine.get_physics_object(self.player).body.velocity.x, 0])
+        profiler = self.profiler
+        profiler.begin_frame()
 
+        # Run the game logic and physics in fixed steps
+        if self.replayer is not None and self.fast_forward:
+            # Skip drawing the steps in between, only the last one is shown
+            self.replayer.fast_forward(self, FAST_FORWARD_STEPS)
         else:
-            self.physics_engine.damping = 0.3
-            self.physics_engine.max_vertical_velocity = PLAYER_MAX_VERTICAL_SPEED
-            self.physics_engine.gravity = GRAVITY
-        # endregion
+            self.advance(delta_time)
 
-        # region Collision Detection
-        for name in self.scene.name_mapping:
-            hit_sprite_list = self.scene.get_sprite_list(name)
-            if hit_sprite_list.properties['collision_type'] == "pick_up":
-                hit_list = arcade.check_for_collision_with_list(self.player, self.scene[name])
-
-                for item in hit_list:
-                    item.remove_from_sprite_lists()
-                    #arcade.play_sound()
-                    run_pick_up = getattr(self, item.properties['on_pick_up'])
-                    run_pick_up(item)
-
-        # region Ladders
-        ladder_hit_list = arcade.check_for_collision_with_list(self.player, self.scene["Ladder"])
-        if ladder_hit_list:
-            self.player.on_ladder = True
-        else:
-            self.player.on_ladder = False
-        # endregion
+        # Replays stay on the level they were recorded on
+        if self.replayer is None and self.level_finished():
+            self.load_level()
 
-        self.score_text = f"Score: {int(self.score)}, there are {len(self.scene['Coin'])} remaining"
-
-        # region Keep track of time
-        self.real_timer_from_right = TIMER_FROM_RIGHT
-        self.total_time += delta_time
-        self.minutes = int(self.total_time) // 60
-        self.seconds = int(self.total_time) % 60
-        self.milliseconds = int((self.total_time - self.seconds - self.minutes*60) * 100 // 1)
-        self.clock_text = f"{self.minutes}:{self.seconds}"
-        x = 1
-        self.real_timer_from_right += 7
-        while x < len(self.clock_text):
-            self.real_timer_from_right += 14
-            x += 1
-        # endregion
+        # Only the numbers are copied here, the save is written on another thread
+        if self.replayer is None:
+            profiler.begin("autosave")
+            self.autosaver.update(self, delta_time)
 
-        # endregion
+        profiler.begin("particles")
+        self.update_particles(delta_time)
 
         # Move the camera
+        profiler.begin("camera")
         self.center_camera_on_player()
 
         # region Animation
-
-        if not self.player.on_ground and not self.player.on_ladder:
-
-            print(self.physics_engine.get_physics_object(self.player).body.velocity.y)
-            if self.physics_engine.get_physics_object(self.player).body.velocity.y > 500:
-                self.player.texture = self.player.jump_right_sprites[0]
-
-            elif self.physics_engine.get_physics_object(self.player).body.velocity.y > 400:
-                self.player.texture = self.player.jump_right_sprites[1]
-
-            elif self.physics_engine.get_physics_object(self.player).body.velocity.y > 200:
-                self.player.texture = self.player.jump_right_sprites[2]
-
-            elif self.physics_engine.get_physics_object(self.player).body.velocity.y > 50:
-                self.player.texture = self.player.jump_right_sprites[3]
-
-            elif self.physics_engine.get_physics_object(self.player).body.velocity.y > -100:
-                self.player.texture = self.player.jump_right_sprites[4]
-
-            elif self.physics_engine.get_physics_object(self.player).body.velocity.y > -300:
-                self.player.texture = self.player.jump_right_sprites[5]
-
-            elif self.physics_engine.get_physics_object(self.player).body.velocity.y > -400:
-                self.player.texture = self.player.jump_right_sprites[6]
-
-            elif self.physics_engine.get_physics_object(self.player).body.velocity.y > -500:
-                self.player.texture = self.player.jump_right_sprites[7]
-
-            elif self.physics_engine.get_physics_object(self.player).body.velocity.y > -600:
-                self.player.texture = self.player.jump_right_sprites[8]
-
-            elif self.physics_engine.get_physics_object(self.player).body.velocity.y > -700:
-                self.player.texture = self.player.jump_right_sprites[9]
-
-            elif self.physics_engine.get_physics_object(self.player).body.velocity.y > -800:
-                self.player.texture = self.player.jump_right_sprites[10]
-
-            else:
-                self.player.texture = self.player.jump_right_sprites[11]
-
-
-        if False:
-            if self.player.animation_frame > 8:
-                self.player.animation_frame = 0
-            self.player.texture = arcade.load_texture(path("skap_plattformer/assets/player/jump_right_sprite_sheet.png"),
-                                                      35 * self.player.animation_frame, 0, 35, 51,
-                                                      hit_box_algorithm='Detailed')
-
+        profiler.begin("animation")
+        self.player_animator.update(self, delta_time)
         # endregion
 
-        # Move items in the physics engine
-        self.physics_engine.step()
+        # Sounds from all the steps of this frame start together
+        profiler.begin("audio")
+        self.audio.flush()
+
+        profiler.begin("hud")
+        self.hud.update(self)
+        self.profiler_overlay.update(delta_time)
+        profiler.end()
 
     def on_draw(self):
         """ Draw everything """
+        if not self.startup.finished:
+            arcade.start_render()
+            self.startup.draw(self.screen_width, self.screen_height)
+            return
+
+        profiler = self.profiler
+        profiler.begin("draw clear")
         arcade.start_render()
 
         # Make the camera follow the player
         self.player_camera.use()
 
-        # Draw the level
-        self.scene.draw()
-        self.scene.draw_hit_boxes()
+        # Draw the level, only what is on screen
+        profiler.begin("draw scene")
+        self.scene_renderer.draw(self.player_camera)
 
         # Draw the gui
+        profiler.begin("draw gui")
         self.gui_camera.use()
-        # Draw the score counter
-        arcade.draw_text(
-            self.score_text,
-            SCORE_FROM_LEFT,
-            self.screen_height - SCORE_FROM_TOP,
-            WHITE,
-            18
-        )
-
-        # Draw the timer
-        arcade.draw_text(
-            self.clock_text,
-            self.screen_width - self.real_timer_from_right,
-            self.screen_height - TIMER_FROM_TOP,
-            WHITE,
-            18
-        )
-
-        arcade.draw_text(
-            f":{self.milliseconds}",
-            self.screen_width - TIMER_FROM_RIGHT,
-            self.screen_height - TIMER_FROM_TOP,
-            WHITE,
-            18
-        )
+        self.hud.draw(self.ctx)
+        self.profiler_overlay.draw(self.ctx)
+
+        # A frame is one update and one draw
+        profiler.end_frame()
 
     # region Misc specific functions
     def center_camera_on_player(self):
@@ -515,21 +273,38 @@ class MyGame(arcade.Window):
 
         self.player_camera.move_to(player_centered)
 
-    # region functions for items that can be picked up
-    def mushroom(self, item):
-        print("IT WOOOOOOOOOOOOOOOOOOOOORKS")
-        print("A mushroom was picked up")
-
-    def coin(self, coin):
-        print(f"A coin worth {int(coin.properties['coin_value'])} was picked up")
-        arcade.play_sound(self.collect_coin_sound)
-        self.score += coin.properties['coin_value']
-
-    def leapy_lime(self, item):
-        print("A Leapy Lime was picked up")
-        print("*energy-drink-noises*")
-        self.player.jump_boost_soda += 1
-    # endregion
+    def play_sound(self, sound):
+        self.audio.play(sound)
+
+    def make_particle(self):
+        # Particles take the texture of what they fly out of, this is the one they start with
+        particle = arcade.Sprite(texture=self.registry.texture("particle"), scale=PARTICLE_SCALING)
+        particle.lifetime = 0.0
+        return particle
+
+    def spawn_particles(self, item):
+        """ Small copies of a picked up item fly out from where it was """
+        for index in range(PICK_UP_PARTICLES):
+            particle = self.particle_pool.activate()
+            particle.texture = item.texture
+            particle.position = item.position
+            angle = 2 * math.pi * index / PICK_UP_PARTICLES
+            particle.change_x = math.cos(angle) * PARTICLE_SPEED
+            particle.change_y = math.sin(angle) * PARTICLE_SPEED + PARTICLE_SPEED
+            particle.lifetime = PARTICLE_LIFETIME
+
+    def update_particles(self, delta_time):
+        """ Particles fall and fade out, then go back in the pool """
+        for particle in self.particle_pool:
+            particle.lifetime -= delta_time
+            if particle.lifetime <= 0:
+                self.particle_pool.deactivate_later(particle)
+                continue
+            particle.change_y -= GRAVITY / 2 * delta_time
+            particle.position = (particle.center_x + particle.change_x * delta_time,
+                                 particle.center_y + particle.change_y * delta_time)
+            particle.alpha = int(255 * particle.lifetime / PARTICLE_LIFETIME)
+        self.particle_pool.deactivate_expired()
 
     def on_resize(self, width, height):
         """ This method is automatically called when the window is resized. """
@@ -539,13 +314,116 @@ class MyGame(arcade.Window):
         super().on_resize(width, height)
         self.screen_width = width
         self.screen_height = height
-        self.player_camera.resize(width, height)
-        self.gui_camera.resize(width, height)
-        print(f"Window resized to: {width}, {height}")
+        # The cameras are made when the level is loaded
+        if self.player_camera is not None:
+            self.player_camera.resize(width, height)
+            self.gui_camera.resize(width, height)
+        self.hud.resize(width, height)
+        if self.chunk_streamer is not None:
+            self.chunk_streamer.view_width = width
+            self.chunk_streamer.view_height = height
+        self.profiler_overlay.resize(width, height)
+        log.debug("window", "Window resized to: {}, {}", width, height)
+
+    def on_close(self):
+        """ Finish the saves and stop the threads and voices of the game before the window goes """
+        self.autosaver.close()
+        self.quick_saver.close()
+        self.level_preloader.close()
+        if self.chunk_streamer is not None:
+            self.chunk_streamer.close()
+        # The sounds may still be loading
+        if self.audio is not None:
+            self.audio.close()
+        super().on_close()
+
+    def toggle_recording(self):
+        """ Start recording from a fresh level, or stop and save the recording """
+        if self.recorder is None:
+            self.recorder = InputRecorder()
+            self.setup()
+            log.info("replay", "Recording started")
+        else:
+            recording = self.recorder.finish(self)
+            self.recorder = None
+            folder = path("skap_plattformer/recordings")
+            os.makedirs(folder, exist_ok=True)
+            file_path = os.path.join(folder, time.strftime("%Y-%m-%d_%H-%M-%S.skr"))
+            recording.save(file_path)
+            log.info("replay", "Saved {} steps to {}", len(recording), file_path)
+
+    def quick_load(self, saver):
+        """ Continue from the last save of an Autosaver """
+        if self.recorder is not None:
+            log.warning("save", "Stop recording before loading a save")
+            return
+        try:
+            state = saver.load()
+            if state is None:
+                log.warning("save", "Nothing saved yet")
+                return
+            self.load_state(state)
+        except SaveError as error:
+            # A save from an older version of the game, or for other ghosts
+            log.warning("save", "Could not load the save: {}", error)
+            return
+        log.info("save", "Loaded the save from step {}", state.tick_count)
+
+    def export_profile(self):
+        """ Save the kept region timings as Chrome trace JSON, open it in chrome://tracing or ui.perfetto.dev """
+        folder = path("skap_plattformer/profiles")
+        file_path = os.path.join(folder, time.strftime("%Y-%m-%d_%H-%M-%S.json"))
+        events = self.profiler.export_trace(file_path)
+        log.info("profiler", "Saved {} trace events to {}", events, file_path)
+
+    def add_coop_player(self):
+        """ One more local player, on the keys in COOP_KEYS. The level starts over """
+        if self.coop_players == len(COOP_KEYS):
+            log.warning("player", "There can't be more than {} players", len(COOP_KEYS) + 1)
+            return
+        self.coop_players += 1
+        self.setup()
+        self.reset_view()
+        log.info("player", "Player {} joined", self.coop_players + 1)
+
+    def set_coop_key(self, key, pressed):
+        """ Keys of the co-op players go straight to their row of the player store. True if it was one of them """
+        for row, keys in enumerate(COOP_KEYS[:self.coop_players], start=1):
+            if key in keys:
+                name, _ = INPUT_FIELDS[keys.index(key)]
+                getattr(self.players, name)[row] = pressed
+                return True
+        return False
 
     def on_key_press(self, key, modifiers):
         """Called whenever a key is pressed. """
 
+        # Nothing to control on the loading screen
+        if not self.startup.finished:
+            return
+
+        # Debug views work in replays too
+        if key == arcade.key.F2:
+            self.scene_renderer.toggle_hit_boxes()
+            return
+        elif key == arcade.key.F3:
+            self.profiler_overlay.toggle()
+            return
+        elif key == arcade.key.F4:
+            self.export_profile()
+            return
+
+        # The replay is in control of the player
+        if self.replayer is not None:
+            if key == arcade.key.TAB:
+                self.fast_forward = True
+            elif key == arcade.key.ESCAPE:
+                self.soft_reset()
+            return
+
+        if self.set_coop_key(key, True):
+            return
+
         if key == arcade.key.LEFT or key == arcade.key.A:
             self.left_pressed = True
         elif key == arcade.key.RIGHT or key == arcade.key.D:
@@ -554,12 +432,33 @@ class MyGame(arcade.Window):
             self.up_pressed = True
         elif key == arcade.key.DOWN or key == arcade.key.S:
             self.down_pressed = True
+        elif key == arcade.key.SPACE:
+            self.fire_pressed = True
         elif key == arcade.key.ESCAPE:
-            self.setup()
+            self.soft_reset()
+        elif key == arcade.key.F5:
+            self.toggle_recording()
+        elif key == arcade.key.F6:
+            self.quick_saver.save(self, full=True)
+            log.info("save", "Game saved")
+        elif key == arcade.key.F7:
+            self.quick_load(self.quick_saver)
+        elif key == arcade.key.F8:
+            self.quick_load(self.autosaver)
+        elif key == arcade.key.F9:
+            self.add_coop_player()
 
     def on_key_release(self, key, modifiers):
         """Called when the user releases a key. """
 
+        if self.replayer is not None:
+            if key == arcade.key.TAB:
+                self.fast_forward = False
+            return
+
+        if self.set_coop_key(key, False):
+            return
+
         if key == arcade.key.LEFT or key == arcade.key.A:
             self.left_pressed = False
         elif key == arcade.key.RIGHT or key == arcade.key.D:
@@ -568,32 +467,16 @@ class MyGame(arcade.Window):
             self.up_pressed = False
         elif key == arcade.key.DOWN or key == arcade.key.S:
             self.down_pressed = False
+        elif key == arcade.key.SPACE:
+            self.fire_pressed = False
 
-    def load_animation_sprite_sheet(self, name, file_path, split_width):
-        img = Image.open(file_path)
-        width, height = img.size
-        x = 0
-        print(f"{width}, {split_width}")
-        image_list = []
-
-        while x * split_width < width:
-
-            left = x * split_width  # 0 * 9
-            top = 0
-            sprite_width = split_width # 8
-
-            image_list.insert(x, arcade.load_texture(file_path, left, top, sprite_width, height))
-
-            x += 1
-
-        return image_list
     # endregion
 
 
 def main():
     """ Main function """
     window = MyGame(SCREEN_WIDTH, SCREEN_HEIGHT, SCREEN_TITLE)
-    window.setup()
+    # The level is set up by the startup, after the window has drawn its first frame
     arcade.run()
 
 
@@ -0,0 +1,81 @@
+# What happens when the player picks something up.
+# The item definitions (see registry.py) list effects by name, with their values:
+#     {"effect": "score", "property": "coin_value"}
+# When a level is compiled, every pick-up gets a handler with the effects of its
+# definition, so picking it up is a plain call.
+
+from constants import *
+from log import log
+from registry import RegistryError
+
+
+# region Effects
+# Each effect is called with the game, the picked up sprite, the player who picked it up
+# and the values from the definition
+def message(game, item, player, text):
+    log.info("pick_up", text)
+
+
+def sound(game, item, player, sound):
+    # The sound itself, looked up in bind_pick_up(). The headless simulation has None.
+    game.play_sound(sound)
+
+
+def score(game, item, player, amount=0, property=None):
+    game.score += amount
+
+
+def jump_boost(game, item, player, amount=1):
+    player.jump_boost_soda += amount
+
+
+EFFECTS = {
+    "message": message,
+    "sound": sound,
+    "score": score,
+    "jump_boost": jump_boost,
+}
+# endregion
+
+
+class PickUpHandler:
+    """ The effects of one pick-up, with their values worked out for that sprite """
+
+    def __init__(self, game, effects):
+        self.game = game
+        # (effect function, values)
+        self.effects = effects
+
+    def __call__(self, item, player):
+        for effect, values in self.effects:
+            effect(self.game, item, player, **values)
+
+
+def bind_pick_up(item, game, registry):
+    """ Give a pick-up the handler of the item named by its on_pick_up property """
+    name = item.properties.get('on_pick_up')
+    definition = registry.definition("items", name)
+
+    effects = []
+    for values in definition.get("effects", ()):
+        values = dict(values)
+        effect = EFFECTS.get(values.pop("effect", None))
+        if effect is None:
+            raise RegistryError(f"Item {name!r} has an effect that is not one of {tuple(EFFECTS)}")
+        if "sound" in values and not hasattr(game, values["sound"]):
+            raise RegistryError(f"Item {name!r} plays the sound {values['sound']!r}, the game has no such sound")
+
+        # Values taken from the properties of the sprite in the level, and the sound, are looked up now,
+        # not on every pick-up. The sounds are loaded before the first level (see MyGame.__init__).
+        if "sound" in values:
+            values["sound"] = getattr(game, values["sound"])
+        if "property" in values:
+            values["amount"] = item.properties.get(values["property"], values.get("amount", 0))
+        if "text" in values:
+            try:
+                values["text"] = values["text"].format(**item.properties)
+            except (KeyError, ValueError) as error:
+                raise RegistryError(f"Item {name!r} has a message that doesn't fit this pick-up: {error}")
+        effects.append((effect, values))
+
+    item.on_pick_up = PickUpHandler(game, effects)
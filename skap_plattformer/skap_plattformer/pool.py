@@ -0,0 +1,94 @@
+# Sprite pools for things that come and go many times in a level: bullets,
+# particles and pick-ups. Every sprite is made when the level is set up and stays
+# in its sprite list for good. Spawning one turns it on (visible, in the game) and
+# getting rid of it turns it off again, so nothing is created or deleted while
+# playing, and the garbage collector has nothing to clean up.
+
+from constants import *
+
+
+class SpritePool:
+    """ A fixed set of sprites in one sprite list, turned on and off instead of made and deleted """
+
+    def __init__(self, sprite_list, sprites=(), active=False):
+        self.sprite_list = sprite_list
+        # Active sprites in the order they were turned on, used as an ordered set
+        self.active = {}
+        self.free = []
+        # Sprites to turn off once the loop over the active sprites is done, used again every time
+        self.expired = []
+        # Goes up whenever a sprite is turned on or off, so what is made from the visible sprites
+        # (the hit box outlines, see culling.py) is only made again after a change
+        self.changes = 0
+
+        for sprite in sprites:
+            self.add(sprite, active)
+
+    @classmethod
+    def preallocate(cls, sprite_list, size, make_sprite):
+        """ A pool of size new sprites made by make_sprite(), all turned off """
+        return cls(sprite_list, [make_sprite() for _ in range(size)])
+
+    def add(self, sprite, active=False):
+        """ Put a sprite in the pool. The pool keeps it in its sprite list from now on """
+        sprite.pool = self
+        if self.sprite_list not in sprite.sprite_lists:
+            self.sprite_list.append(sprite)
+        if active:
+            self.active[sprite] = None
+        else:
+            sprite.visible = False
+            self.free.append(sprite)
+
+    def __len__(self):
+        """ The number of active sprites """
+        return len(self.active)
+
+    def __iter__(self):
+        """ The active sprites. Use deactivate_later() to turn sprites off while looping over them """
+        return iter(self.active)
+
+    def activate(self):
+        """ Turn on a free sprite and return it. When none are free, the oldest active sprite is used again """
+        if self.free:
+            sprite = self.free.pop()
+        else:
+            sprite = next(iter(self.active))
+            del self.active[sprite]
+        self.active[sprite] = None
+        sprite.visible = True
+        self.changes += 1
+        return sprite
+
+    def deactivate(self, sprite):
+        """ Turn a sprite off, so it can be activated again later """
+        if sprite in self.active:
+            del self.active[sprite]
+            sprite.visible = False
+            self.free.append(sprite)
+            self.changes += 1
+
+    def deactivate_later(self, sprite):
+        """ Turn a sprite off at the next deactivate_expired() """
+        self.expired.append(sprite)
+
+    def deactivate_expired(self):
+        """ Turn off the sprites given to deactivate_later() """
+        for sprite in self.expired:
+            self.deactivate(sprite)
+        self.expired.clear()
+
+    def activate_all(self):
+        """ Turn every free sprite back on, and return them """
+        sprites = self.free
+        self.free = []
+        for sprite in sprites:
+            self.active[sprite] = None
+            sprite.visible = True
+        if sprites:
+            self.changes += 1
+        return sprites
+
+    def deactivate_all(self):
+        for sprite in list(self.active):
+            self.deactivate(sprite)
@@ -0,0 +1,211 @@
+# Frame profiler for the Skap platforming game.
+# The game loop marks where each of its regions starts, and the profiler times them
+# with perf_counter_ns. Every frame the time of each region is added to a rolling
+# window, which the overlay turns into p50/p95/p99. Every region is also kept as a
+# Chrome trace event, so a run can be opened in chrome://tracing or ui.perfetto.dev.
+# Counters, like the physics sub-steps, are added up per frame the same way, and end
+# up as counter tracks in the trace.
+
+import arcade, collections, json, os, pyglet, threading, time
+
+# Frames in the rolling window the percentiles are taken from
+PROFILER_WINDOW = 300
+# Trace events kept for export. The oldest are dropped first.
+PROFILER_TRACE_EVENTS = 200_000
+# Seconds between updates of the overlay text
+PROFILER_OVERLAY_INTERVAL = 0.5
+# One frame at 60 fps
+FRAME_BUDGET_MS = 1000 / 60
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(sorted_values, percent):
+    """ Nearest-rank percentile of an already sorted list """
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(percent / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+class Profiler:
+    """ Times named regions of the game loop, and keeps the last frames of every region """
+
+    def __init__(self, enabled=True, window=PROFILER_WINDOW, trace_events=PROFILER_TRACE_EVENTS):
+        self.enabled = enabled
+        self.window = window
+
+        # Region name -> rolling window of milliseconds per frame
+        self.samples = {}
+        # Region name -> nanoseconds spent in it during the current frame
+        self.frame_totals = {}
+        # Counter name -> rolling window of totals per frame, and the total of the current frame
+        self.count_samples = {}
+        self.frame_counts = {}
+        self.frame_start = None
+
+        self.current = None
+        self.current_start = 0
+
+        self.trace = collections.deque(maxlen=trace_events)
+        # (counter name, end of the frame, total of the frame)
+        self.count_trace = collections.deque(maxlen=trace_events)
+        self.start_time = time.perf_counter_ns()
+        self.thread_id = threading.get_ident()
+
+    def begin_frame(self):
+        if not self.enabled:
+            return
+        self.frame_start = time.perf_counter_ns()
+
+    def begin(self, name):
+        """ Start timing a region. Ends the region before it, if there is one """
+        if not self.enabled:
+            return
+        now = time.perf_counter_ns()
+        if self.current is not None:
+            self.add(self.current, self.current_start, now)
+        self.current = name
+        self.current_start = now
+
+    def end(self):
+        """ Stop timing the current region """
+        if not self.enabled or self.current is None:
+            return
+        self.add(self.current, self.current_start, time.perf_counter_ns())
+        self.current = None
+
+    def count(self, name, value=1):
+        """ Add to a counter for the current frame """
+        if not self.enabled:
+            return
+        self.frame_counts[name] = self.frame_counts.get(name, 0) + value
+
+    def add(self, name, start, end):
+        self.frame_totals[name] = self.frame_totals.get(name, 0) + end - start
+        self.trace.append((name, start, end))
+
+    def end_frame(self):
+        """ Move the region times of this frame into the rolling windows """
+        if not self.enabled or self.frame_start is None:
+            return
+        self.end()
+        now = time.perf_counter_ns()
+        self.frame_totals["frame"] = now - self.frame_start
+        self.trace.append(("frame", self.frame_start, now))
+        self.frame_start = None
+
+        # Regions that didn't run this frame count as 0 ms
+        for name in self.samples.keys() | self.frame_totals.keys():
+            if name not in self.samples:
+                self.samples[name] = collections.deque(maxlen=self.window)
+            self.samples[name].append(self.frame_totals.get(name, 0) / 1_000_000)
+        self.frame_totals = {}
+
+        for name in self.count_samples.keys() | self.frame_counts.keys():
+            if name not in self.count_samples:
+                self.count_samples[name] = collections.deque(maxlen=self.window)
+            value = self.frame_counts.get(name, 0)
+            self.count_samples[name].append(value)
+            self.count_trace.append((name, now, value))
+        self.frame_counts = {}
+
+    def percentiles(self):
+        """ Region name -> (p50, p95, p99) in milliseconds, over the rolling window """
+        result = {}
+        for name, samples in self.samples.items():
+            values = sorted(samples)
+            result[name] = tuple(percentile(values, percent) for percent in PERCENTILES)
+        return result
+
+    def count_percentiles(self):
+        """ Counter name -> (p50, p95, p99) of the totals per frame, over the rolling window """
+        result = {}
+        for name, samples in self.count_samples.items():
+            values = sorted(samples)
+            result[name] = tuple(percentile(values, percent) for percent in PERCENTILES)
+        return result
+
+    def export_trace(self, file_path):
+        """ Write the kept regions as Chrome trace JSON. Frames are on their own row above the regions """
+        events = []
+        for name, start, end in list(self.trace):
+            events.append({
+                "name": name,
+                "cat": "frame" if name == "frame" else "region",
+                "ph": "X",
+                "ts": (start - self.start_time) / 1000,
+                "dur": (end - start) / 1000,
+                "pid": os.getpid(),
+                "tid": 0 if name == "frame" else self.thread_id,
+            })
+        for name, when, value in list(self.count_trace):
+            events.append({
+                "name": name,
+                "ph": "C",
+                "ts": (when - self.start_time) / 1000,
+                "pid": os.getpid(),
+                "args": {name: value},
+            })
+        directory = os.path.dirname(file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(file_path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+        return len(events)
+
+
+class ProfilerOverlay:
+    """ Table of the region percentiles, drawn on top of the game with the gui camera """
+
+    def __init__(self, profiler, width, height):
+        self.profiler = profiler
+        self.visible = False
+        self.batch = pyglet.graphics.Batch()
+        self.label = pyglet.text.Label("", font_name=("consolas", "courier new", "dejavu sans mono"), font_size=11,
+                                       color=arcade.get_four_byte_color(arcade.color.WHITE),
+                                       multiline=True, width=460, anchor_x="left", anchor_y="top",
+                                       batch=self.batch)
+        self.warning_color = arcade.get_four_byte_color(arcade.color.ORANGE_RED)
+        self.normal_color = self.label.color
+        self.time_since_update = PROFILER_OVERLAY_INTERVAL
+        self.resize(width, height)
+
+    def resize(self, width, height):
+        self.label.position = (20, height - 50)
+
+    def toggle(self):
+        self.visible = not self.visible
+        self.time_since_update = PROFILER_OVERLAY_INTERVAL
+
+    def update(self, delta_time):
+        """ Sorting the windows takes a while, so the text only changes a couple of times a second """
+        if not self.visible:
+            return
+        self.time_since_update += delta_time
+        if self.time_since_update < PROFILER_OVERLAY_INTERVAL:
+            return
+        self.time_since_update = 0
+
+        table = self.profiler.percentiles()
+        lines = [f"{'region':<20}{'p50':>8}{'p95':>8}{'p99':>8}  ms"]
+        # The whole frame first, then the slowest regions
+        for name in sorted(table, key=lambda name: (name != "frame", -table[name][2])):
+            p50, p95, p99 = table[name]
+            lines.append(f"{name:<20}{p50:>8.2f}{p95:>8.2f}{p99:>8.2f}")
+        counts = self.profiler.count_percentiles()
+        if counts:
+            lines.append(f"{'counter':<20}{'p50':>8}{'p95':>8}{'p99':>8}  per frame")
+            for name in sorted(counts):
+                p50, p95, p99 = counts[name]
+                lines.append(f"{name:<20}{p50:>8g}{p95:>8g}{p99:>8g}")
+        self.label.text = "\n".join(lines)
+
+        over_budget = table.get("frame", (0, 0, 0))[2] > FRAME_BUDGET_MS
+        self.label.color = self.warning_color if over_budget else self.normal_color
+
+    def draw(self, ctx):
+        if not self.visible:
+            return
+        with ctx.pyglet_rendering():
+            self.batch.draw()
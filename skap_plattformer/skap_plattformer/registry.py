@@ -0,0 +1,93 @@
+# Asset registry for the Skap platforming game.
+# Items, weapons and textures are described by small JSON files, one per asset, in
+# a folder per kind under assets/definitions. At startup the registry only lists the
+# folders, so it knows every asset by name without opening a single file. A file is
+# read the first time its asset is asked for, and kept in a cache of the most
+# recently used ones.
+#
+# Adding an asset is adding a JSON file, the code doesn't change:
+#     assets/definitions/items/<name>.json     what happens when a pick-up is picked up (see pick_ups.py)
+#     assets/definitions/weapons/<name>.json   texture, speed, lifetime and cooldown of a bullet
+#     assets/definitions/textures/<name>.json  image file and hit box algorithm
+
+import arcade, json, os
+from collections import OrderedDict
+from constants import *
+
+DEFINITION_FOLDER = "skap_plattformer/assets/definitions"
+DEFINITION_KINDS = ("items", "weapons", "textures")
+
+# Most loaded assets kept in memory. The least recently used one is dropped first.
+REGISTRY_CACHE_SIZE = 64
+
+
+class RegistryError(Exception):
+    """ An asset doesn't exist, or its file is broken """
+    pass
+
+
+class AssetRegistry:
+    """ Every asset by kind and name, loaded when first used """
+
+    def __init__(self, folder=DEFINITION_FOLDER, cache_size=REGISTRY_CACHE_SIZE):
+        self.folder = path(folder)
+        self.cache_size = cache_size
+
+        # Kind -> name -> file path
+        self.files = {kind: {} for kind in DEFINITION_KINDS}
+        # (kind, name) -> loaded asset, least recently used first
+        self.cache = OrderedDict()
+
+        self.index()
+
+    def index(self):
+        """ Find every asset. Only the file names are read """
+        for kind, files in self.files.items():
+            files.clear()
+            try:
+                entries = os.scandir(os.path.join(self.folder, kind))
+            except FileNotFoundError:
+                continue
+            with entries:
+                for entry in entries:
+                    name, extension = os.path.splitext(entry.name)
+                    if extension == ".json":
+                        files[name] = entry.path
+        self.cache.clear()
+
+    def names(self, kind):
+        return sorted(self.files[kind])
+
+    def definition(self, kind, name):
+        """ The JSON of an asset, as a dict. Don't change it, it is shared """
+        return self.cached((kind, name), lambda: self.read(kind, name))
+
+    def texture(self, name):
+        """ The arcade texture of a texture definition """
+        def load():
+            definition = self.definition("textures", name)
+            return arcade.load_texture(path(definition["file"]),
+                                       hit_box_algorithm=definition.get("hit_box_algorithm", "Simple"))
+        return self.cached(("texture", name), load)
+
+    def cached(self, key, load):
+        """ Look up a loaded asset, or load it and keep it. Drops the least recently used one when full """
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        value = load()
+        self.cache[key] = value
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return value
+
+    def read(self, kind, name):
+        file_path = self.files[kind].get(name)
+        if file_path is None:
+            raise RegistryError(f"There is no {kind} asset {name!r}, expected one of {self.names(kind)}")
+        try:
+            with open(file_path) as file:
+                return json.load(file)
+        except (OSError, ValueError) as error:
+            raise RegistryError(f"Could not read {file_path}: {error}")
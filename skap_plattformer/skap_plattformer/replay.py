@@ -0,0 +1,241 @@
+# Input recording and replay for the Skap platforming game.
+# The game logic runs in fixed steps (see simulation.py), so recording which keys
+# were held on every step is enough to play a run back exactly.
+
+import argparse, math, struct, time
+from constants import *
+
+# One bit per key in the per-step input byte
+INPUT_LEFT = 1
+INPUT_RIGHT = 2
+INPUT_UP = 4
+INPUT_DOWN = 8
+INPUT_FIRE = 16
+
+# File format. All numbers are little endian.
+#   header:  magic, version, length of the map name
+#   map name (utf-8)
+#   result:  steps, final x, final y, score, total_time
+#   runs:    number of runs, then (steps, input byte) for every run
+REPLAY_MAGIC = b"SKRP"
+# Bumped whenever a change to the physics makes old runs play out differently
+REPLAY_VERSION = 2
+HEADER_FORMAT = struct.Struct("<4sBH")
+RESULT_FORMAT = struct.Struct("<Idddd")
+RUN_COUNT_FORMAT = struct.Struct("<I")
+RUN_FORMAT = struct.Struct("<HB")
+
+# Steps per rendered frame when fast-forwarding a replay in the game window
+FAST_FORWARD_STEPS = 60
+
+
+def get_input_bits(game):
+    """ Pack the key booleans into one byte """
+    bits = 0
+    if game.left_pressed:
+        bits |= INPUT_LEFT
+    if game.right_pressed:
+        bits |= INPUT_RIGHT
+    if game.up_pressed:
+        bits |= INPUT_UP
+    if game.down_pressed:
+        bits |= INPUT_DOWN
+    if game.fire_pressed:
+        bits |= INPUT_FIRE
+    return bits
+
+
+def set_input_bits(game, bits):
+    """ Unpack one input byte into the key booleans """
+    game.left_pressed = bool(bits & INPUT_LEFT)
+    game.right_pressed = bool(bits & INPUT_RIGHT)
+    game.up_pressed = bool(bits & INPUT_UP)
+    game.down_pressed = bool(bits & INPUT_DOWN)
+    game.fire_pressed = bool(bits & INPUT_FIRE)
+
+
+class ReplayError(Exception):
+    """ The replay file is broken, or the replay did not end where it was recorded """
+    pass
+
+
+class Recording:
+    """ The inputs of one run, and where the run ended """
+
+    def __init__(self, map_name, inputs=None):
+        self.map_name = map_name
+        # One input byte per fixed step
+        self.inputs = inputs if inputs is not None else bytearray()
+
+        # The state at the end of the run
+        self.final_x = 0.0
+        self.final_y = 0.0
+        self.score = 0.0
+        self.total_time = 0.0
+
+    def __len__(self):
+        return len(self.inputs)
+
+    def set_result(self, game):
+        self.final_x, self.final_y = game.player.position
+        self.score = game.score
+        self.total_time = game.total_time
+
+    def save(self, file_path):
+        """ Write the recording to disk. Keys are held for many steps in a row, so the inputs are run-length encoded """
+        runs = []
+        for bits in self.inputs:
+            if runs and runs[-1][1] == bits and runs[-1][0] < 0xFFFF:
+                runs[-1][0] += 1
+            else:
+                runs.append([1, bits])
+
+        map_name = self.map_name.encode("utf-8")
+        with open(file_path, "wb") as file:
+            file.write(HEADER_FORMAT.pack(REPLAY_MAGIC, REPLAY_VERSION, len(map_name)))
+            file.write(map_name)
+            file.write(RESULT_FORMAT.pack(len(self.inputs), self.final_x, self.final_y, self.score, self.total_time))
+            file.write(RUN_COUNT_FORMAT.pack(len(runs)))
+            for count, bits in runs:
+                file.write(RUN_FORMAT.pack(count, bits))
+
+    @classmethod
+    def load(cls, file_path):
+        """ Read a recording written by save() """
+        with open(file_path, "rb") as file:
+            data = file.read()
+
+        try:
+            magic, version, name_length = HEADER_FORMAT.unpack_from(data, 0)
+            if magic != REPLAY_MAGIC:
+                raise ReplayError(f"{file_path} is not a replay file")
+            if version != REPLAY_VERSION:
+                raise ReplayError(f"{file_path} is replay version {version}, expected {REPLAY_VERSION}")
+            offset = HEADER_FORMAT.size
+
+            map_name = data[offset:offset + name_length].decode("utf-8")
+            offset += name_length
+
+            steps, final_x, final_y, score, total_time = RESULT_FORMAT.unpack_from(data, offset)
+            offset += RESULT_FORMAT.size
+
+            run_count, = RUN_COUNT_FORMAT.unpack_from(data, offset)
+            offset += RUN_COUNT_FORMAT.size
+
+            inputs = bytearray()
+            for count, bits in RUN_FORMAT.iter_unpack(data[offset:offset + run_count * RUN_FORMAT.size]):
+                inputs += bytes((bits,)) * count
+        except struct.error as error:
+            raise ReplayError(f"{file_path} is cut short: {error}")
+
+        if len(inputs) != steps:
+            raise ReplayError(f"{file_path} has {len(inputs)} steps of input, expected {steps}")
+
+        recording = cls(map_name, inputs)
+        recording.final_x = final_x
+        recording.final_y = final_y
+        recording.score = score
+        recording.total_time = total_time
+        return recording
+
+
+class InputRecorder:
+    """ Stores the keys held on every fixed step of a game """
+
+    def __init__(self):
+        self.recording = None
+
+    def start(self, game):
+        """ Called by the game when a level is set up. Recording starts over from the first step """
+        self.recording = Recording(game.map_name)
+
+    def record(self, game):
+        self.recording.inputs.append(get_input_bits(game))
+
+    def finish(self, game):
+        """ Stop recording and return the recording, with the current state as its result """
+        recording = self.recording
+        recording.set_result(game)
+        self.recording = None
+        return recording
+
+
+class Replayer:
+    """ Feeds a recording back into the game, one input byte per fixed step """
+
+    def __init__(self, recording):
+        self.recording = recording
+        self.position = 0
+
+    @property
+    def finished(self):
+        return self.position >= len(self.recording)
+
+    def start(self, game):
+        """ Called by the game when a level is set up. The replay starts over from the first step """
+        self.position = 0
+
+    def feed(self, game):
+        """ Set the keys for the next step. After the last step all keys are released """
+        if self.finished:
+            set_input_bits(game, 0)
+            return
+        set_input_bits(game, self.recording.inputs[self.position])
+        self.position += 1
+
+    def fast_forward(self, game, steps=None):
+        """ Run the game logic for the given number of steps, or to the end, without drawing anything """
+        if steps is None:
+            steps = len(self.recording) - self.position
+        steps = min(steps, len(self.recording) - self.position)
+        for _ in range(steps):
+            game.fixed_update()
+        return steps
+
+    def verify(self, game):
+        """ Check that the game ended where the recording did """
+        x, y = game.player.position
+        expected = (self.recording.final_x, self.recording.final_y, self.recording.score, self.recording.total_time)
+        actual = (x, y, game.score, game.total_time)
+        names = ("x", "y", "score", "total_time")
+        for name, want, got in zip(names, expected, actual):
+            if not math.isclose(want, got, rel_tol=1e-9, abs_tol=1e-6):
+                raise ReplayError(f"Replay ended with {name} = {got}, the recording has {want}")
+
+
+def main():
+    """ Play a recording back without a window, as fast as possible, and check that it ends the same way """
+    parser = argparse.ArgumentParser(description="Replay a recorded Skap platformer run")
+    parser.add_argument("file", help="replay file to play back")
+    parser.add_argument("--watch", action="store_true", help="open the game window and watch the replay")
+    args = parser.parse_args()
+
+    recording = Recording.load(args.file)
+
+    if args.watch:
+        import arcade
+        from main import MyGame
+        window = MyGame(SCREEN_WIDTH, SCREEN_HEIGHT, SCREEN_TITLE)
+        window.map_name = recording.map_name
+        window.replayer = Replayer(recording)
+        # The startup of the window sets up the level
+        arcade.run()
+        return
+
+    from simulation import GameSimulation
+    game = GameSimulation()
+    game.map_name = recording.map_name
+    game.replayer = Replayer(recording)
+    game.setup()
+
+    start = time.perf_counter()
+    steps = game.replayer.fast_forward(game)
+    elapsed = time.perf_counter() - start
+
+    game.replayer.verify(game)
+    print(f"Replayed {steps} steps ({game.total_time:.2f} s) in {elapsed:.3f} s ({game.total_time / elapsed:.0f}x real time)")
+    print(f"Ended at {game.player.position} with score {game.score}, matching the recording")
+
+
+if __name__ == "__main__":
+    main()
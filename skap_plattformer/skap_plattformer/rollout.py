@@ -0,0 +1,268 @@
+# Environments for bots and automated playtesting, in the style of gym.
+# A LevelEnv is one headless level: it takes the keys to hold for a step (left, right,
+# up, down) and gives back what the bot sees, the reward, and whether the run is over.
+# It runs the same fixed_update as the game, so movement, jumping, ladders and pick-ups
+# follow the same rules.
+#
+# A RolloutPool runs many LevelEnvs over worker processes. Every worker holds a group
+# of them, so one message to a worker steps the whole group, and a step of the pool is
+# one batch of actions in and NumPy arrays out:
+#
+#     with RolloutPool(envs=256) as pool:
+#         observations = pool.reset()
+#         while ...:
+#             actions = numpy.random.random((256, 4)) < 0.5
+#             observations, rewards, terminated, truncated = pool.step(actions)
+#
+# Envs that are done start over by themselves, and the observation is then the first
+# one of the new run.
+#
+# The level cache (see level_cache.py) is brought up to date once, before the workers
+# start, so they don't all compile the level at the same time. An error in a worker is
+# sent back and raised again by the pool, with the worker's traceback as its cause.
+#
+# Benchmark with:
+#     python rollout.py --envs 256 --seconds 10
+
+import argparse, multiprocessing, numpy, os, time, traceback
+from constants import *
+from chunks import is_streamed_map
+from levels import LevelManifest
+from log import log, WARNING
+from simulation import GameSimulation
+import level_cache
+
+# Action columns, the keys held for the step
+ACTION_FIELDS = ("left", "right", "up", "down")
+# Observation columns
+OBSERVATION_FIELDS = ("x", "y", "velocity_x", "velocity_y", "score", "coins_left")
+
+# Steps before a run is cut off, one minute of game time
+ROLLOUT_MAX_STEPS = 3600
+# A player this far under the bottom of the map has fallen out of it
+FALL_OUT_DEPTH = 1000
+
+
+class RolloutError(Exception):
+    """ A rollout worker failed. Raised as the cause of the worker's own exception """
+    pass
+
+
+class WorkerFailure:
+    """ Sent by a worker instead of an answer when a command raised an exception """
+
+    def __init__(self, error):
+        self.error = error
+        self.traceback = traceback.format_exc()
+
+
+class LevelEnv:
+    """ One level without a window, stepped by a bot. The reward is the score gained in the step """
+
+    def __init__(self, map_name=None, max_steps=ROLLOUT_MAX_STEPS):
+        self.game = GameSimulation()
+        if map_name is not None:
+            self.game.map_name = map_name
+        self.max_steps = max_steps
+        self.steps = 0
+
+    def reset(self):
+        """ Start a new run. The level is set up the first time, and restarted from its snapshot after that """
+        if self.game.physics_engine is None:
+            self.game.setup()
+        else:
+            self.game.soft_reset()
+        self.steps = 0
+        return self.observe()
+
+    def step(self, action):
+        """ Hold the keys in action (see ACTION_FIELDS) for one fixed step.
+        Returns the observation, the reward, and whether the run ended (the level was finished or the player
+        fell out of it) or was cut off at max_steps """
+        game = self.game
+        game.left_pressed, game.right_pressed, game.up_pressed, game.down_pressed = (bool(key) for key in action)
+        score = game.score
+        game.fixed_update()
+        self.steps += 1
+
+        terminated = game.level_finished() or game.player.center_y < -FALL_OUT_DEPTH
+        truncated = not terminated and self.steps >= self.max_steps
+        return self.observe(), game.score - score, terminated, truncated
+
+    def observe(self):
+        game = self.game
+        x, y = game.player.position
+        velocity_x, velocity_y = game.players.physics_objects[0].body.velocity
+        coin_pool = game.pick_up_pools.get("Coin")
+        return (x, y, velocity_x, velocity_y, game.score, len(coin_pool) if coin_pool is not None else 0)
+
+
+class LevelEnvGroup:
+    """ Several LevelEnvs stepped together, with arrays in and out """
+
+    def __init__(self, count, map_name=None, max_steps=ROLLOUT_MAX_STEPS):
+        self.envs = [LevelEnv(map_name, max_steps) for _ in range(count)]
+
+    def __len__(self):
+        return len(self.envs)
+
+    def reset(self):
+        return numpy.array([env.reset() for env in self.envs], numpy.float64).reshape(len(self), len(OBSERVATION_FIELDS))
+
+    def step(self, actions):
+        count = len(self.envs)
+        observations = numpy.empty((count, len(OBSERVATION_FIELDS)))
+        rewards = numpy.empty(count)
+        terminated = numpy.empty(count, numpy.bool_)
+        truncated = numpy.empty(count, numpy.bool_)
+        for index, (env, action) in enumerate(zip(self.envs, actions)):
+            observation, rewards[index], terminated[index], truncated[index] = env.step(action)
+            if terminated[index] or truncated[index]:
+                observation = env.reset()
+            observations[index] = observation
+        return observations, rewards, terminated, truncated
+
+
+def run_worker(connection, count, map_name, max_steps):
+    """ Main loop of a worker process: runs commands from the RolloutPool on its group of envs """
+    # Every pick-up message of every env would end up on the screen
+    log.set_level(WARNING)
+    try:
+        group = LevelEnvGroup(count, map_name, max_steps)
+        while True:
+            command, argument = connection.recv()
+            if command == "step":
+                connection.send(group.step(argument))
+            elif command == "reset":
+                connection.send(group.reset())
+            elif command == "close":
+                connection.close()
+                return
+    except EOFError:
+        # The pool is gone
+        return
+    except Exception as error:
+        # Raised again by RolloutPool.receive()
+        connection.send(WorkerFailure(error))
+        connection.close()
+
+
+def prepare_level(map_name=None):
+    """ Compile the level cache of a map if it is missing or stale. Returns the map name, the first level by default """
+    if map_name is None:
+        map_name = LevelManifest.load().maps[0]
+    if not is_streamed_map(map_name) and not level_cache.is_up_to_date(path(map_name), SPRITE_SCALING_TILES):
+        level_cache.compile_level(path(map_name), SPRITE_SCALING_TILES)
+    return map_name
+
+
+class RolloutPool:
+    """ Many LevelEnvs over worker processes, stepped with a batch of actions. One worker per CPU by default """
+
+    def __init__(self, envs, workers=None, map_name=None, max_steps=ROLLOUT_MAX_STEPS):
+        workers = min(workers or os.cpu_count() or 1, envs)
+        self.envs = envs
+        map_name = prepare_level(map_name)
+        # Envs of every worker, the first ones get one more if they don't divide evenly
+        self.counts = [envs // workers + (index < envs % workers) for index in range(workers)]
+        self.bounds = numpy.cumsum([0] + self.counts)
+
+        self.connections = []
+        self.processes = []
+        for count in self.counts:
+            connection, worker_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=run_worker, args=(worker_connection, count, map_name, max_steps),
+                                              name="rollout worker", daemon=True)
+            process.start()
+            worker_connection.close()
+            self.connections.append(connection)
+            self.processes.append(process)
+
+    def __len__(self):
+        return self.envs
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *error):
+        self.close()
+
+    def reset(self):
+        """ Start every env over. Returns the observations, one row per env (see OBSERVATION_FIELDS) """
+        for index in range(len(self.connections)):
+            self.send(index, ("reset", None))
+        return numpy.concatenate([self.receive(index) for index in range(len(self.connections))])
+
+    def step(self, actions):
+        """ Step every env once. actions has a row per env with the keys to hold (see ACTION_FIELDS).
+        Returns arrays of observations, rewards, terminated and truncated, a row per env """
+        actions = numpy.asarray(actions, numpy.bool_).reshape(self.envs, len(ACTION_FIELDS))
+        # Every worker steps its group at the same time
+        for index in range(len(self.connections)):
+            self.send(index, ("step", actions[self.bounds[index]:self.bounds[index + 1]]))
+        results = [self.receive(index) for index in range(len(self.connections))]
+        return tuple(numpy.concatenate(arrays) for arrays in zip(*results))
+
+    def send(self, index, command):
+        """ Send a command to a worker. Raises if the worker died """
+        try:
+            self.connections[index].send(command)
+        except OSError:
+            raise self.died(index) from None
+
+    def receive(self, index):
+        """ The answer of a worker. Raises the exception of the worker if it failed or died """
+        try:
+            answer = self.connections[index].recv()
+        except (EOFError, OSError):
+            raise self.died(index) from None
+        if isinstance(answer, WorkerFailure):
+            raise answer.error from RolloutError(f"In rollout worker {index}:\n{answer.traceback}")
+        return answer
+
+    def died(self, index):
+        """ The error for a worker that stopped without saying why """
+        process = self.processes[index]
+        process.join()
+        return RolloutError(f"Rollout worker {index} died with exit code {process.exitcode}")
+
+    def close(self):
+        for connection, process in zip(self.connections, self.processes):
+            try:
+                connection.send(("close", None))
+            except OSError:
+                pass
+            process.join()
+        self.connections = []
+        self.processes = []
+
+
+def main():
+    """ Run random bots on a level and print the steps per second """
+    parser = argparse.ArgumentParser(description="Benchmark the rollout pool with random actions")
+    parser.add_argument("--envs", type=int, default=64, help="levels to run at the same time")
+    parser.add_argument("--workers", type=int, default=None, help="processes to use, default is one per CPU")
+    parser.add_argument("--map", default=None, help="level to run, default is the first one in the level manifest")
+    parser.add_argument("--seconds", type=float, default=10, help="game seconds to run every env for")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    with RolloutPool(args.envs, args.workers, args.map) as pool:
+        pool.reset()
+        print(f"Set up {args.envs} envs on {len(pool.processes)} workers in {time.perf_counter() - start:.2f} s")
+
+        random = numpy.random.default_rng(0)
+        steps = round(args.seconds / FIXED_TIMESTEP)
+        episodes = 0
+        start = time.perf_counter()
+        for _ in range(steps):
+            _, rewards, terminated, truncated = pool.step(random.random((args.envs, len(ACTION_FIELDS))) < 0.5)
+            episodes += int(terminated.sum() + truncated.sum())
+        elapsed = time.perf_counter() - start
+
+    print(f"{steps * args.envs} steps in {elapsed:.2f} s, {steps * args.envs / elapsed:.0f} steps per second, "
+          f"{episodes} runs ended")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,362 @@
+# Save states for the Skap platforming game.
+# A save state is a copy of what a LevelSnapshot (see snapshot.py) holds, written as
+# plain numbers instead of sprites, so it can be kept in a file and loaded in a new
+# game. Sprites are stored as their place in their sprite list, which is the same
+# every time a level is set up.
+#
+# Saving happens in two halves. save_state() copies the numbers out of the game on
+# the main thread, which is quick. Turning them into bytes and writing the file is
+# done by the Autosaver on a thread of its own, so autosaving a few times a second
+# doesn't make frames late.
+#
+# A full save has everything. A delta save only has what moved since a full save,
+# so the frequent autosaves are small: the physics items that lie still are left out.
+#
+# Every row of the player store is saved: the first player, the co-op players and the
+# ghosts. The keys held are not, they are the keys held when the save is loaded. Ghosts
+# play their recording at the step of the level (see GhostRunner.feed()), so the saved
+# tick_count is where their playback goes on from. A save only loads onto a game with the
+# same ghosts; the co-op players are added or taken away to fit the save.
+#
+# A loaded save is not replay-exact. It is loaded like a restart (see LevelSnapshot.restore()):
+# the level moves to a new pymunk space, which has none of the contacts and leftover solver
+# pushes of the game that was saved. Every body starts exactly where it was saved, but the
+# steps after that come out slightly different, and the run drifts off the one that was
+# saved: a replay of the rest of a recording ends somewhere else. Only a save made before
+# the first step of a level plays out exactly the same. tests/test_savestate.py checks both.
+
+import math, os, queue, struct, threading
+import numpy
+from constants import *
+from log import log
+from entities import PLAYER_FIELDS
+from snapshot import LevelSnapshot, BodyState, GAME_ATTRIBUTES
+
+# File format. All numbers are little endian.
+#   header:   magic, version, kind (full or delta), length of the map name
+#   map name (utf-8)
+#   game:     tick_count, tick_count of the full save a delta is based on, score, total_time, time_accumulator
+#   players:  number of players, then for each its body, friction, the PLAYER_FIELDS and whether it is a ghost
+#   items:    number of items written, then (index, body) for each. A delta only has the ones that changed.
+#   pick-ups: number of pools, then for each the length of its name, the name, the number of
+#             pick-ups and one bit per pick-up that has not been picked up
+#   bullets:  number of bullets in the air, then (index, x, y, change_x, lifetime) for each
+SAVE_MAGIC = b"SKSV"
+# Bumped whenever the layout changes or something is added
+SAVE_VERSION = 2
+SAVE_FULL = 0
+SAVE_DELTA = 1
+HEADER_FORMAT = struct.Struct("<4sBBH")
+GAME_FORMAT = struct.Struct("<IIddd")
+# Body (6 numbers), friction, then newJump, jump_boost_soda, on_ladder, on_ground, air_time,
+# animation_frame, in_water, facing, fire_cooldown and fall_speed like in PLAYER_FIELDS, then ghost
+PLAYER_FORMAT = struct.Struct("<7d?H??iI?bdd?")
+COUNT_FORMAT = struct.Struct("<H")
+ITEM_FORMAT = struct.Struct("<H6d")
+NAME_FORMAT = struct.Struct("<B")
+BULLET_FORMAT = struct.Struct("<Hdddd")
+
+# Items lying still still change by tiny amounts every step (around 1e-16). A delta
+# leaves an item out when none of its numbers changed by more than this.
+DELTA_TOLERANCE = 1e-6
+
+# Seconds between autosaves, and how many autosaves there are between two full saves
+AUTOSAVE_INTERVAL = 0.25
+AUTOSAVE_FULL_EVERY = 40
+
+
+class SaveError(Exception):
+    """ The save file is broken, or doesn't fit the level """
+    pass
+
+
+class SaveState:
+    """ The changing state of a level as plain numbers. Nothing in it is changed after it is made """
+
+    def __init__(self, map_name, game_values, players, items, pick_ups, bullets):
+        self.map_name = map_name
+        # Values of GAME_ATTRIBUTES
+        self.game_values = game_values
+        # For every row of the player store: body values, friction, the values of PLAYER_FIELDS, then ghost
+        self.players = players
+        # Body values of every physics item, in the order of the item layers
+        self.items = items
+        # (layer name, one bool per pick-up in its sprite list) for every pick-up pool
+        self.pick_ups = pick_ups
+        # (index in the bullet list, x, y, change_x, lifetime) of the bullets in the air
+        self.bullets = bullets
+
+    @property
+    def tick_count(self):
+        return self.game_values[GAME_ATTRIBUTES.index("tick_count")]
+
+    @property
+    def ghosts(self):
+        """ Whether each player is a ghost """
+        return tuple(player[-1] for player in self.players)
+
+    @property
+    def coop_players(self):
+        """ Players after the first that aren't ghosts """
+        return self.ghosts.count(False) - 1
+
+    @classmethod
+    def capture(cls, game):
+        """ Copy the state out of the game. Called on the main thread, the result can be handed to any thread """
+        snapshot = LevelSnapshot(game)
+        bodies = [(snapshot.player_body, snapshot.player_friction), *snapshot.other_players]
+        players = tuple((*body.values(), friction,
+                         *(snapshot.player_arrays[name][index].item() for _, name, _ in PLAYER_FIELDS),
+                         bool(snapshot.player_arrays["ghost"][index]))
+                        for index, (body, friction) in enumerate(bodies))
+        items = tuple(snapshot.items[item].values() for item in item_order(game))
+        pick_ups = tuple((name, tuple(sprite in snapshot.pick_ups[name] for sprite in pool.sprite_list))
+                         for name, pool in game.pick_up_pools.items())
+        bullet_index = {bullet: index for index, bullet in enumerate(game.bullet_pool.sprite_list)}
+        bullets = tuple((bullet_index[bullet], *position, change_x, lifetime)
+                        for bullet, position, change_x, lifetime in snapshot.bullets)
+        return cls(game.map_name, tuple(snapshot.game_values[name] for name in GAME_ATTRIBUTES),
+                   players, items, pick_ups, bullets)
+
+    def restore(self, game):
+        """ Put the level the way the state has it. The game has to have this level set up """
+        if game.map_name != self.map_name:
+            raise SaveError(f"The save is for {self.map_name}, the game has {game.map_name}")
+        items = item_order(game)
+        if len(items) != len(self.items):
+            raise SaveError(f"The save has {len(self.items)} items, the level has {len(items)}")
+        if [name for name, _ in self.pick_ups] != list(game.pick_up_pools):
+            raise SaveError("The save has other pick-up layers than the level")
+        players = game.players
+        if self.ghosts != tuple(players.ghost[:players.count].tolist()):
+            raise SaveError(f"The save has {len(self.players)} players, {self.ghosts.count(True)} of them ghosts. "
+                            f"The game has {players.count}, {int(players.ghost[:players.count].sum())} of them ghosts")
+
+        # The snapshot of the game as it is now, changed to the saved values
+        snapshot = LevelSnapshot(game)
+        snapshot.game_values = dict(zip(GAME_ATTRIBUTES, self.game_values))
+        columns = list(zip(*self.players))
+        for number, (attribute, name, kind) in enumerate(PLAYER_FIELDS, start=7):
+            snapshot.player_arrays[name] = numpy.array(columns[number], kind)
+            snapshot.player_values[attribute] = self.players[0][number]
+        bodies = [(BodyState.from_values(player[0:6]), player[6]) for player in self.players]
+        (snapshot.player_body, snapshot.player_friction), *snapshot.other_players = bodies
+        snapshot.items = {item: BodyState.from_values(values) for item, values in zip(items, self.items)}
+        for name, flags in self.pick_ups:
+            sprite_list = game.pick_up_pools[name].sprite_list
+            if len(flags) != len(sprite_list):
+                raise SaveError(f"The save has {len(flags)} pick-ups in {name}, the level has {len(sprite_list)}")
+            snapshot.pick_ups[name] = {sprite for sprite, active in zip(sprite_list, flags) if active}
+        bullet_list = game.bullet_pool.sprite_list
+        snapshot.bullets = [(bullet_list[index], (x, y), change_x, lifetime)
+                            for index, x, y, change_x, lifetime in self.bullets]
+        snapshot.restore(game)
+
+
+def item_order(game):
+    """ The physics items of a level, in the order they are saved """
+    return [item for item_list in game.compiled_level.item_layers for item in item_list]
+
+
+# region Encoding
+def encode(state, base=None):
+    """ The state as bytes. With a base state, only what changed since the base is written """
+    map_name = state.map_name.encode("utf-8")
+    data = bytearray(HEADER_FORMAT.pack(SAVE_MAGIC, SAVE_VERSION, SAVE_FULL if base is None else SAVE_DELTA,
+                                        len(map_name)))
+    data += map_name
+    data += GAME_FORMAT.pack(state.tick_count, 0 if base is None else base.tick_count, *state.game_values[:3])
+    data += COUNT_FORMAT.pack(len(state.players))
+    for player in state.players:
+        data += PLAYER_FORMAT.pack(*player)
+
+    if base is None:
+        items = list(enumerate(state.items))
+    else:
+        items = [(index, values) for index, (values, old) in enumerate(zip(state.items, base.items))
+                 if changed(values, old)]
+    data += COUNT_FORMAT.pack(len(items))
+    for index, values in items:
+        data += ITEM_FORMAT.pack(index, *values)
+
+    data += COUNT_FORMAT.pack(len(state.pick_ups))
+    for name, flags in state.pick_ups:
+        name = name.encode("utf-8")
+        data += NAME_FORMAT.pack(len(name))
+        data += name
+        data += COUNT_FORMAT.pack(len(flags))
+        bits = bytearray((len(flags) + 7) // 8)
+        for index, active in enumerate(flags):
+            if active:
+                bits[index // 8] |= 1 << (index % 8)
+        data += bits
+
+    data += COUNT_FORMAT.pack(len(state.bullets))
+    for bullet in state.bullets:
+        data += BULLET_FORMAT.pack(*bullet)
+    return bytes(data)
+
+
+def changed(values, old):
+    """ True if a body moved enough since the base to go in a delta """
+    return any(not math.isclose(value, old_value, rel_tol=0, abs_tol=DELTA_TOLERANCE)
+               for value, old_value in zip(values, old))
+
+
+def decode(data, base=None):
+    """ Read bytes written by encode(). A delta needs the full state it was based on """
+    try:
+        magic, version, kind, name_length = HEADER_FORMAT.unpack_from(data, 0)
+        if magic != SAVE_MAGIC:
+            raise SaveError("Not a save file")
+        if version != SAVE_VERSION:
+            raise SaveError(f"Save version {version}, expected {SAVE_VERSION}")
+        offset = HEADER_FORMAT.size
+
+        map_name = data[offset:offset + name_length].decode("utf-8")
+        offset += name_length
+
+        tick_count, base_tick_count, score, total_time, time_accumulator = GAME_FORMAT.unpack_from(data, offset)
+        offset += GAME_FORMAT.size
+        game_values = (score, total_time, time_accumulator, tick_count)
+
+        count, = COUNT_FORMAT.unpack_from(data, offset)
+        offset += COUNT_FORMAT.size
+        players = tuple(PLAYER_FORMAT.iter_unpack(data[offset:offset + count * PLAYER_FORMAT.size]))
+        if len(players) != count:
+            raise SaveError("The save file is cut short")
+        offset += count * PLAYER_FORMAT.size
+
+        if kind == SAVE_DELTA:
+            if base is None or base.tick_count != base_tick_count or base.map_name != map_name:
+                raise SaveError(f"The delta save is based on the full save of step {base_tick_count}")
+            items = list(base.items)
+        elif kind == SAVE_FULL:
+            items = []
+        else:
+            raise SaveError(f"Unknown save kind {kind}")
+
+        count, = COUNT_FORMAT.unpack_from(data, offset)
+        offset += COUNT_FORMAT.size
+        for index, *values in ITEM_FORMAT.iter_unpack(data[offset:offset + count * ITEM_FORMAT.size]):
+            if kind == SAVE_FULL:
+                items.append(tuple(values))
+            else:
+                items[index] = tuple(values)
+        offset += count * ITEM_FORMAT.size
+
+        pick_ups = []
+        pool_count, = COUNT_FORMAT.unpack_from(data, offset)
+        offset += COUNT_FORMAT.size
+        for _ in range(pool_count):
+            length, = NAME_FORMAT.unpack_from(data, offset)
+            offset += NAME_FORMAT.size
+            name = data[offset:offset + length].decode("utf-8")
+            offset += length
+            count, = COUNT_FORMAT.unpack_from(data, offset)
+            offset += COUNT_FORMAT.size
+            bits = data[offset:offset + (count + 7) // 8]
+            offset += (count + 7) // 8
+            pick_ups.append((name, tuple(bool(bits[index // 8] & (1 << (index % 8))) for index in range(count))))
+
+        count, = COUNT_FORMAT.unpack_from(data, offset)
+        offset += COUNT_FORMAT.size
+        bullets = tuple(BULLET_FORMAT.iter_unpack(data[offset:offset + count * BULLET_FORMAT.size]))
+        if len(bullets) != count:
+            raise SaveError("The save file is cut short")
+    except (struct.error, IndexError) as error:
+        raise SaveError(f"The save file is cut short: {error}")
+
+    return SaveState(map_name, game_values, players, tuple(items), tuple(pick_ups), bullets)
+# endregion
+
+
+class Autosaver:
+    """ Writes save states to a folder on a thread of its own.
+    The folder has the last full save, and the last delta save on top of it """
+
+    def __init__(self, folder, name="autosave", interval=AUTOSAVE_INTERVAL, full_every=AUTOSAVE_FULL_EVERY):
+        self.full_path = os.path.join(folder, f"{name}.sks")
+        self.delta_path = os.path.join(folder, f"{name}.delta.sks")
+        self.interval = interval
+        self.full_every = full_every
+
+        # Seconds since the last autosave, and autosaves until the next full one
+        self.timer = 0.0
+        self.until_full = 0
+
+        # Only the save thread touches this
+        self.base = None
+
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target=self.work, name="autosave", daemon=True)
+        self.thread.start()
+
+    def update(self, game, delta_time):
+        """ Autosave every interval seconds. Called once per frame """
+        self.timer += delta_time
+        if self.timer >= self.interval:
+            self.timer = 0.0
+            self.save(game)
+
+    def save(self, game, full=False):
+        """ Save the game as it is now. The file is written a moment later, by the save thread """
+        if full or self.until_full <= 0:
+            self.until_full = self.full_every
+            full = True
+        self.until_full -= 1
+        self.requests.put((SaveState.capture(game), full))
+
+    def load(self):
+        """ The last saved state, or None if nothing was saved yet """
+        self.wait()
+        try:
+            with open(self.full_path, "rb") as file:
+                base = decode(file.read())
+        except FileNotFoundError:
+            return None
+        try:
+            with open(self.delta_path, "rb") as file:
+                return decode(file.read(), base)
+        except (FileNotFoundError, SaveError):
+            # No delta since the full save, or one left over from an older full save
+            return base
+
+    def wait(self):
+        """ Wait for the saves asked for so far to be written """
+        self.requests.join()
+
+    def close(self):
+        """ Write the saves asked for so far, then stop the save thread """
+        self.requests.put(None)
+        self.thread.join()
+
+    # region Save thread
+    def work(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                self.requests.task_done()
+                return
+            state, full = request
+            try:
+                if full or self.base is None or self.base.map_name != state.map_name:
+                    self.write(self.full_path, encode(state))
+                    self.base = state
+                    # The old delta is based on another full save
+                    if os.path.exists(self.delta_path):
+                        os.remove(self.delta_path)
+                else:
+                    self.write(self.delta_path, encode(state, self.base))
+            except OSError as error:
+                log.error("save", "Could not save the game: {}", error)
+            self.requests.task_done()
+
+    def write(self, file_path, data):
+        """ Write the whole file or nothing, so a crash halfway never leaves a broken save """
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        temporary_path = file_path + ".tmp"
+        with open(temporary_path, "wb") as file:
+            file.write(data)
+        os.replace(temporary_path, file_path)
+    # endregion
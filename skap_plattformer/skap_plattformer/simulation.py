@@ -0,0 +1,706 @@
+# Headless simulation core for the Skap platforming game.
+# Holds the level, the player and the physics engine, and runs the game logic
+# with a fixed timestep. Needs no window or GL context, so it can run on CI.
+
+import arcade, argparse, math, numpy, pymunk, time
+from constants import *
+from activity import ItemActivity, ITEM_ACTIVITY_INTERVAL, ITEM_SLEEP_TIME, sync_sprites, view_area
+from chunks import ChunkStreamer, is_streamed_map
+from entities import PlayerStore, PlayerSprite, GhostRunner, GHOST_GROUP, GHOST_CATEGORY
+from level import compile_level
+from levels import LevelManifest
+from log import log
+from pool import SpritePool
+from profiler import Profiler
+from registry import AssetRegistry
+from replay import get_input_bits
+from savestate import SaveState
+from snapshot import LevelSnapshot
+from substeps import SubStepper
+import level_cache
+
+
+# Bullets go through ghosts
+BULLET_FILTER = pymunk.ShapeFilter(mask=pymunk.ShapeFilter.ALL_MASKS() ^ GHOST_CATEGORY)
+
+PLAYER_HIT_BOX = ((-14.5, -20.0), (-11.5, -25.0), (7.5, -25.0), (8.5, -20.0), (8.5, 18.0), (4.5, 22.0), (-2.5, 22.0),
+                  (-14.5, 10.0))
+# Left, bottom, right and top of the player hit box, one pixel bigger, to find the players that might be on a ladder
+PLAYER_BOX = numpy.array([min(x for x, _ in PLAYER_HIT_BOX) - 1, min(y for _, y in PLAYER_HIT_BOX) - 1,
+                          max(x for x, _ in PLAYER_HIT_BOX) + 1, max(y for _, y in PLAYER_HIT_BOX) + 1])
+
+
+def is_on_ground(engine, body):
+    """ Same as PymunkPhysicsEngine.is_on_ground(), without making a contact point set for every contact """
+    down = pymunk.Vec2d(1, 0).rotated(engine.space.gravity.angle)
+    incline = engine.maximum_incline_on_ground
+    grounded = False
+
+    def check(arbiter):
+        nonlocal grounded
+        normal = arbiter.normal
+        if down.x + incline > normal.x > down.x - incline and down.y + incline > normal.y > down.y - incline:
+            grounded = True
+
+    body.each_arbiter(check)
+    return grounded
+
+
+def player_velocity(body, gravity, damping, dt):
+    """ Same as the velocity callback PymunkPhysicsEngine.add_sprite() gives the players, without looking
+    up the sprite's pymunk settings for every body every step """
+    pymunk.Body.update_velocity(body, gravity, PLAYER_DAMPING ** dt, dt)
+    velocity_x, velocity_y = body.velocity
+    if abs(velocity_x) > PLAYER_MAX_HORIZONTAL_SPEED:
+        body.velocity = pymunk.Vec2d(PLAYER_MAX_HORIZONTAL_SPEED * math.copysign(1, velocity_x), velocity_y)
+        velocity_x = body.velocity.x
+    # arcade caps the vertical speed at the horizontal maximum, kept so the players move like before
+    if abs(velocity_y) > PLAYER_MAX_VERTICAL_SPEED:
+        body.velocity = pymunk.Vec2d(velocity_x, PLAYER_MAX_HORIZONTAL_SPEED * math.copysign(1, velocity_y))
+
+
+class GameSimulation:
+    """ Game state and logic, without any drawing """
+
+    def __init__(self):
+        """ Create the variables """
+
+        # Init the tile map
+        self.tile_map = None
+        self.end_of_map = None
+        self.friction = None
+
+        # Levels in the order they are played (see levels.py)
+        self.levels = LevelManifest.load()
+        # Number of the level in the manifest, None for maps that aren't in it
+        self.level = 1
+        self.map_name = self.levels.maps[0]
+        # Loads the next level while this one is played. None to load every level when it starts.
+        self.level_preloader = None
+
+        # Scene object
+        self.scene = None
+
+        # Loads the chunks around the player of infinite maps (see chunks.py). None for normal levels.
+        self.chunk_streamer = None
+
+        # Items, weapons and textures by name, loaded when first used (see registry.py)
+        self.registry = AssetRegistry()
+
+        # The weapon definition the player shoots with
+        self.weapon = None
+
+        # Layer groups and pick-up handlers compiled from the level properties (see level.py)
+        self.compiled_level = None
+
+        # Spatial indexes of the sprites the player can touch, built in setup()
+        self.pick_up_index = None
+        self.ladder_index = None
+        self.water_index = None
+
+        # Pooled sprites (see pool.py). Pick-up layer name -> pool of its pick-ups.
+        self.pick_up_pools = {}
+        self.bullet_pool = None
+        self.wall_collision_type = None
+
+        # Physics engine
+        self.physics_engine = None
+        # Freezes the physics items far from the players (see activity.py)
+        self.item_activity = None
+        # Splits the physics steps when something is going fast towards a wall (see substeps.py)
+        self.sub_stepper = SubStepper()
+        # Physics sub-steps taken since setup(), to see how often steps are split
+        self.physics_substeps = 0
+        # Pymunk shape -> the order setup() added it to the space in, restoring a snapshot adds them the same way
+        self.shape_order = {}
+
+        # Every player is a row in the player store (see entities.py). self.player is the first one,
+        # the one on the keyboard that the camera follows.
+        self.players = None
+        self.ghosts = None
+        # Players added when a level is set up: the number of co-op players after the first,
+        # and (recording, delay) for every ghost runner
+        self.coop_players = 0
+        self.ghost_recordings = []
+
+        # Score
+        self.score = 0
+
+        # Timer
+        self.total_time = 0.0
+
+        # Fixed timestep. Time from rendered frames that has not been simulated yet.
+        self.time_accumulator = 0.0
+        self.tick_count = 0
+
+        # The level right after setup(), restored by soft_reset() (see snapshot.py)
+        self.start_snapshot = None
+
+        # Input recording and replay (see replay.py)
+        self.recorder = None
+        self.replayer = None
+
+        # Region timings (see profiler.py). The game window turns this on.
+        self.profiler = Profiler(enabled=False)
+
+        # Sounds. The game window loads these, the headless simulation stays silent.
+        self.collect_coin_sound = None
+        self.jump_sound = None
+        self.big_jump_sound = None
+        self.land_sound = None
+
+        # Sprite lists we need
+        self.player_list = None
+        self.wall_list = None
+        self.bullet_list = None
+        self.item_list = None
+        self.coin_list = None
+        self.ice_list = None
+
+        # Track the current state of what key is pressed
+        self.left_pressed: bool = False
+        self.right_pressed: bool = False
+        self.up_pressed: bool = False
+        self.down_pressed: bool = False
+        self.fire_pressed: bool = False
+
+        self.player = {}
+        self.damping = 0
+        self.gravity = 0
+
+    def setup(self):
+        """ Set up the level, the player and the physics """
+
+        # region Map
+        prepared = None
+        if self.level_preloader is not None:
+            prepared = self.level_preloader.take(self.map_name)
+
+        if self.chunk_streamer is not None:
+            self.chunk_streamer.close()
+            self.chunk_streamer = None
+
+        if is_streamed_map(self.map_name):
+            # Infinite map. Its tiles are loaded in chunks around the player once the physics engine is made.
+            self.tile_map = None
+            self.chunk_streamer = ChunkStreamer(path(self.map_name))
+            self.scene = arcade.Scene()
+            self.end_of_map = None
+        else:
+            # Load in TileMap, from the level cache (see level_cache.py), unless it was loaded already
+            if prepared is not None:
+                self.tile_map = prepared.tile_map
+            else:
+                self.tile_map = level_cache.load_tilemap(path(self.map_name), SPRITE_SCALING_TILES)
+            self.scene = arcade.Scene.from_tilemap(self.tile_map)
+            self.end_of_map = self.tile_map.width * self.tile_map.tile_width * SPRITE_SCALING_TILES
+        self.level = self.levels.number(self.map_name)
+
+        self.score = 0
+        self.total_time = 0.0
+        self.time_accumulator = 0.0
+        self.tick_count = 0
+        self.physics_substeps = 0
+        self.sub_stepper.reset()
+
+        # Create the missing sprite lists
+        self.player_list = arcade.SpriteList()
+        self.bullet_list = arcade.SpriteList()
+
+        layers = ["BackgroundTile", "Ground", "Ice", "Ladder", "DecorationBehindPlayer", "Player", "DynamicItem",
+                  "Item", "Coin", "Platform", "DecorationInFrontPlayer"]
+        if "BackgroundTile" not in self.scene.name_mapping:
+            self.scene.add_sprite_list("BackgroundTile")
+
+
+        previous_layer = "BackgroundTile"
+        for name in layers:
+            if name not in self.scene.name_mapping:
+                self.scene.add_sprite_list_after(name, previous_layer)
+                previous_layer = name
+
+        if self.chunk_streamer is None:
+            for name, properties in self.tile_map.layer_properties:
+                if properties:
+                    if not self.scene[name]:
+                        self.scene.add_sprite_list(name)
+                    self.scene[name].properties = properties
+                    log.debug("level", "Added {} to {}", properties, name)
+        else:
+            # The streamed map has none of the game's layers. They stay empty.
+            for name in self.scene.name_mapping:
+                self.scene[name].properties = {'collision_type': 'none'}
+
+        log.debug("level", "Ground properties: {}", self.scene["Ground"].properties)
+
+        # Turn the layer and object properties into tables, so the game loop doesn't have to read them
+        self.compiled_level = compile_level(self.scene, self, prepared.wall_shapes if prepared is not None else None)
+        self.pick_up_index = self.compiled_level.pick_up_index
+        self.ladder_index = self.compiled_level.ladder_index
+        self.water_index = self.compiled_level.water_index
+        self.coin_list = self.scene["Coin"]
+
+        # Picked up items are turned off and can be turned on again, instead of being deleted
+        self.pick_up_pools = {}
+        for name, sprite_list in self.scene.name_mapping.items():
+            if any(sprite_list is layer for layer in self.compiled_level.pick_up_layers):
+                self.pick_up_pools[name] = SpritePool(sprite_list, sprite_list, active=True)
+
+        # All the bullets of the level are made now. The scene only takes a sprite list that isn't empty.
+        self.weapon = self.registry.definition("weapons", "fireball")
+        self.bullet_pool = SpritePool.preallocate(self.bullet_list, BULLET_POOL_SIZE, self.make_bullet)
+        self.scene.add_sprite_list_after("Bullet", "Item", sprite_list=self.bullet_list)
+
+        # The streamed tile layers fill up later, so they are not compiled with the rest
+        if self.chunk_streamer is not None:
+            self.chunk_streamer.add_to_scene(self.scene)
+        # endregion
+
+        # region Player
+        if "Player" not in self.scene.name_mapping:
+            self.scene.add_sprite_list_before("Player", "DecorationInFrontPlayer")
+
+        self.players = PlayerStore()
+        self.ghosts = GhostRunner()
+        self.player = self.make_player()
+        log.debug("player", "Player hit box: {}", self.player.hit_box)
+        # endregion
+
+        # Damping means the fraction of speed that you still have after 1 second.
+        self.damping = DEFAULT_DAMPING
+
+        # Set the gravity. (0, 0) is good for outer space and top-down.
+        self.gravity = (0, -GRAVITY)
+
+        # region The physics engine
+        self.physics_engine = arcade.PymunkPhysicsEngine(damping=self.damping, gravity=self.gravity)
+
+        # Add the player.
+        self.add_player_physics(self.player)
+
+        # STATIC means cant move, DYNAMIC can move, KINEMATIC means can move, but has to be coded in.
+
+        # Add the walls. The wall tiles are merged into a few big shapes when the level
+        # is compiled (see level.py), so they are added straight to the pymunk space.
+        if "wall" not in self.physics_engine.collision_types:
+            self.physics_engine.collision_types.append("wall")
+        self.wall_collision_type = self.physics_engine.collision_types.index("wall")
+        static_body = self.physics_engine.space.static_body
+        for points, friction in self.compiled_level.wall_shapes:
+            shape = pymunk.Poly(static_body, points)
+            shape.friction = friction
+            shape.collision_type = self.wall_collision_type
+            self.physics_engine.space.add(shape)
+
+        # Add the items
+        for item_list in self.compiled_level.item_layers:
+            self.physics_engine.add_sprite_list(item_list,
+                                                friction=DYNAMIC_ITEM_FRICTION,
+                                                mass = 0.75,
+                                                collision_type="item")
+            for item in item_list:
+                self.physics_engine.get_physics_object(item).shape.filter = pymunk.ShapeFilter(
+                    mask=pymunk.ShapeFilter.ALL_MASKS() ^ GHOST_CATEGORY)
+
+        # Items that are still sleep until something touches them, items far from the players are frozen
+        self.physics_engine.space.sleep_time_threshold = ITEM_SLEEP_TIME
+        self.item_activity = ItemActivity(self.physics_engine,
+                                          [item for item_list in self.compiled_level.item_layers for item in item_list])
+
+        # The other players come last, so the first player plays out the same with or without them
+        for _ in range(self.coop_players):
+            self.add_player_physics(self.make_player())
+        for recording, delay in self.ghost_recordings:
+            ghost = self.make_player(ghost=True)
+            self.add_player_physics(ghost)
+            self.ghosts.add(ghost.index, recording, delay)
+
+        # Load the chunks around the player before the first step, so there is ground to stand on
+        if self.chunk_streamer is not None:
+            self.chunk_streamer.attach(self.physics_engine)
+            self.chunk_streamer.load_all_around(*self.player.position)
+        # endregion
+
+        self.shape_order = {shape: number for number, shape in enumerate(self.physics_engine.space.shapes)}
+        self.start_snapshot = LevelSnapshot(self)
+
+        # Recordings and replays start from the first step of the level
+        self.start_recording()
+
+        if self.level_preloader is not None:
+            self.level_preloader.preload(self.levels.next(self.map_name))
+
+    def level_finished(self):
+        """ The player has walked off the right end of the level """
+        return self.end_of_map is not None and self.player.center_x > self.end_of_map
+
+    def load_level(self, map_name=None):
+        """ Start the given level, or the next one in the level manifest """
+        self.map_name = map_name or self.levels.next(self.map_name)
+        self.setup()
+
+    # region Players
+    def make_player(self, ghost=False):
+        """ A new player sprite with a row in the player store, at the start of the level """
+        image_source = path("skap_plattformer/assets/player/player_right.png")
+        player = PlayerSprite(image_source, 1, hit_box_algorithm='Simple')
+        self.players.add(player, ghost)
+        self.scene.add_sprite("Player", player)
+
+        player.hit_box = PLAYER_HIT_BOX
+        # Co-op players start next to each other, ghosts where the first player starts
+        grid_x = 3 if ghost else 3 + player.index
+        grid_y = 3
+        player.center_x = SPRITE_SIZE * grid_x + SPRITE_SIZE / 2
+        player.center_y = SPRITE_SIZE * grid_y + SPRITE_SIZE / 2
+        if ghost:
+            player.alpha = GHOST_ALPHA
+        return player
+
+    def add_player_physics(self, player):
+        ghost = self.players.ghost[player.index]
+        self.physics_engine.add_sprite(player,
+                                       damping=PLAYER_DAMPING,
+                                       friction=PLAYER_FRICTION,
+                                       mass=PLAYER_MASS,
+                                       moment=arcade.PymunkPhysicsEngine.MOMENT_INF,
+                                       collision_type="ghost" if ghost else "player",
+                                       max_horizontal_velocity=PLAYER_MAX_HORIZONTAL_SPEED,
+                                       max_vertical_velocity=PLAYER_MAX_VERTICAL_SPEED)
+        physics_object = self.physics_engine.get_physics_object(player)
+        physics_object.body.velocity_func = player_velocity
+        if ghost:
+            physics_object.shape.filter = pymunk.ShapeFilter(group=GHOST_GROUP, categories=GHOST_CATEGORY)
+        else:
+            physics_object.shape.filter = pymunk.ShapeFilter(mask=pymunk.ShapeFilter.ALL_MASKS() ^ GHOST_CATEGORY)
+        self.players.physics_objects[player.index] = physics_object
+
+    def add_ghost(self, recording, delay=0):
+        """ A ghost runner that plays a recording of this level, from the next setup() on """
+        self.ghost_recordings.append((recording, delay))
+    # endregion
+
+    def soft_reset(self):
+        """ Restart the level without loading it again: only the state that changes while playing is put back """
+        self.start_snapshot.restore(self)
+        if self.chunk_streamer is not None:
+            self.chunk_streamer.jump_to(*self.player.position)
+        self.start_recording()
+
+    def save_state(self):
+        """ The state of the level as plain numbers, to be saved with savestate.encode() or an Autosaver """
+        return SaveState.capture(self)
+
+    def load_state(self, state):
+        """ Continue from a saved state. Sets up its level first if another one is loaded,
+        or if the save has another number of co-op players. The game goes on from there,
+        but not exactly like the saved game would have (see savestate.py) """
+        if self.map_name != state.map_name or self.physics_engine is None or self.coop_players != state.coop_players:
+            self.map_name = state.map_name
+            self.coop_players = state.coop_players
+            self.setup()
+        state.restore(self)
+        if self.chunk_streamer is not None:
+            self.chunk_streamer.jump_to(*self.player.position)
+
+    def start_recording(self):
+        """ Recordings and replays start from the first step of the level """
+        if self.recorder is not None:
+            self.recorder.start(self)
+        if self.replayer is not None:
+            self.replayer.start(self)
+
+    def advance(self, delta_time):
+        """ Move the game forward by delta_time seconds, in fixed steps. Returns how many steps were run """
+
+        self.time_accumulator += delta_time
+        steps = 0
+        while self.time_accumulator >= FIXED_TIMESTEP and steps < MAX_STEPS_PER_FRAME:
+            self.fixed_update()
+            self.time_accumulator -= FIXED_TIMESTEP
+            steps += 1
+
+        # Too far behind to catch up. Drop the rest instead of spiraling.
+        if steps == MAX_STEPS_PER_FRAME:
+            self.time_accumulator = min(self.time_accumulator, FIXED_TIMESTEP)
+
+        return steps
+
+    def run(self, seconds):
+        """ Simulate the given number of game seconds as fast as possible.
+        One player on the test level runs at about 60 to 100 times real time, 0.2 to 0.3 ms a step
+        (python simulation.py --seconds 20). That is far from thousands of times real time: the
+        pymunk step alone takes about 0.035 ms, so even without any game logic it would stop near
+        500 times. Most of a step is the NumPy work on the player store (climbing, movement and
+        jumping, about 0.18 ms), whose cost per call doesn't shrink with one player. Run many
+        levels side by side with rollout.py for more game seconds per second """
+
+        for _ in range(round(seconds / FIXED_TIMESTEP)):
+            self.fixed_update()
+
+    def fixed_update(self):
+        """ One fixed step of movement and game logic """
+
+        profiler = self.profiler
+
+        # region Input replay and recording
+        profiler.begin("replay")
+        if self.replayer is not None:
+            self.replayer.feed(self)
+        if self.recorder is not None:
+            self.recorder.record(self)
+        # endregion
+
+        # Every player at once, as arrays with a value per player (see entities.py)
+        players = self.players
+        count = players.count
+        engine = self.physics_engine
+        sprites = players.sprites
+        not_ghost = ~players.ghost[:count]
+        players.set_input_bits(0, get_input_bits(self))
+        self.ghosts.feed(players, self.tick_count)
+        left = players.left[:count]
+        right = players.right[:count]
+        up = players.up[:count]
+        down = players.down[:count]
+
+        # region Player Left/Right
+        profiler.begin("movement")
+        on_ground = players.on_ground[:count]
+        was_on_ground = on_ground.copy()
+        on_ground[:] = [is_on_ground(engine, physics_object.body) for physics_object in players.physics_objects]
+        landed = on_ground & ~was_on_ground & (players.fall_speed[:count] > LAND_SOUND_MIN_SPEED)
+        if (landed & not_ghost).any():
+            self.play_sound(self.land_sound)
+
+        # The forces on every player are added up here and in the next regions, then applied at the end of Climbing
+        force_x = numpy.zeros(count)
+        force_y = numpy.zeros(count)
+
+        # Update player forces based on keys pressed
+        walking_left = left & ~right
+        walking_right = right & ~left
+        walk_force = numpy.where(on_ground, PLAYER_MOVE_FORCE_ON_GROUND, PLAYER_MOVE_FORCE_IN_AIR)  # Bole er bøg
+        force_x[walking_left] -= walk_force[walking_left]
+        force_x[walking_right] += walk_force[walking_right]
+        players.animation_frame[:count] += walking_right & on_ground
+        facing = players.facing[:count]
+        facing[walking_left] = -1
+        facing[walking_right] = 1
+        # Friction is zero for the players that are moving. The others get their friction up, so they stop.
+        friction = numpy.where(walking_left | walking_right, 0.0, 1.0)
+        # endregion
+
+        # region Jump mechanics
+        profiler.begin("jump")
+        on_ladder = players.on_ladder[:count]
+        new_jump = players.new_jump[:count]
+        boost = players.jump_boost_soda[:count] * PLAYER_JUMP_SODA_BOOST
+        holding_up = up & ~down
+
+        # Do the jump
+        jumping = on_ground & ~on_ladder & new_jump & holding_up
+        new_jump[jumping] = False
+        for index in numpy.flatnonzero(jumping):
+            engine.apply_impulse(sprites[index], [0, PLAYER_JUMP_FORCE + int(boost[index])])
+        if (jumping & not_ghost).any():
+            self.play_sound(self.jump_sound)
+
+        # Extending the jump
+        air_time = players.air_time[:count]
+        in_air = ~on_ground & ~on_ladder
+        air_time[in_air] += 1
+        holding_jump = in_air & holding_up & ~new_jump
+        first_push = holding_jump & (air_time < 11)
+        second_push = holding_jump & (air_time < 17)
+        force_y[first_push] += 3500 + boost[first_push]
+        force_y[second_push] += 2500 + boost[second_push]
+        # Once the jump stops being held, it can't be extended again
+        air_time[in_air & ~second_push] = 1000
+        force_y[in_air & down & ~up] -= 5000
+        air_time[~in_air] = 0
+
+        new_jump[~up] = True
+        # endregion
+
+        # region Climbing
+        profiler.begin("climbing")
+        # Only the players near a ladder cell are checked one by one
+        positions = numpy.array([sprite.position for sprite in sprites]).reshape(count, 2)
+        boxes = (positions[:, 0] + PLAYER_BOX[0], positions[:, 1] + PLAYER_BOX[1],
+                 positions[:, 0] + PLAYER_BOX[2], positions[:, 1] + PLAYER_BOX[3])
+        on_ladder[:] = False
+        for index in numpy.flatnonzero(self.ladder_index.may_touch(*boxes)):
+            on_ladder[index] = bool(self.ladder_index.check_for_collision(sprites[index]))
+        # Being in water only changes the animation (see animations.py)
+        in_water = players.in_water[:count]
+        in_water[:] = False
+        for index in numpy.flatnonzero(self.water_index.may_touch(*boxes)):
+            in_water[index] = bool(self.water_index.check_for_collision(sprites[index]))
+
+        climbing_up = on_ladder & up & ~down
+        climbing_down = on_ladder & down & ~up
+        force_y[climbing_up] += PLAYER_CLIMB_FORCE * 100
+        force_y[climbing_down] -= PLAYER_CLIMB_FORCE
+        friction[climbing_up | climbing_down] = 0.0
+        # Players holding on to a ladder stop going up or down
+        for index in numpy.flatnonzero(on_ladder & ~climbing_up & ~climbing_down):
+            body = players.physics_objects[index].body
+            body.velocity = (body.velocity.x, 0)
+
+        # Not read by the physics engine, they follow the first player
+        if on_ladder[0]:
+            engine.gravity = (0, 0)
+            engine.damping = 0.01
+            engine.max_vertical_velocity = PLAYER_MAX_CLIMB_SPEED
+        else:
+            engine.damping = 0.3
+            engine.max_vertical_velocity = PLAYER_MAX_VERTICAL_SPEED
+            engine.gravity = GRAVITY
+
+        for index, physics_object in enumerate(players.physics_objects):
+            if force_x[index] or force_y[index]:
+                physics_object.body.apply_force_at_local_point((force_x[index], force_y[index]), (0, 0))
+            physics_object.shape.friction = friction[index]
+        # endregion
+
+        # region Collision Detection
+        profiler.begin("collision detection")
+        for index in numpy.flatnonzero(not_ghost):
+            player = sprites[index]
+            for item in self.pick_up_index.check_for_collision(player):
+                self.pick_up_index.remove(item)
+                item.pool.deactivate(item)
+                item.on_pick_up(item, player)
+                self.spawn_particles(item)
+
+        # The players have not moved since the ladder check in the Climbing region,
+        # so on_ladder is still up to date here.
+
+        # region Keep track of time
+        profiler.begin("timer")
+        # The HUD (see hud.py) turns this into text, once per drawn frame
+        self.total_time += FIXED_TIMESTEP
+        # endregion
+
+        # endregion
+
+        # region Bullets
+        profiler.begin("bullets")
+        fire_cooldown = players.fire_cooldown[:count]
+        for index in numpy.flatnonzero(players.fire[:count] & not_ghost & (fire_cooldown <= 0)):
+            self.fire_bullet(sprites[index])
+        fire_cooldown -= FIXED_TIMESTEP
+        self.update_bullets()
+        # endregion
+
+        # Move items in the physics engine
+        profiler.begin("physics step")
+        # Split up when something goes fast towards a wall (see substeps.py). Only the sprites of the
+        # players and the items in the space are moved to their bodies.
+        substeps = self.sub_stepper.step(self.physics_engine,
+                                         players.physics_objects + self.item_activity.active_objects, FIXED_TIMESTEP)
+        self.physics_substeps += substeps
+        profiler.count("physics sub-steps", substeps)
+        if substeps > 1:
+            log.debug("physics", "Step {} split into {} sub-steps", self.tick_count, substeps)
+        sync_sprites(players.sprites, players.physics_objects)
+        self.item_activity.sync()
+        if self.tick_count % ITEM_ACTIVITY_INTERVAL == 0:
+            profiler.begin("item activity")
+            self.item_activity.update([view_area(*sprites[index].position) for index in numpy.flatnonzero(not_ghost)])
+        players.fall_speed[:count] = [-physics_object.body.velocity.y for physics_object in players.physics_objects]
+
+        # Load the chunks the player is getting close to, and unload the ones left behind
+        if self.chunk_streamer is not None:
+            profiler.begin("chunk streaming")
+            self.chunk_streamer.update(*self.player.position)
+        profiler.end()
+        self.tick_count += 1
+
+    def play_sound(self, sound):
+        """ The headless simulation has no audio. The game window plays the sound instead """
+        pass
+
+    def spawn_particles(self, item):
+        """ Particles are only for show, so the game window makes them and the headless simulation doesn't """
+        pass
+
+    # region Pooled sprites
+    def make_bullet(self):
+        bullet = arcade.Sprite(texture=self.registry.texture(self.weapon["texture"]), scale=SPRITE_SCALING_TILES)
+        bullet.lifetime = 0.0
+        return bullet
+
+    def fire_bullet(self, player):
+        """ Shoot a bullet the way a player is facing. If every bullet is flying, the oldest one is used """
+        bullet = self.bullet_pool.activate()
+        bullet.position = player.position
+        bullet.change_x = self.weapon["speed"] * player.facing
+        bullet.lifetime = self.weapon["lifetime"]
+        player.fire_cooldown = self.weapon["cooldown"]
+
+    def update_bullets(self):
+        """ Move the bullets, and turn off the ones that hit a wall or flew for too long """
+        space = self.physics_engine.space
+        for bullet in self.bullet_pool:
+            bullet.center_x += bullet.change_x * FIXED_TIMESTEP
+            bullet.lifetime -= FIXED_TIMESTEP
+            hit = space.point_query_nearest(bullet.position, 0, BULLET_FILTER)
+            if bullet.lifetime <= 0 or (hit is not None and hit.shape.collision_type == self.wall_collision_type):
+                self.bullet_pool.deactivate_later(bullet)
+        self.bullet_pool.deactivate_expired()
+    # endregion
+
+
+def main():
+    """ Run the game without a window, as fast as possible """
+    parser = argparse.ArgumentParser(description="Run the Skap platformer without a window")
+    parser.add_argument("--seconds", type=float, default=60, help="game seconds to simulate")
+    parser.add_argument("--map", default=DEFAULT_MAP, help="level to load, relative to the repository")
+    parser.add_argument("--trace", help="time every step and write a Chrome trace JSON file here")
+    parser.add_argument("--ghost", help="recording (.skr) for ghost runners to play back")
+    parser.add_argument("--ghosts", type=int, default=1, help="how many ghost runners play --ghost, a step apart")
+    parser.add_argument("--players", type=int, default=1, help="local players, they stand still")
+    args = parser.parse_args()
+
+    simulation = GameSimulation()
+    simulation.map_name = args.map
+    simulation.coop_players = args.players - 1
+    if args.ghost:
+        from replay import Recording
+        recording = Recording.load(args.ghost)
+        simulation.map_name = recording.map_name
+        for delay in range(args.ghosts):
+            simulation.add_ghost(recording, delay)
+    simulation.setup()
+
+    start = time.perf_counter()
+    if args.trace:
+        # Every step is a frame of its own in the trace
+        simulation.profiler.enabled = True
+        for _ in range(round(args.seconds / FIXED_TIMESTEP)):
+            simulation.profiler.begin_frame()
+            simulation.fixed_update()
+            simulation.profiler.end_frame()
+    else:
+        simulation.run(args.seconds)
+    elapsed = time.perf_counter() - start
+
+    print(f"Simulated {args.seconds} s in {elapsed:.3f} s ({args.seconds / elapsed:.0f}x real time)")
+    print(f"Player at {simulation.player.position}, score {simulation.score}")
+    print(f"{simulation.physics_substeps} physics sub-steps in {simulation.tick_count} steps")
+    if len(simulation.players) > 1:
+        print(f"{len(simulation.players)} players, {len(simulation.ghosts)} of them ghosts")
+
+    if args.trace:
+        for name, (p50, p95, p99) in simulation.profiler.percentiles().items():
+            print(f"{name:<20} p50 {p50:.3f} ms, p95 {p95:.3f} ms, p99 {p99:.3f} ms")
+        for name, (p50, p95, p99) in simulation.profiler.count_percentiles().items():
+            print(f"{name:<20} p50 {p50:g}, p95 {p95:g}, p99 {p99:g}")
+        events = simulation.profiler.export_trace(args.trace)
+        print(f"Wrote {events} trace events to {args.trace}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+# Snapshots of everything in a level that changes while playing.
+# The level itself (tiles, walls, textures, the physics space) never changes after
+# setup(), so restarting only has to put the moving parts back: the player, the
+# physics items, the pick-ups, the bullets, the score and the clock. That is a few
+# hundred numbers, instead of loading the level again.
+
+import pymunk
+from constants import *
+
+# Attributes the game loop changes on the player sprite
+PLAYER_ATTRIBUTES = ("newJump", "jump_boost_soda", "on_ladder", "on_ground", "air_time", "animation_frame",
+                     "in_water", "facing", "fire_cooldown", "fall_speed")
+# Attributes the climbing code changes on the physics engine
+PHYSICS_ENGINE_ATTRIBUTES = ("gravity", "damping", "max_vertical_velocity")
+# Counters on the game
+GAME_ATTRIBUTES = ("score", "total_time", "time_accumulator", "tick_count")
+# Settings of the pymunk space, copied to the new space on restore
+SPACE_ATTRIBUTES = ("gravity", "damping", "iterations", "sleep_time_threshold", "idle_speed_threshold",
+                    "collision_slop", "collision_bias", "collision_persistence")
+
+
+class BodyState:
+    """ Where a pymunk body is and how it moves """
+
+    def __init__(self, body):
+        self.position = tuple(body.position)
+        self.velocity = tuple(body.velocity)
+        self.angle = body.angle
+        self.angular_velocity = body.angular_velocity
+
+    def restore(self, body):
+        body.position = self.position
+        body.velocity = self.velocity
+        body.angle = self.angle
+        body.angular_velocity = self.angular_velocity
+        body.force = (0, 0)
+        body.torque = 0
+
+    def values(self):
+        """ The state as six numbers, for save files (see savestate.py) """
+        return (*self.position, *self.velocity, self.angle, self.angular_velocity)
+
+    @classmethod
+    def from_values(cls, values):
+        """ The state from the six numbers of values() """
+        state = cls.__new__(cls)
+        state.position = tuple(values[0:2])
+        state.velocity = tuple(values[2:4])
+        state.angle = values[4]
+        state.angular_velocity = values[5]
+        return state
+
+
+class LevelSnapshot:
+    """ The changing state of a level at one moment """
+
+    def __init__(self, game):
+        self.game_values = {name: getattr(game, name) for name in GAME_ATTRIBUTES}
+        self.player_values = {name: getattr(game.player, name) for name in PLAYER_ATTRIBUTES}
+        self.physics_engine_values = {name: getattr(game.physics_engine, name)
+                                      for name in PHYSICS_ENGINE_ATTRIBUTES if hasattr(game.physics_engine, name)}
+
+        player_object = game.physics_engine.get_physics_object(game.player)
+        self.player_body = BodyState(player_object.body)
+        self.player_friction = player_object.shape.friction
+
+        # The rows of every player in the player store, and the bodies of the players after the first
+        self.player_arrays = game.players.save()
+        self.other_players = [(BodyState(physics_object.body), physics_object.shape.friction)
+                              for physics_object in game.players.physics_objects[1:]]
+
+        # Sprite -> BodyState of every physics item
+        self.items = {}
+        for item_list in game.compiled_level.item_layers:
+            for item in item_list:
+                self.items[item] = BodyState(game.physics_engine.get_physics_object(item).body)
+
+        # Layer name -> the pick-ups not picked up yet, and the bullets in the air with how long they have left
+        self.pick_ups = {name: set(pool.active) for name, pool in game.pick_up_pools.items()}
+        self.bullets = [(bullet, bullet.position, bullet.change_x, bullet.lifetime) for bullet in game.bullet_pool]
+
+    def restore(self, game):
+        """ Put the level back the way it was. The physics bodies get a clean start, as if the level was just set up """
+        for name, value in self.game_values.items():
+            setattr(game, name, value)
+        # The first player's values go on top, they can be changed after the snapshot is taken (see savestate.py)
+        game.players.load(self.player_arrays)
+        for name, value in self.player_values.items():
+            setattr(game.player, name, value)
+        for name, value in self.physics_engine_values.items():
+            setattr(game.physics_engine, name, value)
+
+        # The level moves to a new pymunk space, with everything added in the order setup()
+        # added it. Pymunk numbers the shapes in the order they are added to a space, and
+        # collides them in the order of those numbers, so putting them back in the old space
+        # would number them on from where it was. The new space also has none of the contacts
+        # pymunk remembers from the last steps. The moving bodies are swapped for copies, which
+        # drops the push the solver left on them for the next step. The next step then plays
+        # out exactly the same as after a fresh setup(). For a snapshot taken in the middle of
+        # a run, that means the contacts it had are gone, so the run goes on a little differently
+        # from how it would have (see savestate.py).
+        engine = game.physics_engine
+        space = engine.space
+        shapes = list(space.shapes)
+        # The items frozen far from the players aren't in the space (see activity.py)
+        shapes += [physics_object.shape for physics_object in engine.sprites.values()
+                   if physics_object.shape.space is None]
+        shapes.sort(key=lambda shape: game.shape_order.get(shape, len(game.shape_order)))
+        space.remove(*space.shapes, *space.bodies)
+
+        new_space = pymunk.Space()
+        for name in SPACE_ATTRIBUTES:
+            setattr(new_space, name, getattr(space, name))
+        for shape in shapes:
+            if shape.body is space.static_body:
+                shape.body = new_space.static_body
+        engine.space = new_space
+
+        player_object = engine.get_physics_object(game.player)
+        player_object.shape.friction = self.player_friction
+        self.restore_body(player_object, self.player_body, game.player)
+        for (state, friction), physics_object, player in zip(self.other_players, game.players.physics_objects[1:],
+                                                            game.players.sprites[1:]):
+            physics_object.shape.friction = friction
+            self.restore_body(physics_object, state, player)
+        for item, state in self.items.items():
+            self.restore_body(engine.get_physics_object(item), state, item)
+
+        new_space.add(*(physics_object.body for physics_object in engine.sprites.values()), *shapes)
+        game.item_activity.reset()
+        game.sub_stepper.reset()
+
+        for name, pool in game.pick_up_pools.items():
+            keep = self.pick_ups[name]
+            for item in pool.activate_all():
+                game.pick_up_index.add(item)
+            for item in list(pool.active):
+                if item not in keep:
+                    game.pick_up_index.remove(item)
+                    pool.deactivate(item)
+
+        game.bullet_pool.deactivate_all()
+        for bullet, position, change_x, lifetime in self.bullets:
+            # Free bullets are taken from the end, so put the wanted one there first
+            game.bullet_pool.free.remove(bullet)
+            game.bullet_pool.free.append(bullet)
+            game.bullet_pool.activate()
+            bullet.position = position
+            bullet.change_x = change_x
+            bullet.lifetime = lifetime
+
+    def restore_body(self, physics_object, state, sprite):
+        """ Give a physics object a fresh copy of its body, in the snapshot state """
+        body = physics_object.body.copy()
+        state.restore(body)
+        physics_object.shape.body = body
+        physics_object.body = body
+        sprite.position = body.position
+        sprite.radians = body.angle
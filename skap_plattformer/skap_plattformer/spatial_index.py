@@ -0,0 +1,83 @@
+# Uniform grid of sprites that do not move, like coins and ladders.
+# Built once when a level is set up, so asking what the player touches only
+# looks at the few cells around the player instead of every sprite in the layer.
+
+import arcade, math, numpy
+from constants import *
+
+# Width and height of one grid cell in pixels. Two scaled tiles per cell.
+SPATIAL_INDEX_CELL_SIZE = GRID_PIXEL_SIZE * SPRITE_SCALING_TILES * 2
+
+
+class SpatialIndex:
+    """ Spatial hash for static sprites """
+
+    def __init__(self, cell_size=SPATIAL_INDEX_CELL_SIZE):
+        self.cell_size = cell_size
+        # (column, row) -> sprites touching that cell
+        self.cells = {}
+        # sprite -> the cells it was put in, so it can be taken out again
+        self.sprite_cells = {}
+        # Sorted numbers of the cells with sprites in them, for may_touch(). Made again after a change.
+        self.cell_keys = None
+
+    def __len__(self):
+        return len(self.sprite_cells)
+
+    def cell_range(self, left, right, bottom, top):
+        """ All cells covered by a box """
+        size = self.cell_size
+        for column in range(math.floor(left / size), math.floor(right / size) + 1):
+            for row in range(math.floor(bottom / size), math.floor(top / size) + 1):
+                yield column, row
+
+    def add(self, sprite):
+        cells = list(self.cell_range(sprite.left, sprite.right, sprite.bottom, sprite.top))
+        for cell in cells:
+            self.cells.setdefault(cell, []).append(sprite)
+        self.sprite_cells[sprite] = cells
+        self.cell_keys = None
+
+    def add_sprite_list(self, sprite_list):
+        for sprite in sprite_list:
+            self.add(sprite)
+
+    def remove(self, sprite):
+        for cell in self.sprite_cells.pop(sprite, ()):
+            sprites = self.cells[cell]
+            sprites.remove(sprite)
+            if not sprites:
+                del self.cells[cell]
+        self.cell_keys = None
+
+    def nearby(self, sprite):
+        """ Sprites sharing a cell with the sprite. They might not actually touch it """
+        found = {}
+        for cell in self.cell_range(sprite.left, sprite.right, sprite.bottom, sprite.top):
+            for other in self.cells.get(cell, ()):
+                found[other] = None
+        return list(found)
+
+    def check_for_collision(self, sprite):
+        """ Same as arcade.check_for_collision_with_list, but only checks nearby sprites """
+        return [other for other in self.nearby(sprite) if arcade.check_for_collision(sprite, other)]
+
+    def may_touch(self, left, bottom, right, top):
+        """ For arrays of boxes no bigger than a cell: False where a box is sure to touch no sprite.
+        Checks all the boxes at once, so check_for_collision() is only needed where this is True """
+        if self.cell_keys is None:
+            self.cell_keys = numpy.array(sorted(cell_key(column, row) for column, row in self.cells), numpy.int64)
+        if not len(self.cell_keys):
+            return numpy.zeros(len(left), numpy.bool_)
+        size = self.cell_size
+        columns = (numpy.floor(left / size).astype(numpy.int64), numpy.floor(right / size).astype(numpy.int64))
+        rows = (numpy.floor(bottom / size).astype(numpy.int64), numpy.floor(top / size).astype(numpy.int64))
+        # The cells of the four corners, looked up in the sorted cell numbers
+        keys = numpy.stack([cell_key(column, row) for column in columns for row in rows])
+        places = numpy.minimum(numpy.searchsorted(self.cell_keys, keys), len(self.cell_keys) - 1)
+        return (self.cell_keys[places] == keys).any(axis=0)
+
+
+def cell_key(column, row):
+    """ One number for a cell, so cells can be looked up in a NumPy array """
+    return column * 1_000_003 + row
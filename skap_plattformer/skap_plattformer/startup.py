@@ -0,0 +1,147 @@
+# Staged startup for the game window.
+# The window opens first, with a loading screen, and everything else is loaded
+# after that in stages. Stages that don't touch OpenGL (decoding sounds and images)
+# run on loader threads right away. Stages that do (the texture atlas, sprite lists)
+# run on the main thread, between frames of the loading screen. A main thread stage
+# can be a generator: it is then run a step at a time, until the frame has used up
+# its time, so the loading screen keeps drawing.
+#
+# When everything is loaded, the time of every stage is printed, so a slower startup
+# shows up right away.
+
+import arcade, concurrent.futures, time
+from constants import *
+from log import log
+
+# Milliseconds of main thread stages per loading screen frame
+STARTUP_FRAME_BUDGET = 12
+LOADER_THREADS = 2
+
+PROGRESS_BAR_WIDTH = 400
+PROGRESS_BAR_HEIGHT = 24
+
+
+class StartupStage:
+    """ One step of loading, timed from when it started to when it was done """
+
+    def __init__(self, name, function, background=False):
+        self.name = name
+        self.function = function
+        # Run on a loader thread instead of the main thread
+        self.background = background
+
+        self.future = None
+        self.steps = None
+        self.start = None
+        self.end = None
+
+    @property
+    def done(self):
+        return self.end is not None
+
+
+class Startup:
+    """ Runs the loading stages and draws the loading screen until they are done """
+
+    def __init__(self, stages, start_time=None):
+        self.stages = stages
+        # perf_counter when the program started, for the report
+        self.start_time = start_time if start_time is not None else time.perf_counter()
+        # The startup is made right after the window opens
+        self.window_time = time.perf_counter()
+        self.first_frame_time = None
+        self.finished = False
+        # The main thread stage that runs next, stages are run in order
+        self.next_stage = 0
+
+        self.executor = concurrent.futures.ThreadPoolExecutor(LOADER_THREADS, thread_name_prefix="loader")
+        for stage in stages:
+            if stage.background:
+                stage.future = self.executor.submit(self.run_in_background, stage)
+
+        self.label = arcade.Text("", 0, 0, arcade.color.WHITE, 14, anchor_x="center")
+
+    def run_in_background(self, stage):
+        stage.start = time.perf_counter()
+        stage.function()
+        stage.end = time.perf_counter()
+
+    @property
+    def progress(self):
+        return sum(stage.done for stage in self.stages) / len(self.stages)
+
+    def update(self):
+        """ Run main thread stages for up to one frame budget. Returns True once everything is loaded """
+        if self.finished:
+            return True
+        if self.first_frame_time is None:
+            self.first_frame_time = time.perf_counter()
+
+        deadline = time.perf_counter() + STARTUP_FRAME_BUDGET / 1000
+        while self.next_stage < len(self.stages) and time.perf_counter() < deadline:
+            stage = self.stages[self.next_stage]
+            if stage.background:
+                if not stage.future.done():
+                    # Main thread stages after it may need what it loads
+                    return False
+                # Errors on the loader thread are raised here, on the main thread
+                stage.future.result()
+            else:
+                self.step(stage)
+            if stage.done:
+                self.next_stage += 1
+
+        if self.next_stage == len(self.stages):
+            self.finished = True
+            self.executor.shutdown(wait=False)
+            self.print_report()
+        return self.finished
+
+    def step(self, stage):
+        """ Run a main thread stage, or one step of it if it is a generator """
+        if stage.start is None:
+            stage.start = time.perf_counter()
+            stage.steps = stage.function()
+        if stage.steps is not None:
+            try:
+                next(stage.steps)
+                return
+            except StopIteration:
+                pass
+        stage.end = time.perf_counter()
+
+    def current_name(self):
+        for stage in self.stages:
+            if not stage.done:
+                return stage.name
+        return "done"
+
+    def draw(self, width, height):
+        """ The loading screen: a progress bar with the stage that is loading """
+        left = (width - PROGRESS_BAR_WIDTH) / 2
+        bottom = (height - PROGRESS_BAR_HEIGHT) / 2
+        arcade.draw_lrtb_rectangle_filled(left, left + PROGRESS_BAR_WIDTH * self.progress,
+                                          bottom + PROGRESS_BAR_HEIGHT, bottom, arcade.color.WHITE)
+        arcade.draw_lrtb_rectangle_outline(left, left + PROGRESS_BAR_WIDTH, bottom + PROGRESS_BAR_HEIGHT, bottom,
+                                           arcade.color.WHITE, 2)
+        self.label.text = f"Loading {self.current_name()}..."
+        self.label.position = (width / 2, bottom - 30)
+        self.label.draw()
+
+    def report(self):
+        """ Lines with when every stage started and how long it took, in ms from the start of the program """
+        lines = [f"{'stage':<20}{'thread':<8}{'start':>8}{'took':>8}  ms",
+                 f"{'window open':<20}{'main':<8}{(self.window_time - self.start_time) * 1000:>8.0f}"]
+        if self.first_frame_time is not None:
+            lines.append(f"{'first frame':<20}{'main':<8}{(self.first_frame_time - self.start_time) * 1000:>8.0f}")
+        for stage in self.stages:
+            if stage.done:
+                thread = "loader" if stage.background else "main"
+                lines.append(f"{stage.name:<20}{thread:<8}{(stage.start - self.start_time) * 1000:>8.0f}"
+                             f"{(stage.end - stage.start) * 1000:>8.0f}")
+        end = max((stage.end for stage in self.stages if stage.done), default=self.start_time)
+        lines.append(f"{'ready':<20}{'':<8}{(end - self.start_time) * 1000:>8.0f}")
+        return lines
+
+    def print_report(self):
+        log.info("startup", "Startup:\n{}", "\n".join(self.report()))
@@ -0,0 +1,97 @@
+# Splits a physics step into shorter ones when something moves fast towards a wall.
+# Pymunk only looks for collisions where the bodies are at the end of a step, so a body
+# that moves further in one step than a wall is thick can end up on the other side of
+# it: a player pushed down onto a half-height platform, or an item falling on ice.
+#
+# Before a step, every moving body is checked against SUBSTEP_MAX_TRAVEL, the most it may
+# move in one (sub-)step. Only a body that is faster than that looks for walls in the box
+# it sweeps during the step, and only then is the step split, into enough sub-steps that
+# the fastest of those bodies stays under SUBSTEP_MAX_TRAVEL. Walls don't move, so the
+# speed of a body is its speed relative to them. Most steps stay one step and play out
+# exactly as before.
+#
+# Pymunk clears the forces on the bodies after every step, so the forces the game loop put
+# on the players are put back before every sub-step.
+#
+# Pymunk starts every step by pushing the bodies in contact as hard as in the step before,
+# scaled by how much longer this step is. After the last sub-step of a landing, that is
+# the push that stopped the fall, doubled or more, and the item bounces back up as fast
+# as it came. So the steps go on being split for SUBSTEP_SETTLE_STEPS more steps, until
+# only the push of things resting on each other is left.
+
+import math, pymunk
+from constants import *
+
+# Pixels a body near a wall may move in one sub-step, three quarters of a half-height tile. Pymunk pushes
+# a body back out the way it came as long as it is less than halfway through the wall plus half its own height.
+SUBSTEP_MAX_TRAVEL = GRID_PIXEL_SIZE * SPRITE_SCALING_TILES * 3 / 8
+# Most sub-steps a step is split into
+MAX_SUBSTEPS = 8
+# Steps split the same way after the last one that needed it, see above
+SUBSTEP_SETTLE_STEPS = 1
+
+
+def wall_in_the_way(space, shape, offset):
+    """ Whether a static shape is in the box the shape sweeps when it moves by offset """
+    bb = shape.bb
+    offset_x, offset_y = offset
+    swept = pymunk.BB(bb.left + min(offset_x, 0), bb.bottom + min(offset_y, 0),
+                      bb.right + max(offset_x, 0), bb.top + max(offset_y, 0))
+    static_body = space.static_body
+    return any(hit.body is static_body for hit in space.bb_query(swept, pymunk.ShapeFilter()))
+
+
+def substep_count(space, physics_objects, delta_time):
+    """ Sub-steps needed so no body that is going towards a wall moves more than SUBSTEP_MAX_TRAVEL in one """
+    limit = (SUBSTEP_MAX_TRAVEL / delta_time) ** 2
+    # Squared speed of the fastest body that has a wall in the way
+    fastest = 0.0
+    for physics_object in physics_objects:
+        body = physics_object.body
+        velocity = body.velocity
+        speed = velocity.get_length_sqrd()
+        if speed <= limit or speed <= fastest:
+            continue
+        if wall_in_the_way(space, physics_object.shape, velocity * delta_time):
+            fastest = speed
+    if not fastest:
+        return 1
+    return min(MAX_SUBSTEPS, math.ceil(math.sqrt(fastest) * delta_time / SUBSTEP_MAX_TRAVEL))
+
+
+class SubStepper:
+    """ Steps the physics engine, split up when a physics object is going fast towards a wall """
+
+    def __init__(self):
+        # Sub-steps of the last split step, and how many more steps are split like it
+        self.last_count = 1
+        self.settle_steps = 0
+
+    def reset(self):
+        """ For a new pymunk space, it has no contacts left from split steps """
+        self.last_count = 1
+        self.settle_steps = 0
+
+    def step(self, engine, physics_objects, delta_time):
+        """ Step the physics engine by delta_time. The sprites aren't moved. Returns the number of sub-steps """
+        count = substep_count(engine.space, physics_objects, delta_time)
+        if count > 1:
+            self.last_count = count
+            self.settle_steps = SUBSTEP_SETTLE_STEPS
+        elif self.settle_steps:
+            count = self.last_count
+            self.settle_steps -= 1
+        if count == 1:
+            engine.step(delta_time, resync_sprites=False)
+            return 1
+
+        pushed = [(body, body.force, body.torque)
+                  for body in (physics_object.body for physics_object in physics_objects)
+                  if body.force != (0, 0) or body.torque]
+        for number in range(count):
+            if number:
+                for body, force, torque in pushed:
+                    body.force = force
+                    body.torque = torque
+            engine.step(delta_time / count, resync_sprites=False)
+        return count
@@ -0,0 +1,72 @@
+# Loads saves made in the middle of a run and compares how the rest of the run plays out
+# with the run that was never interrupted. Run with: python -m pytest skap_plattformer/tests
+
+import os, sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "skap_plattformer"))
+
+from log import log, WARNING
+from replay import INPUT_RIGHT, set_input_bits
+from savestate import encode, decode
+from simulation import GameSimulation
+
+log.set_level(WARNING)
+
+# Ten seconds of holding right, along the ground of the first level and up a step
+RUN_RIGHT = bytes((INPUT_RIGHT,)) * 600
+
+
+def new_game():
+    game = GameSimulation()
+    game.setup()
+    return game
+
+
+def play(game, inputs):
+    for bits in inputs:
+        set_input_bits(game, bits)
+        game.fixed_update()
+
+
+def save_and_load(game):
+    """ A fresh game that continues from a save of game, written to bytes and read back """
+    loaded = new_game()
+    loaded.load_state(decode(encode(game.save_state())))
+    return loaded
+
+
+def end_of_run(save_step, inputs=RUN_RIGHT):
+    """ Where the player ends up when the run is saved at save_step and the rest is played in a new game """
+    game = new_game()
+    play(game, inputs[:save_step])
+    loaded = save_and_load(game)
+    play(loaded, inputs[save_step:])
+    return tuple(loaded.player.position)
+
+
+def uninterrupted_end(inputs=RUN_RIGHT):
+    game = new_game()
+    play(game, inputs)
+    return tuple(game.player.position)
+
+
+def test_save_before_the_first_step_replays_exactly():
+    assert end_of_run(0) == uninterrupted_end()
+
+
+def test_loaded_save_has_the_saved_state():
+    game = new_game()
+    play(game, RUN_RIGHT[:100])
+    loaded = save_and_load(game)
+    assert encode(loaded.save_state()) == encode(game.save_state())
+
+
+def test_loaded_save_plays_out_the_same_every_time():
+    assert end_of_run(100) == end_of_run(100)
+
+
+@pytest.mark.xfail(strict=True, reason="A loaded save starts in a new pymunk space without the contacts of the "
+                                       "saved game, so it is not replay-exact (see savestate.py)")
+def test_save_made_mid_run_ends_where_the_uninterrupted_run_ends():
+    assert end_of_run(100) == uninterrupted_end()